@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+
+"""Module containing the native Brownian Dynamics (BD) functions used by the BDRun native backend."""
+from typing import Iterator, Optional
+import numpy as np
+from biobb_flexserv.flexserv.contacts import Contacts
+from biobb_flexserv.flexserv.nma import KB, KOVACS_CTE, KOVACS_R0
+
+# Springs only join the CA atoms closer than the cutoff (Angstroms), as the bd binary
+BD_CUTOFF = 12.0
+# Mass (amu) and friction coefficient (1/ps) of the CA beads
+BEAD_MASS = 75.0
+FRICTION = 1.0
+# kcal/(mol A amu) to A/ps^2
+FORCE_UNITS = 418.4
+
+
+def spring_constants(contacts: Contacts, cte: float = KOVACS_CTE, r0: float = KOVACS_R0) -> np.ndarray:
+    """Force constant cte * (r0 / r)^6 kcal/(mol A^2) of the spring of every contact, r being its length in the initial structure."""
+    return cte * (r0 / contacts.distances) ** 6
+
+
+def spring_forces(coords: np.ndarray, contacts: Contacts, force_constants: np.ndarray) -> np.ndarray:
+    """Forces (kcal/(mol A)) of the harmonic springs of the contacts on every atom, as an (atoms, 3) array."""
+    first, second = contacts.first, contacts.second
+    distances = coords[first] - coords[second]
+    lengths = np.sqrt(np.einsum('ij,ij->i', distances, distances))
+    pair_forces = (force_constants * (contacts.distances / lengths - 1.0))[:, np.newaxis] * distances
+    forces = np.empty_like(coords)
+    for axis in range(3):
+        forces[:, axis] = np.bincount(first, pair_forces[:, axis], minlength=len(coords))
+        forces[:, axis] -= np.bincount(second, pair_forces[:, axis], minlength=len(coords))
+    return forces
+
+
+class BDEngine:
+    """
+    | biobb_flexserv BDEngine
+    | Brownian Dynamics of the elastic network of the contacts, the native counterpart of the bd binary.
+    | The whole state of the simulation (positions, velocities, forces, random generator and step) lives in the engine, so it can be pickled into a checkpoint and resumed.
+
+    The equations of motion of the CA beads, coupled to a heat bath by a friction coefficient
+    and a random force, are integrated with the BAOAB Langevin splitting, updating all
+    the beads at once on every step. The starting velocities follow the Maxwell-Boltzmann distribution.
+
+    Args:
+        coords (np.ndarray): Initial (atoms, 3) structure, also the equilibrium structure of the springs.
+        contacts (Contacts): Pairs of atoms joined by a spring.
+        dt (float): Integration time step in ps.
+        temperature (float): (300) Temperature in K.
+        mass (float): (75) Mass of the beads in amu.
+        friction (float): (1) Friction coefficient in 1/ps.
+        seed (int): (None) Seed of the random generator.
+    """
+
+    def __init__(self, coords: np.ndarray, contacts: Contacts, dt: float, temperature: float = 300.0,
+                 mass: float = BEAD_MASS, friction: float = FRICTION, seed: Optional[int] = None) -> None:
+        self.contacts = contacts
+        self.dt = dt
+        self.rng = np.random.default_rng(seed)
+        self.force_constants = spring_constants(contacts)
+        self.thermal_velocity = np.sqrt(KB * temperature * FORCE_UNITS / mass)
+        self.damping = np.exp(-friction * dt)
+        self.noise = self.thermal_velocity * np.sqrt(1.0 - self.damping * self.damping)
+        self.acceleration = FORCE_UNITS / mass
+
+        self.step = 0
+        self.coords = np.array(coords, dtype=np.float64)
+        self.velocities = self.thermal_velocity * self.rng.standard_normal(self.coords.shape)
+        self.forces = spring_forces(self.coords, contacts, self.force_constants)
+
+    def run(self, steps: int, wfreq: int) -> Iterator[np.ndarray]:
+        """Yield a snapshot every wfreq integration steps (counted from the first step of the engine) until steps more steps."""
+        dt, acceleration = self.dt, self.acceleration
+        coords, velocities = self.coords, self.velocities
+        for _ in range(steps):
+            velocities += 0.5 * dt * acceleration * self.forces
+            coords += 0.5 * dt * velocities
+            velocities *= self.damping
+            velocities += self.noise * self.rng.standard_normal(coords.shape)
+            coords += 0.5 * dt * velocities
+            self.forces = spring_forces(coords, self.contacts, self.force_constants)
+            velocities += 0.5 * dt * acceleration * self.forces
+            self.step += 1
+            if not self.step % wfreq:
+                yield coords.copy()
+
+
+def brownian_dynamics(coords: np.ndarray, contacts: Contacts, steps: int, dt: float, wfreq: int,
+                      temperature: float = 300.0, mass: float = BEAD_MASS, friction: float = FRICTION,
+                      seed: Optional[int] = None) -> Iterator[np.ndarray]:
+    """Yield a snapshot every wfreq integration steps of a BD trajectory of the elastic network of the contacts, see BDEngine."""
+    yield from BDEngine(coords, contacts, dt, temperature, mass, friction, seed).run(steps, wfreq)
@@ -3,8 +3,17 @@
 """Module containing the bd_run class and the command line interface."""
 from typing import Optional
 from pathlib import Path
+from biobb_common.tools import file_utils as fu
 from biobb_common.generic.biobb_object import BiobbObject
 from biobb_common.tools.file_utils import launchlogger
+from biobb_flexserv.flexserv import replicas
+from biobb_flexserv.flexserv import bd
+from biobb_flexserv.flexserv.checkpoint import Checkpoint, FRAMES_SUFFIX
+from biobb_flexserv.flexserv.contacts import Contacts
+from biobb_flexserv.flexserv.ensemble import EnsembleWriter, read_ca_atoms
+from biobb_flexserv.flexserv.nma import read_ca_coords
+from biobb_flexserv.flexserv.progress import ProgressMonitor
+from biobb_flexserv.pcasuite.fitting import center
 
 
 class BDRun(BiobbObject):
@@ -16,12 +25,25 @@ class BDRun(BiobbObject):
     Args:
         input_pdb_path (str): Input PDB file. File type: input. `Sample file <https://github.com/bioexcel/biobb_flexserv/raw/master/biobb_flexserv/test/data/flexserv/structure.ca.pdb>`_. Accepted formats: pdb (edam:format_1476).
         output_log_path (str): Output log file. File type: output. `Sample file <https://github.com/bioexcel/biobb_flexserv/raw/master/biobb_flexserv/test/reference/flexserv/bd_run_out.log>`_. Accepted formats: log (edam:format_2330), out (edam:format_2330), txt (edam:format_2330), o (edam:format_2330).
-        output_crd_path (str): Output ensemble. File type: output. `Sample file <https://github.com/bioexcel/biobb_flexserv/raw/master/biobb_flexserv/test/reference/flexserv/bd_run_out.crd>`_. Accepted formats: crd (edam:format_3878), mdcrd (edam:format_3878), inpcrd (edam:format_3878).
+        output_crd_path (str) (Optional): Output ensemble, needed by the bd binary. File type: output. `Sample file <https://github.com/bioexcel/biobb_flexserv/raw/master/biobb_flexserv/test/reference/flexserv/bd_run_out.crd>`_. Accepted formats: crd (edam:format_3878), mdcrd (edam:format_3878), inpcrd (edam:format_3878).
+        output_index_path (str) (Optional): Output per-replica frame index of the merged ensemble, with the seed and the frame range of every replica. File type: output. `Sample file <https://github.com/bioexcel/biobb_flexserv/raw/master/biobb_flexserv/test/reference/flexserv/bd_run_index.json>`_. Accepted formats: json (edam:format_3464).
+        output_pcz_path (str) (Optional): Output ensemble compressed with the native PCA engine, written without the intermediate CRD file (fused mode, native backend). File type: output. `Sample file <https://github.com/bioexcel/biobb_flexserv/raw/master/biobb_flexserv/test/reference/pcasuite/pcazip.pcz>`_. Accepted formats: pcz (edam:format_3874).
+        output_checkpoint_path (str) (Optional): Output checkpoint of the simulation (native backend), read back to continue it when resume is set. With output_pcz_path the frames of the PCZ file are kept next to it in a .frames file. File type: output. Accepted formats: chk (edam:format_2333).
+        output_metrics_path (str) (Optional): Output progress and throughput metrics of the run (frames written, frames per second, ETA, output size), rewritten every progress_interval seconds. File type: output. Accepted formats: json (edam:format_3464).
         properties (dict - Python dictionary object containing the tool parameters, not input/output files):
             * **binary_path** (*str*) - ("bd") BD binary path to be used.
             * **time** (*int*) - (1000000) Total simulation time (ps)
             * **dt** (*float*) - (1e-15) Integration time (ps)
             * **wfreq** (*int*) - (1000) Writing frequency (ps)
+            * **backend** (*str*) - ("bd") Engine used to run the simulation: bd Fortran binary or in-process vectorized NumPy integrator with the same elastic network (Options: bd, native)
+            * **seed** (*int*) - (None) Seed of the random generator used by the native backend. Replica i uses seed + i.
+            * **replicas** (*int*) - (1) Number of independent seeded replicas merged into the output ensemble, only with the native backend.
+            * **n_workers** (*int*) - (1) Number of processes running replicas concurrently.
+            * **neigenv** (*int*) - (0) Fused mode: number of eigenvectors of the output PCZ file.
+            * **variance** (*int*) - (90) Fused mode: percentage of variance captured by the eigenvectors of the output PCZ file.
+            * **checkpoint_freq** (*int*) - (100) Number of frames between checkpoints, only the final checkpoint if 0.
+            * **resume** (*bool*) - (False) Continue the simulation from the output checkpoint if it exists, appending the new frames to the outputs, until the total simulation time (which can be extended).
+            * **progress_interval** (*float*) - (60) Seconds between the progress reports (frames written, frames per second, ETA and output size) in the log and the metrics file, only the final report if 0.
             * **remove_tmp** (*bool*) - (True) [WF property] Remove temporal files.
             * **restart** (*bool*) - (False) [WF property] Do not execute if output files exist.
             * **sandbox_path** (*str*) - ("./") [WF property] Parent path to the sandbox directory.
@@ -50,7 +72,9 @@ class BDRun(BiobbObject):
     """
 
     def __init__(self, input_pdb_path: str, output_log_path: str,
-                 output_crd_path: str, properties: Optional[dict] = None, **kwargs) -> None:
+                 output_crd_path: Optional[str] = None, output_index_path: Optional[str] = None,
+                 output_pcz_path: Optional[str] = None, output_checkpoint_path: Optional[str] = None,
+                 output_metrics_path: Optional[str] = None, properties: Optional[dict] = None, **kwargs) -> None:
 
         properties = properties or {}
 
@@ -62,7 +86,11 @@ class BDRun(BiobbObject):
         self.io_dict = {
             'in': {'input_pdb_path': input_pdb_path},
             'out': {'output_log_path': output_log_path,
-                    'output_crd_path': output_crd_path}
+                    'output_crd_path': output_crd_path,  # type: ignore
+                    'output_index_path': output_index_path,  # type: ignore
+                    'output_pcz_path': output_pcz_path,  # type: ignore
+                    'output_checkpoint_path': output_checkpoint_path,  # type: ignore
+                    'output_metrics_path': output_metrics_path}  # type: ignore
         }
 
         # Properties specific for BB
@@ -71,11 +99,100 @@ class BDRun(BiobbObject):
         self.time = properties.get('time', 1000000)
         self.dt = properties.get('dt', 1e-15)
         self.wfreq = properties.get('wfreq', 1000)
+        self.backend = properties.get('backend', 'bd')
+        self.seed = properties.get('seed', None)
+        self.replicas = properties.get('replicas', 1)
+        self.n_workers = properties.get('n_workers', 1)
+        self.neigenv = properties.get('neigenv', 0)
+        self.variance = properties.get('variance')
+        self.checkpoint_freq = properties.get('checkpoint_freq', 100)
+        self.resume = properties.get('resume', False)
+        self.progress_interval = properties.get('progress_interval', 60)
 
         # Check the properties
         self.check_properties(properties)
         self.check_arguments()
 
+    def launch_native(self):
+        """Runs the Brownian Dynamics simulation in-process with NumPy, writing the snapshots through a buffered CRD writer or compressing them into PCZ."""
+
+        coords = center(read_ca_coords(self.io_dict["in"]["input_pdb_path"]))
+        contacts = Contacts(coords, bd.BD_CUTOFF)
+        # The bd binary takes the time step in seconds, the integrator in ps
+        dt = float(self.dt) * 1e12
+        output_log_path = self.io_dict["out"]["output_log_path"]
+        output_crd_path = self.io_dict["out"].get("output_crd_path")
+        output_pcz_path = self.io_dict["out"].get("output_pcz_path")
+        output_checkpoint_path = self.io_dict["out"].get("output_checkpoint_path")
+        # Frames of the fused mode PCZ file, kept next to the checkpoint to resume
+        frames_path = output_checkpoint_path + FRAMES_SUFFIX if output_checkpoint_path and output_pcz_path else None
+        checkpoint = None
+        state = None
+        if output_checkpoint_path:
+            checkpoint = Checkpoint(output_checkpoint_path, int(self.checkpoint_freq),
+                                    settings={'natoms': len(coords), 'dt': dt, 'wfreq': int(self.wfreq)},
+                                    outputs={'log': output_log_path, 'crd': output_crd_path, 'pcz_frames': frames_path})
+            state = checkpoint.load() if self.resume else None
+
+        if state:
+            engine = state['engine']
+            frames = state['frames']
+            fu.log('Resuming from checkpoint %s at step %d (%d frames)' % (output_checkpoint_path, engine.step, frames), self.out_log)
+        else:
+            engine = bd.BDEngine(coords, contacts, dt, seed=self.seed)
+            frames = 0
+            with open(output_log_path, 'w') as log_file:
+                log_file.write(' Applied%13.7f      A cutoff, %12d  pairs\n' % (bd.BD_CUTOFF, len(contacts)))
+                log_file.write(' Beginning trajectory for %12d  atoms\n' % len(coords))
+        steps = max(0, int(self.time) - engine.step)
+        fu.log('Running %d BD steps of %g ps for %d CA atoms and %d springs' % (steps, dt, len(coords), len(contacts)), self.out_log)
+
+        with ProgressMonitor(int(self.time) // int(self.wfreq), self.progress_interval, outputs=[output_log_path, output_crd_path, output_pcz_path],
+                             output_metrics_path=self.io_dict["out"].get("output_metrics_path"),
+                             frames=frames, out_log=self.out_log) as monitor, \
+                open(output_log_path, 'a') as log_file, \
+                EnsembleWriter(len(coords), output_crd_path, output_pcz_path,
+                               atoms=read_ca_atoms(self.io_dict["in"]["input_pdb_path"]), neigenv=self.neigenv, variance=self.variance,
+                               append=bool(state), frames_path=frames_path) as ensemble:
+            for snapshot in engine.run(steps, int(self.wfreq)):
+                ensemble.write(snapshot)
+                frames += 1
+                monitor.update(frames)
+                if checkpoint:
+                    checkpoint.update(engine, frames, ensemble, log_file)
+            if checkpoint:
+                checkpoint.save(engine, frames, ensemble, log_file)
+        if ensemble.compression:
+            fu.log('Ensemble compressed into PCZ: %d eigenvectors kept, %.2f%% of the total variance' % (ensemble.compression[0], 100 * ensemble.compression[1]), self.out_log)
+
+        self.check_arguments(output_files_created=True, raise_exception=False)
+
+        return self.return_code
+
+    def launch_replicas(self):
+        """Runs independent seeded replicas in a pool of processes and merges them into a single ensemble."""
+
+        if self.backend != 'native':
+            raise SystemExit('The bd binary has no seed argument, replicas need the native backend')
+        if self.io_dict["out"].get("output_checkpoint_path"):
+            raise SystemExit('Checkpoints of replicas are not supported, please checkpoint every replica as a separate run')
+        seeds = replicas.replica_seeds(self.seed, self.replicas)
+        fu.log('Running %d replicas with seeds %d-%d in %d processes' % (self.replicas, seeds[0], seeds[-1], self.n_workers), self.out_log)
+        # The replicas run silently, only their total throughput is reported
+        total_frames = self.replicas * int(self.time) // int(self.wfreq)
+        with ProgressMonitor(total_frames, self.progress_interval,
+                             outputs=[self.io_dict["out"]["output_log_path"], self.io_dict["out"].get("output_crd_path"), self.io_dict["out"].get("output_pcz_path")],
+                             output_metrics_path=self.io_dict["out"].get("output_metrics_path"), out_log=self.out_log) as monitor:
+            self.tmp_files.extend(replicas.run_replicas(BDRun, self.io_dict, self.properties, seeds,
+                                                        self.n_workers, str(self.sandbox_path), self.out_log))
+            monitor.update(total_frames)
+
+        # Remove temporary folder(s)
+        self.remove_tmp_files()
+        self.check_arguments(output_files_created=True, raise_exception=False)
+
+        return self.return_code
+
     @launchlogger
     def launch(self):
         """Launches the execution of the FlexServ BDRun module."""
@@ -83,6 +200,18 @@ class BDRun(BiobbObject):
         # Setup Biobb
         if self.check_restart():
             return 0
+
+        if self.replicas > 1:
+            return self.launch_replicas()
+
+        if self.backend == 'native':
+            return self.launch_native()
+
+        if not self.io_dict["out"].get("output_crd_path") or self.io_dict["out"].get("output_pcz_path"):
+            raise SystemExit('The bd binary writes a CRD file: output_crd_path is needed and output_pcz_path needs the native backend')
+        if self.io_dict["out"].get("output_checkpoint_path"):
+            raise SystemExit('The bd binary has no checkpoints, output_checkpoint_path needs the native backend')
+
         self.stage_files()
 
         # Internal file paths
@@ -111,8 +240,13 @@ class BDRun(BiobbObject):
                     '>', output_log
                     ]
 
-        # Run Biobb block
-        self.run_biobb()
+        # Run Biobb block, reporting the frames written by the binary
+        with ProgressMonitor(int(self.time) // int(self.wfreq), self.progress_interval,
+                             outputs=[self.stage_io_dict["out"]["output_crd_path"], self.stage_io_dict["out"]["output_log_path"]],
+                             output_metrics_path=self.io_dict["out"].get("output_metrics_path"),
+                             poll_crd_path=self.stage_io_dict["out"]["output_crd_path"],
+                             natoms=len(read_ca_coords(self.io_dict["in"]["input_pdb_path"])), out_log=self.out_log):
+            self.run_biobb()
 
         # Copy files to host
         self.copy_to_host()
@@ -125,7 +259,9 @@ class BDRun(BiobbObject):
 
 
 def bd_run(input_pdb_path: str,
-           output_log_path: str, output_crd_path: str,
+           output_log_path: str, output_crd_path: Optional[str] = None,
+           output_index_path: Optional[str] = None, output_pcz_path: Optional[str] = None,
+           output_checkpoint_path: Optional[str] = None, output_metrics_path: Optional[str] = None,
            properties: Optional[dict] = None, **kwargs) -> int:
     """Create :class:`BDRun <flexserv.bd_run.BDRun>`flexserv.bd_run.BDRun class and
     execute :meth:`launch() <flexserv.bd_run.BDRun.launch>` method"""
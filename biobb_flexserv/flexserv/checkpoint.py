@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+
+"""Module containing the Checkpoint class, periodic checkpoints and resume of the simulations of the native FlexServ runners."""
+import os
+import pickle
+from pathlib import Path
+from typing import IO, Optional
+from biobb_flexserv.flexserv.ensemble import EnsembleWriter
+
+CHECKPOINT_VERSION = 2
+# Suffix of the file next to the checkpoint where the frames of the PCZ file are spilled
+FRAMES_SUFFIX = '.frames'
+
+
+class Checkpoint:
+    """
+    | biobb_flexserv Checkpoint
+    | Periodic checkpoints of a native simulation (engine state, frame count and size of the outputs) and resume from the last one.
+    | The engine (BDEngine or DMDEngine) is pickled with its positions, velocities and random generator, so a resumed simulation continues exactly as the uninterrupted one.
+
+    Every checkpoint replaces the previous one atomically, a job killed while writing it
+    keeps the last complete checkpoint. When resuming, the outputs are truncated to their
+    size at the checkpoint (dropping the frames written after it, which are generated again)
+    and the new frames are appended. In fused mode the frames of the PCZ file are
+    spilled next to the checkpoint (FRAMES_SUFFIX), an output rewound by size like the others.
+    Checkpoints are pickle files: only resume from checkpoints written by yourself.
+
+    Args:
+        checkpoint_path (str): Checkpoint file.
+        freq (int): (0) Number of frames between checkpoints, only the final checkpoint if 0.
+        settings (dict): (None) Settings of the simulation that must not change to resume it.
+        outputs (dict): (None) Output files of the simulation by name, None if not written.
+    """
+
+    def __init__(self, checkpoint_path: str, freq: int = 0, settings: Optional[dict] = None,
+                 outputs: Optional[dict] = None) -> None:
+        self.checkpoint_path = checkpoint_path
+        self.freq = freq
+        self.outputs = {name: path for name, path in (outputs or {}).items() if path}
+        # The set of outputs written can not change either
+        self.settings = dict(settings or {}, outputs=sorted(self.outputs))
+
+    def load(self) -> Optional[dict]:
+        """State saved by the last checkpoint after rewinding the outputs to it, None if there is no checkpoint yet."""
+        if not Path(self.checkpoint_path).exists():
+            return None
+        with open(self.checkpoint_path, 'rb') as checkpoint_file:
+            state = pickle.load(checkpoint_file)
+        if not isinstance(state, dict) or state.get('version') != CHECKPOINT_VERSION:
+            raise SystemExit('%s is not a valid checkpoint file' % self.checkpoint_path)
+        changed = sorted(key for key in self.settings if state['settings'].get(key) != self.settings[key])
+        if changed:
+            raise SystemExit('Cannot resume from %s: %s changed since the checkpoint' % (self.checkpoint_path, ', '.join(changed)))
+
+        for name, path in self.outputs.items():
+            size = state['sizes'][name]
+            if not Path(path).exists() or os.path.getsize(path) < size:
+                raise SystemExit('Cannot resume from %s: %s is missing or shorter than at the checkpoint' % (self.checkpoint_path, path))
+            os.truncate(path, size)
+        return state
+
+    def save(self, engine, frames: int, ensemble: EnsembleWriter, log_file: IO) -> None:
+        """Flush the outputs and save the state of the engine after the given number of frames."""
+        ensemble.flush()
+        log_file.flush()
+        state = {'version': CHECKPOINT_VERSION, 'settings': self.settings, 'engine': engine, 'frames': frames,
+                 'sizes': {name: os.path.getsize(path) for name, path in self.outputs.items()}}
+        tmp_path = self.checkpoint_path + '.tmp'
+        with open(tmp_path, 'wb') as checkpoint_file:
+            pickle.dump(state, checkpoint_file, protocol=pickle.HIGHEST_PROTOCOL)
+            checkpoint_file.flush()
+            os.fsync(checkpoint_file.fileno())
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def update(self, engine, frames: int, ensemble: EnsembleWriter, log_file: IO) -> None:
+        """Save a checkpoint every freq frames."""
+        if self.freq and not frames % self.freq:
+            self.save(engine, frames, ensemble, log_file)
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+
+"""Module containing the Contacts class, a cell list neighbour list builder for the FlexServ elastic network methods."""
+import numpy as np
+
+# Half shell of neighbour cells: every pair of neighbouring cells is visited only once
+HALF_SHELL = np.array([(dx, dy, dz) for dx in (-1, 0, 1) for dy in (-1, 0, 1) for dz in (-1, 0, 1)
+                       if (dx, dy, dz) > (0, 0, 0)] + [(0, 0, 0)])
+
+
+class Contacts:
+    """
+    | biobb_flexserv Contacts
+    | Neighbour list of the atom pairs closer than a cutoff, built in O(N) with a cell list.
+    | Stored in compressed sparse row (CSR) layout: the neighbours j > i of atom i are indices[indptr[i]:indptr[i + 1]].
+
+    The atoms are binned in cubic cells of at least cutoff side, so only the atoms of the
+    same or neighbouring cells are compared, in vectorized NumPy blocks per cell offset.
+
+    Args:
+        coords (np.ndarray): Coordinates of the atoms as an (atoms, 3) array.
+        cutoff (float): Distance cutoff in Angstroms.
+        min_separation (int): (1) Minimum distance between atom indices, 2 skips the consecutive (bonded) CA atoms.
+    """
+
+    def __init__(self, coords: np.ndarray, cutoff: float, min_separation: int = 1) -> None:
+        self.natoms = len(coords)
+        self.cutoff = cutoff
+        first, second = cell_list_pairs(np.asarray(coords, dtype=np.float64), cutoff)
+
+        keep = second - first >= min_separation
+        first, second = first[keep], second[keep]
+        order = np.lexsort((second, first))
+        first, second = first[order], second[order]
+
+        self.indptr = np.zeros(self.natoms + 1, dtype=np.int64)
+        np.cumsum(np.bincount(first, minlength=self.natoms), out=self.indptr[1:])
+        self.indices = second
+        self._first = first
+        self.distances = np.linalg.norm(coords[first] - coords[second], axis=1)
+
+    def __len__(self) -> int:
+        return len(self.indices)
+
+    @property
+    def first(self) -> np.ndarray:
+        """First atom of every pair (row indices of the CSR layout)."""
+        return self._first
+
+    @property
+    def second(self) -> np.ndarray:
+        """Second atom of every pair, always larger than the first one."""
+        return self.indices
+
+    def neighbours(self, atom: int) -> np.ndarray:
+        """Neighbours of the atom with a larger index."""
+        return self.indices[self.indptr[atom]:self.indptr[atom + 1]]
+
+
+def cell_list_pairs(coords: np.ndarray, cutoff: float) -> tuple[np.ndarray, np.ndarray]:
+    """Pairs of atoms (i < j) closer than cutoff, as two index arrays."""
+    natoms = len(coords)
+    origin = coords.min(axis=0)
+    extent = coords.max(axis=0) - origin
+    # Cells of at least cutoff side, larger if needed to keep the grid in the order of the number of atoms
+    cell_side = max(cutoff, float(np.prod(extent + cutoff) / (8 * natoms + 1)) ** (1 / 3))
+    grid = (extent // cell_side).astype(np.int64) + 1
+    cells = ((coords - origin) // cell_side).astype(np.int64)
+
+    # Atoms sorted by cell, with the first position and number of atoms of every cell
+    cell_ids = np.ravel_multi_index(cells.T, grid)
+    order = np.argsort(cell_ids, kind='stable')
+    counts = np.bincount(cell_ids, minlength=int(np.prod(grid)))
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+
+    first_list, second_list = [], []
+    squared_cutoff = cutoff * cutoff
+    for offset in HALF_SHELL:
+        neighbour_cells = cells + offset
+        inside = np.all((neighbour_cells >= 0) & (neighbour_cells < grid), axis=1)
+        atoms = np.flatnonzero(inside)
+        neighbour_ids = np.ravel_multi_index(neighbour_cells[inside].T, grid)
+
+        # Every atom against all the atoms of its neighbour cell
+        repeats = counts[neighbour_ids]
+        first = np.repeat(atoms, repeats)
+        positions = np.arange(len(first)) - np.repeat(np.cumsum(repeats) - repeats, repeats)
+        second = order[np.repeat(starts[neighbour_ids], repeats) + positions]
+
+        close = np.sum((coords[first] - coords[second]) ** 2, axis=1) < squared_cutoff
+        if not offset.any():
+            # Same cell: every pair appears twice and every atom with itself
+            close &= first < second
+        first, second = first[close], second[close]
+        first_list.append(np.minimum(first, second))
+        second_list.append(np.maximum(first, second))
+
+    return np.concatenate(first_list), np.concatenate(second_list)
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+
+"""Module containing the CRDfile and CRDWriter classes and the write_crd function, native Amber CRD trajectory I/O."""
+from typing import Optional, Union
+import numpy as np
+
+FIELD_WIDTH = 8
+FIELDS_PER_LINE = 10
+LINE_WIDTH = FIELD_WIDTH * FIELDS_PER_LINE
+NEWLINE = ord('\n')
+
+
+def frame_size(natoms: int) -> int:
+    """Number of bytes of a CRD frame: 3 x atoms 8.3f fields, 10 per line, every line ended by a newline."""
+    ncoords = 3 * natoms
+    return ncoords * FIELD_WIDTH + -(-ncoords // FIELDS_PER_LINE)
+
+
+def field_columns(natoms: int) -> np.ndarray:
+    """Byte positions inside a CRD frame of the 8 characters of every coordinate, as a (3 x atoms, 8) array."""
+    coords = np.arange(3 * natoms)
+    starts = coords * FIELD_WIDTH + coords // FIELDS_PER_LINE
+    return starts[:, np.newaxis] + np.arange(FIELD_WIDTH)
+
+
+class CRDfile:
+    """
+    | biobb_flexserv CRDfile
+    | Native reader for Amber CRD trajectories such as the ones generated by the FlexServ BD, DMD and NMA runners.
+    | Decodes the fixed-width coordinate records directly into (frames, atoms, 3) float32 NumPy arrays.
+
+    The file is memory-mapped and every frame has the same size in bytes, so slicing
+    or striding the trajectory only reads and parses the selected frames.
+
+    CRD layout:
+
+        * Title: one line of free text.
+        * One record per frame: 3 x atoms coordinates (x1, y1, z1, x2...) written as 8.3f fields, 10 per line, the last line of the frame may be shorter.
+
+    Args:
+        input_crd_path (str): Input trajectory file.
+        natoms (int): (None) Number of atoms of the trajectory. If not given, it is guessed from the length of the first line shorter than 80 characters.
+        mmap (bool): (True) Memory-map the file instead of reading it into memory.
+    """
+
+    def __init__(self, input_crd_path: str, natoms: Optional[int] = None, mmap: bool = True) -> None:
+        self.input_crd_path = input_crd_path
+
+        data: np.ndarray
+        if mmap:
+            data = np.memmap(input_crd_path, dtype=np.uint8, mode='r')
+        else:
+            data = np.fromfile(input_crd_path, dtype=np.uint8)
+
+        newlines = np.flatnonzero(data[:min(data.size, 64 * 1024 * 1024)] == NEWLINE)
+        if not newlines.size:
+            raise ValueError('%s is not a valid CRD file: missing title line' % input_crd_path)
+        self.title = data[:newlines[0]].tobytes().decode('ascii', errors='replace')
+        offset = int(newlines[0]) + 1
+
+        self.natoms = natoms or self.guess_natoms(newlines)
+        self.frame_size = frame_size(self.natoms)
+        body_size = data.size - offset
+        if body_size % self.frame_size:
+            raise ValueError('%s is not a valid CRD file for %d atoms: %d bytes do not fit in frames of %d bytes' %
+                             (input_crd_path, self.natoms, body_size, self.frame_size))
+        self.nframes = body_size // self.frame_size
+
+        self._frames = data[offset:].reshape(self.nframes, self.frame_size)
+        self._columns = field_columns(self.natoms)
+        if self.nframes and not np.all(self._frames[0, self._columns[FIELDS_PER_LINE - 1::FIELDS_PER_LINE, -1] + 1] == NEWLINE):
+            raise ValueError('%s is not a valid CRD file: lines are not %d characters wide' % (input_crd_path, LINE_WIDTH))
+
+    def guess_natoms(self, newlines: np.ndarray) -> int:
+        """Number of atoms from the first short line (the last line of the first frame)."""
+        lengths = np.diff(newlines)[:1000] - 1
+        short = np.flatnonzero(lengths < LINE_WIDTH)
+        if not short.size or lengths[short[0]] % FIELD_WIDTH:
+            raise ValueError('Number of atoms of %s cannot be guessed, please provide it' % self.input_crd_path)
+        ncoords = short[0] * FIELDS_PER_LINE + lengths[short[0]] // FIELD_WIDTH
+        if ncoords % 3:
+            raise ValueError('Number of atoms of %s cannot be guessed, please provide it' % self.input_crd_path)
+        return int(ncoords // 3)
+
+    def __len__(self) -> int:
+        return self.nframes
+
+    def __getitem__(self, frames: Union[int, slice]) -> np.ndarray:
+        if isinstance(frames, slice):
+            return self.read(frames.start, frames.stop, frames.step)
+        if not -self.nframes <= frames < self.nframes:
+            raise IndexError('Frame %d out of range (%d frames)' % (frames, self.nframes))
+        frame = frames % self.nframes
+        return self.read(frame, frame + 1)[0]
+
+    def read(self, start: Optional[int] = None, stop: Optional[int] = None, step: Optional[int] = None) -> np.ndarray:
+        """Coordinates of the selected frames (Python slice semantics) as a (frames, atoms, 3) float32 array."""
+        frames = self._frames[start:stop:step]
+        coords = np.empty((len(frames), self.natoms, 3), dtype=np.float32)
+        # Parse by blocks of frames to bound the size of the temporary arrays
+        chunk_size = max(1, 4 * 1024 * 1024 // self.frame_size)
+        for chunk in range(0, len(frames), chunk_size):
+            fields = frames[chunk:chunk + chunk_size][:, self._columns]
+            coords[chunk:chunk + chunk_size] = parse_fields(fields).reshape(-1, self.natoms, 3)
+        return coords
+
+    def iter_chunks(self, chunk_size: int = 1000, step: int = 1):
+        """Yield the coordinates in blocks of at most chunk_size frames, to handle trajectories larger than memory."""
+        for start in range(0, self.nframes, chunk_size * step):
+            yield self.read(start, min(start + chunk_size * step, self.nframes), step)
+
+
+def parse_fields(fields: np.ndarray) -> np.ndarray:
+    """Convert an array of 8.3f fields given as (..., 8) ASCII bytes into float32 values."""
+    if not np.all(fields[..., 4] == ord('.')):
+        # Not a plain 8.3f field somewhere, let NumPy parse the strings
+        return np.ascontiguousarray(fields).view('S%d' % FIELD_WIDTH)[..., 0].astype(np.float32)
+    thousandths = np.zeros(fields.shape[:-1], dtype=np.int32)
+    negative = np.zeros(fields.shape[:-1], dtype=bool)
+    for position, power in enumerate((1000000, 100000, 10000, 1000, 0, 100, 10, 1)):
+        char = fields[..., position]
+        if power:
+            digit = char - np.uint8(ord('0'))
+            thousandths += np.where(digit < 10, digit, 0).astype(np.int32) * power
+        if position < 4:
+            negative |= char == ord('-')
+    values = thousandths / np.float32(1000)
+    return np.where(negative, -values, values).astype(np.float32)
+
+
+def format_fields(coords: np.ndarray) -> np.ndarray:
+    """Convert an array of values into 8.3f fields given as (..., 8) ASCII bytes.
+
+    Values are rounded as float32, for which the product by 1000 in float64 is exact, so
+    the fields are identical to the ones written by printf("%8.3f").
+    """
+    coords = np.asarray(coords, dtype=np.float32)
+    if not np.all(np.isfinite(coords)):
+        raise ValueError('NaN or infinite coordinates cannot be written in the CRD 8.3f format')
+    negative = np.signbit(coords)
+    thousandths = np.rint(np.abs(coords.astype(np.float64)) * 1000)
+    if np.any(thousandths >= 9999999.5) or np.any(negative & (thousandths >= 999999.5)):
+        raise ValueError('Coordinates out of the range of the CRD 8.3f format')
+    thousandths = thousandths.astype(np.int32)
+
+    fields = np.empty(coords.shape + (FIELD_WIDTH,), dtype=np.uint8)
+    # The minus sign goes right before the first digit of the integer part
+    sign_position = 2 - (thousandths >= 10000).astype(np.int32) - (thousandths >= 100000) - (thousandths >= 1000000)
+    for position, power in enumerate((1000000, 100000, 10000, 1000, 0, 100, 10, 1)):
+        if not power:
+            fields[..., position] = ord('.')
+            continue
+        digit = (thousandths // power % 10).astype(np.uint8) + np.uint8(ord('0'))
+        if position < 3:
+            # Leading zeros of the integer part are blanks
+            digit = np.where(thousandths >= power, digit, np.uint8(ord(' ')))
+        fields[..., position] = digit
+    for position in range(3):
+        fields[..., position][negative & (sign_position == position)] = ord('-')
+    return fields
+
+
+class CRDWriter:
+    """
+    | biobb_flexserv CRDWriter
+    | Buffered writer for Amber CRD trajectories, used by the native runners to output their snapshots.
+    | Frames are stored in a float32 buffer and formatted and written in blocks when the buffer is full.
+
+    Args:
+        output_crd_path (str): Output trajectory file.
+        natoms (int): Number of atoms of the trajectory.
+        title (str): ('') Title line, not written when appending.
+        append (bool): (False) Add the frames to the end of an existing trajectory.
+        buffer_size (int): (1000) Number of frames kept in memory before writing them.
+    """
+
+    def __init__(self, output_crd_path: str, natoms: int, title: str = '', append: bool = False, buffer_size: int = 1000) -> None:
+        self.natoms = natoms
+        self.frame_size = frame_size(natoms)
+        self._columns = field_columns(natoms)
+        # Newlines go after every 10th field and after the last field of the frame
+        self._line_ends = np.append(self._columns[FIELDS_PER_LINE - 1::FIELDS_PER_LINE, -1] + 1, self.frame_size - 1)
+        self._buffer = np.empty((max(1, buffer_size), 3 * natoms), dtype=np.float32)
+        self._buffered = 0
+        self.nframes = 0
+
+        self._crd_file = open(output_crd_path, 'ab' if append else 'wb')
+        if not append:
+            self._crd_file.write(('%s\n' % title).encode('ascii'))
+
+    def __enter__(self) -> 'CRDWriter':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def write(self, coords: np.ndarray) -> None:
+        """Add a (frames, atoms, 3) block of frames, or a single (atoms, 3) frame, to the trajectory."""
+        coords = np.asarray(coords).reshape(-1, 3 * self.natoms)
+        while len(coords):
+            count = min(len(coords), len(self._buffer) - self._buffered)
+            self._buffer[self._buffered:self._buffered + count] = coords[:count]
+            self._buffered += count
+            self.nframes += count
+            coords = coords[count:]
+            if self._buffered == len(self._buffer):
+                self.flush()
+
+    def flush(self) -> None:
+        """Format and write the buffered frames."""
+        if self._buffered:
+            frames = np.empty((self._buffered, self.frame_size), dtype=np.uint8)
+            frames[:, self._columns] = format_fields(self._buffer[:self._buffered])
+            frames[:, self._line_ends] = NEWLINE
+            self._crd_file.write(frames.tobytes())
+            self._buffered = 0
+        self._crd_file.flush()
+
+    def close(self) -> None:
+        """Write the remaining frames and close the file."""
+        if not self._crd_file.closed:
+            self.flush()
+            self._crd_file.close()
+
+
+def write_crd(output_crd_path: str, coords: np.ndarray, title: str = '', append: bool = False, chunk_size: int = 1000) -> None:
+    """Write a (frames, atoms, 3) coordinates array as an Amber CRD trajectory.
+
+    Args:
+        output_crd_path (str): Output trajectory file.
+        coords (np.ndarray): Coordinates in Angstroms, a single (atoms, 3) frame is also accepted.
+        title (str): ('') Title line, not written when appending.
+        append (bool): (False) Add the frames to the end of an existing trajectory.
+        chunk_size (int): (1000) Number of frames formatted at once.
+    """
+    coords = np.asarray(coords)
+    with CRDWriter(output_crd_path, coords.shape[-2], title=title, append=append, buffer_size=chunk_size) as writer:
+        writer.write(coords)
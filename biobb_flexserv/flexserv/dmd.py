@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+
+"""Module containing the native event-driven Discrete Molecular Dynamics (DMD) engine used by the DMDRun native backend."""
+import heapq
+from typing import Iterator, Optional
+import numpy as np
+from biobb_flexserv.flexserv.contacts import Contacts
+from biobb_flexserv.flexserv.nma import KB
+
+# Go contacts: pairs of CA atoms closer than RCUTGO (A) in the native structure, consecutive atoms excluded
+RCUTGO = 8.0
+# Relative half width of the square wells of the consecutive CA atoms (SIGMA) and of the Go contacts (SIGMAGO)
+SIGMA = 0.05
+SIGMAGO = 0.1
+# Relative half width of the hard walls keeping the consecutive CA atoms bonded out of their wells
+TETHER = 0.3
+# Hard sphere radius (A) of the CA atoms not joined by a square well
+RCA = 0.5
+# Depth (kcal/mol) of the square wells of the consecutive CA atoms (DEPTH) and of the Go contacts (DEPTHGO):
+# pairs with more kinetic energy along their distance escape them
+DEPTH = 2.0
+DEPTHGO = 3.0
+# Mass of the CA beads (amu), with the thermostat and the depths giving the fluctuations, frame to frame
+# displacements and event rates of the dmdgoopt trajectories
+CA_MASS = 230.0
+# Collision frequency (1/ps) of every atom with the Andersen heat bath
+THERMOSTAT_RATE = 3.0
+# kcal/mol to amu A^2/ps^2
+ENERGY_UNITS = 418.4
+# Extra distance (A) of the hard sphere neighbour list, rebuilt before any atom can move more than half of it
+SKIN = 6.0
+
+SNAPSHOT = -1
+REBUILD = -2
+THERMOSTAT = -3
+
+
+class DMDEngine:
+    """
+    | biobb_flexserv DMDEngine
+    | Event-driven Discrete Molecular Dynamics of the square well Go model of the dmdgoopt binary.
+    | Atoms move in straight lines between collisions, which are processed in time order from a binary heap event queue.
+
+    Consecutive CA atoms and Go contacts are joined by square wells of width 2 x sigma x r0
+    around their native distance r0, the rest of the pairs are hard spheres. The wells are
+    finite: a pair reaching one of their walls leaves the well (compressed or stretched) if
+    its kinetic energy along the distance is larger than the depth, losing it, and is
+    captured again (gaining it) when it comes back, otherwise it bounces. Out of their wells,
+    consecutive atoms are kept within hard walls at tether x r0 of their native distance and
+    Go contacts only by the hard spheres. Bounces reflect the relative velocity of the pair
+    along its distance vector, so energy and momentum are conserved. The temperature is kept
+    by an Andersen thermostat: every atom takes a new Maxwell-Boltzmann velocity at random
+    times with the given collision frequency.
+    After an event only the events of its atoms are predicted again, the stale events left in
+    the queue are detected when popped by comparing the collision counters of their atoms
+    (lazy invalidation). The hard sphere candidate pairs come from a cell list (Contacts),
+    rebuilt when needed. The engine can be pickled into a checkpoint between snapshots and
+    run again after loading it.
+
+    Args:
+        coords (np.ndarray): Native (atoms, 3) structure, the initial structure of the simulation.
+        temperature (float): (300) Temperature in K of the initial velocities and of the heat bath.
+        seed (int): (None) Seed of the random generator.
+        rcutgo (float): (8.0) Cutoff distance in Angstroms of the Go contacts.
+        sigma (float): (0.05) Relative half width of the square wells of the consecutive atoms.
+        sigmago (float): (0.1) Relative half width of the square wells of the Go contacts.
+        tether (float): (0.3) Relative half width of the hard walls of the consecutive atoms out of their wells.
+        rca (float): (0.5) Hard sphere radius in Angstroms of the rest of the atoms.
+        depth (float): (2.0) Depth in kcal/mol of the square wells of the consecutive atoms.
+        depthgo (float): (3.0) Depth in kcal/mol of the square wells of the Go contacts.
+        mass (float): (230) Mass of the atoms in amu.
+        thermostat_rate (float): (3.0) Collision frequency in 1/ps of every atom with the heat bath (0: constant energy).
+    """
+
+    def __init__(self, coords: np.ndarray, temperature: float = 300.0, seed: Optional[int] = None,
+                 rcutgo: float = RCUTGO, sigma: float = SIGMA, sigmago: float = SIGMAGO, tether: float = TETHER,
+                 rca: float = RCA, depth: float = DEPTH, depthgo: float = DEPTHGO, mass: float = CA_MASS,
+                 thermostat_rate: float = THERMOSTAT_RATE) -> None:
+        self.natoms = len(coords)
+        self.positions = np.array(coords, dtype=np.float64)
+        self.hard_core = 2.0 * rca
+
+        # Square wells: consecutive atoms and Go contacts, with their squared hard and well walls
+        go = Contacts(self.positions, rcutgo, min_separation=2)
+        self.go_contacts = len(go)
+        bonds = np.arange(self.natoms - 1)
+        bond_lengths = np.linalg.norm(self.positions[1:] - self.positions[:-1], axis=1)
+        first = np.concatenate([bonds, go.first])
+        second = np.concatenate([bonds + 1, go.second])
+        widths = np.concatenate([np.full(len(bonds), sigma), np.full(len(go), sigmago)])
+        lengths = np.concatenate([bond_lengths, go.distances])
+        self._well_pairs = {pair: well for well, pair in enumerate(zip(first.tolist(), second.tolist()))}
+        # Inner hard wall, inner and outer well walls and outer hard wall of every well
+        hard_walls = np.concatenate([np.full(len(bonds), tether), np.full(len(go), np.inf)])
+        self._walls = np.column_stack([np.maximum((1 - hard_walls) * lengths, self.hard_core), (1 - widths) * lengths,
+                                       (1 + widths) * lengths, (1 + hard_walls) * lengths]) ** 2
+        self._wells = self._partner_lists(first, second, self._walls[:, 1], self._walls[:, 2], np.arange(len(first)))
+        # Region of every pair: -1 compressed, 0 in its well, 1 stretched
+        self.regions = np.zeros(len(first), dtype=np.int64)
+        self.nbonds = len(bonds)
+
+        # Escape energy of every well along the distance of its pair, as a squared relative speed (energy over the reduced mass)
+        depths = np.concatenate([np.full(len(bonds), depth), np.full(len(go), depthgo)])
+        self._escape_speeds = 4.0 * depths * ENERGY_UNITS / mass
+        self._thermal_speed = np.sqrt(KB * temperature * ENERGY_UNITS / mass)
+        self.thermostat_rate = thermostat_rate
+        self.rng = np.random.default_rng(seed)
+
+        # Initial velocities from the Maxwell-Boltzmann distribution without center of mass motion
+        velocities = self.rng.standard_normal((self.natoms, 3)) * self._thermal_speed
+        self.velocities = velocities - velocities.mean(axis=0)
+
+        # Positions are stored at the time of the last event of every atom
+        self.time = 0.0
+        self.atom_times = np.zeros(self.natoms)
+        self.collisions = np.zeros(self.natoms, dtype=np.int64)
+        self.events = 0
+        # Escapes of the bonds and of the Go contacts from their wells, and bounces of pairs without energy to escape
+        self.escapes = np.zeros(2, dtype=np.int64)
+        self.bounces = 0
+        self.queue: list[tuple] = []
+        self._sequence = 0
+        self._rebuilds = 0
+        if self.thermostat_rate > 0:
+            for atom, wait in enumerate(self.rng.exponential(1.0 / self.thermostat_rate, self.natoms).tolist()):
+                self._push(wait, THERMOSTAT, atom, 0, 0)
+        self.rebuild()
+
+    def __getstate__(self) -> dict:
+        # The pending snapshots belong to the current run call, a resumed engine schedules its own ones
+        state = self.__dict__.copy()
+        state['queue'] = [event for event in self.queue if event[2] != SNAPSHOT]
+        heapq.heapify(state['queue'])
+        return state
+
+    def _partner_lists(self, first: np.ndarray, second: np.ndarray, inner: np.ndarray, outer: np.ndarray,
+                       wells: np.ndarray) -> list[tuple]:
+        """Partners of every atom with the squared inner and outer distances and the well (-1: hard sphere) of their pair,
+        as (partners, inner, outer, wells) arrays."""
+        atoms = np.concatenate([first, second])
+        partners = np.concatenate([second, first])
+        inner, outer, wells = np.concatenate([inner, inner]), np.concatenate([outer, outer]), np.concatenate([wells, wells])
+        order = np.argsort(atoms, kind='stable')
+        bounds = np.searchsorted(atoms[order], np.arange(self.natoms + 1))
+        return [(partners[order[start:stop]], inner[order[start:stop]], outer[order[start:stop]], wells[order[start:stop]])
+                for start, stop in zip(bounds[:-1], bounds[1:])]
+
+    def _push(self, time: float, first: int, second: int, first_count: int, second_count: int) -> None:
+        heapq.heappush(self.queue, (time, self._sequence, first, second, first_count, second_count))
+        self._sequence += 1
+
+    def positions_at(self, time: float, atoms=slice(None)) -> np.ndarray:
+        """Positions of the atoms at a time not earlier than their last events."""
+        return self.positions[atoms] + self.velocities[atoms] * (time - self.atom_times[atoms])[..., np.newaxis]
+
+    def rebuild(self) -> None:
+        """Rebuild the hard sphere neighbour list and predict again the events of all the atoms."""
+        self.positions = self.positions_at(self.time)
+        self.atom_times[:] = self.time
+        self._rebuilds += 1
+        self.queue = [event for event in self.queue if event[2] in (SNAPSHOT, THERMOSTAT)]
+        heapq.heapify(self.queue)
+
+        # Candidate hard sphere pairs: close enough to collide before the next rebuild, and not joined by a well
+        candidates = Contacts(self.positions, self.hard_core + SKIN)
+        keep = np.array([pair not in self._well_pairs for pair in zip(candidates.first.tolist(), candidates.second.tolist())], dtype=bool)
+        first, second = candidates.first[keep], candidates.second[keep]
+        spheres = self._partner_lists(first, second, np.full(len(first), self.hard_core ** 2), np.full(len(first), np.inf),
+                                      np.full(len(first), -1))
+        self._partners = [tuple(np.concatenate(arrays) for arrays in zip(wells, atom_spheres))
+                          for wells, atom_spheres in zip(self._wells, spheres)]
+
+        self.predict(list(range(self.natoms)), partners_above=True)
+        self._schedule_rebuild()
+
+    def _schedule_rebuild(self) -> None:
+        # No atom can move more than half of the skin before the rebuild
+        self._max_speed = float(np.sqrt(np.max(np.sum(self.velocities ** 2, axis=1))))
+        self._mark_time = self.time
+        self._displacement = 0.0
+        self._push_rebuild()
+
+    def _push_rebuild(self) -> None:
+        rebuild_time = self._mark_time + (0.5 * SKIN - self._displacement) / max(self._max_speed, 1e-12)
+        self._push(rebuild_time, REBUILD, self._rebuilds, 0, 0)
+
+    def _check_speed(self, speed: float) -> None:
+        """Bring forward the next rebuild if an atom got faster than the speed used to schedule it."""
+        if speed > self._max_speed:
+            self._displacement += self._max_speed * (self.time - self._mark_time)
+            self._mark_time = self.time
+            self._max_speed = speed
+            self._rebuilds += 1
+            self._push_rebuild()
+
+    def predict(self, atoms: list[int], partners_above: bool = False) -> None:
+        """Push the next collision of every atom with each one of its partners.
+
+        With partners_above only the partners with a larger index are considered, so every pair is predicted once.
+        """
+        lists = [self._partners[atom] for atom in atoms]
+        owners = np.repeat(atoms, [len(partners) for partners, _, _, _ in lists])
+        partners = np.concatenate([partners for partners, _, _, _ in lists])
+        inner = np.concatenate([inner for _, inner, _, _ in lists])
+        outer = np.concatenate([outer for _, _, outer, _ in lists])
+        wells = np.concatenate([wells for _, _, _, wells in lists])
+        # Only one event per pair
+        selected = partners > owners if partners_above else ~((owners == atoms[-1]) & (partners == atoms[0]))
+        owners, partners, inner, outer, wells = owners[selected], partners[selected], inner[selected], outer[selected], wells[selected]
+        # Walls of the region of the pairs out of their wells
+        escaped = wells >= 0
+        escaped[escaped] = self.regions[wells[escaped]] != 0
+        escaped_wells = wells[escaped]
+        inner[escaped] = self._walls[escaped_wells, self.regions[escaped_wells] + 1]
+        outer[escaped] = self._walls[escaped_wells, self.regions[escaped_wells] + 2]
+
+        distances = self.positions_at(self.time, partners) - self.positions_at(self.time, owners)
+        relative = self.velocities[partners] - self.velocities[owners]
+        approach = np.einsum('ij,ij->i', distances, relative)
+        speed = np.einsum('ij,ij->i', relative, relative)
+        squared = np.einsum('ij,ij->i', distances, distances)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # Inner wall (or hard sphere) when approaching, else outer wall
+            inner_discriminant = approach * approach - speed * (squared - inner)
+            inner_times = (-approach - np.sqrt(inner_discriminant)) / speed
+            outer_times = (-approach + np.sqrt(approach * approach - speed * (squared - outer))) / speed
+        times = np.where((approach < 0) & (inner_discriminant > 0), inner_times, outer_times)
+        # Pairs left out of their well by rounding errors meet its wall at once
+        times[(squared > outer) & (approach > 0)] = 0.0
+        times = self.time + np.maximum(times, 0.0)
+
+        valid = np.isfinite(times)
+        collisions = self.collisions.tolist()
+        for time, owner, partner in zip(times[valid].tolist(), owners[valid].tolist(), partners[valid].tolist()):
+            heapq.heappush(self.queue, (time, self._sequence, owner, partner, collisions[owner], collisions[partner]))
+            self._sequence += 1
+
+    def _moved(self, atoms: list[int]) -> None:
+        """Invalidate the events of the atoms after a change of their velocities and predict them again."""
+        self.collisions[atoms] += 1
+        self._check_speed(float(np.sqrt(np.max(np.sum(self.velocities[atoms] ** 2, axis=1)))))
+        self.predict(atoms)
+
+    def collide(self, first: int, second: int) -> None:
+        """Collision of two atoms of the same mass at a wall: the component of their relative velocity along their
+        distance vector is reflected (bounce) or changed by the depth of the well (escape or capture)."""
+        atoms = [first, second]
+        self.positions[atoms] = self.positions_at(self.time, atoms)
+        self.atom_times[atoms] = self.time
+        distance = self.positions[second] - self.positions[first]
+        distance /= np.sqrt(np.dot(distance, distance))
+        radial = float(np.dot(self.velocities[second] - self.velocities[first], distance))
+        new_radial = -radial
+
+        well = self._well_pairs.get((first, second) if first < second else (second, first), -1)
+        if well >= 0:
+            region = int(self.regions[well])
+            # Region on the other side of the wall, the hard walls have no other side
+            target = region + (1 if radial > 0 else -1)
+            if region != 0 and target == 0:
+                # Captured again, the well depth goes to the relative speed
+                new_radial = np.copysign(np.sqrt(radial * radial + self._escape_speeds[well]), radial)
+                self.regions[well] = 0
+            elif region == 0:
+                if radial * radial > self._escape_speeds[well]:
+                    new_radial = np.copysign(np.sqrt(radial * radial - self._escape_speeds[well]), radial)
+                    self.regions[well] = target
+                    self.escapes[int(well >= self.nbonds)] += 1
+                else:
+                    self.bounces += 1
+
+        impulse = 0.5 * (new_radial - radial) * distance
+        self.velocities[first] -= impulse
+        self.velocities[second] += impulse
+        self.events += 1
+        self._moved(atoms)
+
+    def thermalize(self, atom: int) -> None:
+        """Collision of the atom with the heat bath: new velocity from the Maxwell-Boltzmann distribution."""
+        self.positions[atom] = self.positions_at(self.time, atom)
+        self.atom_times[atom] = self.time
+        self.velocities[atom] = self.rng.standard_normal(3) * self._thermal_speed
+        self._push(self.time + self.rng.exponential(1.0 / self.thermostat_rate), THERMOSTAT, atom, 0, 0)
+        self._moved([atom])
+
+    def run(self, tsnap: float, frames: int) -> Iterator[np.ndarray]:
+        """Yield the positions every tsnap ps until frames snapshots, processing the events in time order."""
+        # Without snapshots the self-rescheduling rebuild and thermostat events would never empty the queue
+        if frames <= 0:
+            return
+        start = self.time
+        for frame in range(1, frames + 1):
+            self._push(start + frame * tsnap, SNAPSHOT, frame, 0, 0)
+        while self.queue:
+            time, _, first, second, first_count, second_count = heapq.heappop(self.queue)
+            self.time = time
+            if first == SNAPSHOT:
+                yield self.positions_at(time)
+            elif first == REBUILD:
+                if second == self._rebuilds:
+                    self.rebuild()
+            elif first == THERMOSTAT:
+                self.thermalize(second)
+            elif first_count == self.collisions[first] and second_count == self.collisions[second]:
+                self.collide(first, second)
+            if first == SNAPSHOT and second == frames:
+                return
@@ -3,8 +3,16 @@
 """Module containing the dmd_run class and the command line interface."""
 from typing import Optional
 from pathlib import Path
+from biobb_common.tools import file_utils as fu
 from biobb_common.generic.biobb_object import BiobbObject
 from biobb_common.tools.file_utils import launchlogger
+from biobb_flexserv.flexserv import replicas
+from biobb_flexserv.flexserv.ensemble import EnsembleWriter, read_ca_atoms
+from biobb_flexserv.flexserv.checkpoint import Checkpoint, FRAMES_SUFFIX
+from biobb_flexserv.flexserv.dmd import DMDEngine
+from biobb_flexserv.flexserv.nma import read_ca_coords
+from biobb_flexserv.flexserv.progress import ProgressMonitor
+from biobb_flexserv.pcasuite.fitting import center
 
 
 class DMDRun(BiobbObject):
@@ -16,12 +24,25 @@ class DMDRun(BiobbObject):
     Args:
         input_pdb_path (str): Input PDB file. File type: input. `Sample file <https://github.com/bioexcel/biobb_flexserv/raw/master/biobb_flexserv/test/data/flexserv/structure.ca.pdb>`_. Accepted formats: pdb (edam:format_1476).
         output_log_path (str): Output log file. File type: output. `Sample file <https://github.com/bioexcel/biobb_flexserv/raw/master/biobb_flexserv/test/reference/flexserv/dmd_run_out.log>`_. Accepted formats: log (edam:format_2330), out (edam:format_2330), txt (edam:format_2330), o (edam:format_2330).
-        output_crd_path (str): Output ensemble. File type: output. `Sample file <https://github.com/bioexcel/biobb_flexserv/raw/master/biobb_flexserv/test/reference/flexserv/dmd_run_out.crd>`_. Accepted formats: crd (edam:format_3878), mdcrd (edam:format_3878), inpcrd (edam:format_3878).
+        output_crd_path (str) (Optional): Output ensemble, needed by the dmdgoopt binary. File type: output. `Sample file <https://github.com/bioexcel/biobb_flexserv/raw/master/biobb_flexserv/test/reference/flexserv/dmd_run_out.crd>`_. Accepted formats: crd (edam:format_3878), mdcrd (edam:format_3878), inpcrd (edam:format_3878).
+        output_index_path (str) (Optional): Output per-replica frame index of the merged ensemble, with the seed and the frame range of every replica. File type: output. `Sample file <https://github.com/bioexcel/biobb_flexserv/raw/master/biobb_flexserv/test/reference/flexserv/dmd_run_index.json>`_. Accepted formats: json (edam:format_3464).
+        output_pcz_path (str) (Optional): Output ensemble compressed with the native PCA engine, written without the intermediate CRD file (fused mode, native backend). File type: output. `Sample file <https://github.com/bioexcel/biobb_flexserv/raw/master/biobb_flexserv/test/reference/pcasuite/pcazip.pcz>`_. Accepted formats: pcz (edam:format_3874).
+        output_checkpoint_path (str) (Optional): Output checkpoint of the simulation (native backend), read back to continue it when resume is set. With output_pcz_path the frames of the PCZ file are kept next to it in a .frames file. File type: output. Accepted formats: chk (edam:format_2333).
+        output_metrics_path (str) (Optional): Output progress and throughput metrics of the run (frames written, frames per second, ETA, output size), rewritten every progress_interval seconds. File type: output. Accepted formats: json (edam:format_3464).
         properties (dict - Python dictionary object containing the tool parameters, not input/output files):
             * **binary_path** (*str*) - ("dmdgoopt") DMD binary path to be used.
             * **dt** (*float*) - (1e-12) Integration time (s)
             * **temperature** (*int*) - (300) Simulation temperature (K)
             * **frames** (*int*) - (1000) Number of frames in the final ensemble
+            * **seed** (*int*) - (2839) Seed of the random generator (KKK). Replica i uses seed + i.
+            * **backend** (*str*) - ("dmdgoopt") Engine used to run the simulation: dmdgoopt Fortran binary or in-process event-driven Python engine with the same square well Go model (Options: dmdgoopt, native)
+            * **replicas** (*int*) - (1) Number of independent seeded replicas merged into the output ensemble.
+            * **n_workers** (*int*) - (1) Number of processes running replicas concurrently.
+            * **neigenv** (*int*) - (0) Fused mode: number of eigenvectors of the output PCZ file.
+            * **variance** (*int*) - (90) Fused mode: percentage of variance captured by the eigenvectors of the output PCZ file.
+            * **checkpoint_freq** (*int*) - (100) Number of frames between checkpoints, only the final checkpoint if 0.
+            * **resume** (*bool*) - (False) Continue the simulation from the output checkpoint if it exists, appending the new frames to the outputs, until the number of frames (which can be extended).
+            * **progress_interval** (*float*) - (60) Seconds between the progress reports (frames written, frames per second, ETA and output size) in the log and the metrics file, only the final report if 0.
             * **remove_tmp** (*bool*) - (True) [WF property] Remove temporal files.
             * **restart** (*bool*) - (False) [WF property] Do not execute if output files exist.
             * **sandbox_path** (*str*) - ("./") [WF property] Parent path to the sandbox directory.
@@ -50,7 +71,9 @@ class DMDRun(BiobbObject):
     """
 
     def __init__(self, input_pdb_path: str, output_log_path: str,
-                 output_crd_path: str, properties: Optional[dict] = None, **kwargs) -> None:
+                 output_crd_path: Optional[str] = None, output_index_path: Optional[str] = None,
+                 output_pcz_path: Optional[str] = None, output_checkpoint_path: Optional[str] = None,
+                 output_metrics_path: Optional[str] = None, properties: Optional[dict] = None, **kwargs) -> None:
 
         properties = properties or {}
 
@@ -62,7 +85,11 @@ class DMDRun(BiobbObject):
         self.io_dict = {
             'in': {'input_pdb_path': input_pdb_path},
             'out': {'output_log_path': output_log_path,
-                    'output_crd_path': output_crd_path}
+                    'output_crd_path': output_crd_path,  # type: ignore
+                    'output_index_path': output_index_path,  # type: ignore
+                    'output_pcz_path': output_pcz_path,  # type: ignore
+                    'output_checkpoint_path': output_checkpoint_path,  # type: ignore
+                    'output_metrics_path': output_metrics_path}  # type: ignore
         }
 
         # Properties specific for BB
@@ -72,18 +99,122 @@ class DMDRun(BiobbObject):
         self.dt = properties.get('dt', 1e-12)
         self.temperature = properties.get('temperature', 300)
         self.frames = properties.get('frames', 1000)
+        self.seed = properties.get('seed', 2839)
+        self.backend = properties.get('backend', 'dmdgoopt')
+        self.replicas = properties.get('replicas', 1)
+        self.n_workers = properties.get('n_workers', 1)
+        self.neigenv = properties.get('neigenv', 0)
+        self.variance = properties.get('variance')
+        self.checkpoint_freq = properties.get('checkpoint_freq', 100)
+        self.resume = properties.get('resume', False)
+        self.progress_interval = properties.get('progress_interval', 60)
 
         # Check the properties
         self.check_properties(properties)
         self.check_arguments()
 
+    def launch_native(self):
+        """Runs the Discrete Molecular Dynamics simulation in-process with the event-driven DMDEngine."""
+
+        coords = center(read_ca_coords(self.io_dict["in"]["input_pdb_path"]))
+        # The dmdgoopt binary takes the snapshot time in seconds, the engine in ps
+        tsnap = float(self.dt) * 1e12
+        output_log_path = self.io_dict["out"]["output_log_path"]
+        output_crd_path = self.io_dict["out"].get("output_crd_path")
+        output_pcz_path = self.io_dict["out"].get("output_pcz_path")
+        output_checkpoint_path = self.io_dict["out"].get("output_checkpoint_path")
+        # Frames of the fused mode PCZ file, kept next to the checkpoint to resume
+        frames_path = output_checkpoint_path + FRAMES_SUFFIX if output_checkpoint_path and output_pcz_path else None
+        checkpoint = None
+        state = None
+        if output_checkpoint_path:
+            checkpoint = Checkpoint(output_checkpoint_path, int(self.checkpoint_freq),
+                                    settings={'natoms': len(coords), 'tsnap': tsnap},
+                                    outputs={'log': output_log_path, 'crd': output_crd_path, 'pcz_frames': frames_path})
+            state = checkpoint.load() if self.resume else None
+
+        if state:
+            engine = state['engine']
+            frames = state['frames']
+            fu.log('Resuming from checkpoint %s at %g ps (%d frames)' % (output_checkpoint_path, engine.time, frames), self.out_log)
+        else:
+            engine = DMDEngine(coords, temperature=float(self.temperature), seed=self.seed)
+            frames = 0
+            with open(output_log_path, 'w') as log_file:
+                log_file.write(' natom,tsnap,nbloc%12d%26.16E%12d\n' % (len(coords), float(self.dt), self.frames))
+                log_file.write(' Contactes Go%12d\n' % engine.go_contacts)
+        blocks = max(0, int(self.frames) - frames)
+        fu.log('Running %d DMD blocks of %g ps for %d CA atoms and %d Go contacts' % (blocks, tsnap, len(coords), engine.go_contacts), self.out_log)
+
+        with ProgressMonitor(int(self.frames) + 1, self.progress_interval, outputs=[output_log_path, output_crd_path, output_pcz_path],
+                             output_metrics_path=self.io_dict["out"].get("output_metrics_path"),
+                             frames=frames + 1, out_log=self.out_log) as monitor, \
+                open(output_log_path, 'a') as log_file, \
+                EnsembleWriter(len(coords), output_crd_path, output_pcz_path,
+                               atoms=read_ca_atoms(self.io_dict["in"]["input_pdb_path"]), neigenv=self.neigenv, variance=self.variance,
+                               append=bool(state), frames_path=frames_path) as ensemble:
+            if not state:
+                ensemble.write(coords)
+            events = engine.events
+            # Nothing left to run when resuming a complete simulation
+            for snapshot in engine.run(tsnap, blocks) if blocks else ():
+                # Collisions of every block
+                log_file.write(' Temps%26.16E  Events%12d\n' % (engine.time * 1e-12, engine.events - events))
+                events = engine.events
+                ensemble.write(center(snapshot))
+                frames += 1
+                monitor.update(frames + 1)
+                if checkpoint:
+                    checkpoint.update(engine, frames, ensemble, log_file)
+            if checkpoint:
+                checkpoint.save(engine, frames, ensemble, log_file)
+        if ensemble.compression:
+            fu.log('Ensemble compressed into PCZ: %d eigenvectors kept, %.2f%% of the total variance' % (ensemble.compression[0], 100 * ensemble.compression[1]), self.out_log)
+
+        self.check_arguments(output_files_created=True, raise_exception=False)
+
+        return self.return_code
+
+    def launch_replicas(self):
+        """Runs independent seeded replicas in a pool of processes and merges them into a single ensemble."""
+
+        if self.io_dict["out"].get("output_checkpoint_path"):
+            raise SystemExit('Checkpoints of replicas are not supported, please checkpoint every replica as a separate run')
+        seeds = replicas.replica_seeds(self.seed, self.replicas)
+        fu.log('Running %d replicas with seeds %d-%d in %d processes' % (self.replicas, seeds[0], seeds[-1], self.n_workers), self.out_log)
+        # The replicas run silently, only their total throughput is reported
+        total_frames = self.replicas * (int(self.frames) + 1)
+        with ProgressMonitor(total_frames, self.progress_interval,
+                             outputs=[self.io_dict["out"]["output_log_path"], self.io_dict["out"].get("output_crd_path"), self.io_dict["out"].get("output_pcz_path")],
+                             output_metrics_path=self.io_dict["out"].get("output_metrics_path"), out_log=self.out_log) as monitor:
+            self.tmp_files.extend(replicas.run_replicas(DMDRun, self.io_dict, self.properties, seeds,
+                                                        self.n_workers, str(self.sandbox_path), self.out_log))
+            monitor.update(total_frames)
+
+        # Remove temporary folder(s)
+        self.remove_tmp_files()
+        self.check_arguments(output_files_created=True, raise_exception=False)
+
+        return self.return_code
+
     @launchlogger
     def launch(self):
-        """Launches the execution of the FlexServ BDRun module."""
+        """Launches the execution of the FlexServ DMDRun module."""
 
         # Setup Biobb
         if self.check_restart():
             return 0
+
+        if self.replicas > 1:
+            return self.launch_replicas()
+
+        if self.backend == 'native':
+            return self.launch_native()
+
+        if not self.io_dict["out"].get("output_crd_path") or self.io_dict["out"].get("output_pcz_path"):
+            raise SystemExit('The dmdgoopt binary writes a CRD file: output_crd_path is needed and output_pcz_path needs the native backend')
+        if self.io_dict["out"].get("output_checkpoint_path"):
+            raise SystemExit('The dmdgoopt binary has no checkpoints, output_checkpoint_path needs the native backend')
         self.stage_files()
 
         # Internal file paths
@@ -112,7 +243,7 @@ class DMDRun(BiobbObject):
             dmdin.write("  RCA=0.5,\n")
             dmdin.write("  SIGMA=0.05,\n")
             dmdin.write("  SIGMAGO=0.1,\n")
-            dmdin.write("  KKK=2839\n")
+            dmdin.write("  KKK={}\n".format(self.seed))
             dmdin.write("&END\n")
 
         # Command line
@@ -122,8 +253,13 @@ class DMDRun(BiobbObject):
                     '>', output_log
                     ]
 
-        # Run Biobb block
-        self.run_biobb()
+        # Run Biobb block, reporting the frames written by the binary
+        with ProgressMonitor(int(self.frames) + 1, self.progress_interval,
+                             outputs=[self.stage_io_dict["out"]["output_crd_path"], self.stage_io_dict["out"]["output_log_path"]],
+                             output_metrics_path=self.io_dict["out"].get("output_metrics_path"),
+                             poll_crd_path=self.stage_io_dict["out"]["output_crd_path"],
+                             natoms=len(read_ca_coords(self.io_dict["in"]["input_pdb_path"])), out_log=self.out_log):
+            self.run_biobb()
 
         # Copy files to host
         self.copy_to_host()
@@ -136,7 +272,9 @@ class DMDRun(BiobbObject):
 
 
 def dmd_run(input_pdb_path: str,
-            output_log_path: str, output_crd_path: str,
+            output_log_path: str, output_crd_path: Optional[str] = None,
+            output_index_path: Optional[str] = None, output_pcz_path: Optional[str] = None,
+            output_checkpoint_path: Optional[str] = None, output_metrics_path: Optional[str] = None,
             properties: Optional[dict] = None, **kwargs) -> int:
     """Create :class:`DMDRun <flexserv.dmd_run.DMDRun>`flexserv.dmd_run.DMDRun class and
     execute :meth:`launch() <flexserv.dmd_run.DMDRun.launch>` method"""
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+
+"""Module containing the EnsembleWriter class, output of the ensembles generated by the native FlexServ runners."""
+import os
+from typing import Optional
+import tempfile
+import numpy as np
+from biobb_flexserv.flexserv.crdfile import CRDWriter
+from biobb_flexserv.pcasuite import pca
+
+# Frames per block read back from the spilled frames by the PCA engine
+PCA_BLOCK_SIZE = 1000
+
+
+def read_ca_atoms(input_pdb_path: str) -> np.ndarray:
+    """CA atom records of a PDB file in the PCZ atom names layout, the atoms simulated by the FlexServ runners."""
+    atoms = pca.read_pdb_atoms(input_pdb_path)
+    return atoms[np.char.strip(atoms['atom_name']) == b'CA']
+
+
+class EnsembleWriter:
+    """
+    | biobb_flexserv EnsembleWriter
+    | Output of the frames generated by the native runners: written to a CRD trajectory, compressed into a PCZ file, or both.
+    | Fused mode: without output CRD the frames are spilled as float32 coordinates to a temporary binary file and compressed with the native PCA engine when the writer is closed, reading them back in blocks through a memory map, so the ensemble never goes through a text trajectory nor is held in memory.
+    | The frames can be spilled to a given file instead, which is kept to resume the simulation: with append its frames are part of the ensemble.
+
+    Args:
+        natoms (int): Number of atoms of the frames.
+        output_crd_path (str): (None) Output trajectory file.
+        output_pcz_path (str): (None) Output compressed trajectory file.
+        title (str): (' ') Title of the output files.
+        atoms (np.ndarray): (None) Atom records of the PCZ file, see read_ca_atoms.
+        neigenv (int): (0) Number of eigenvectors of the PCZ file.
+        variance (float): (None) Percentage of variance captured by the eigenvectors of the PCZ file, 90 if neither neigenv nor variance are given.
+        append (bool): (False) Add the frames to the end of the existing output trajectory and spilled frames.
+        frames_path (str): (None) File where the frames of the PCZ file are spilled, a temporary file if not given.
+    """
+
+    def __init__(self, natoms: int, output_crd_path: Optional[str] = None, output_pcz_path: Optional[str] = None,
+                 title: str = ' ', atoms: Optional[np.ndarray] = None, neigenv: int = 0, variance: Optional[float] = None,
+                 append: bool = False, frames_path: Optional[str] = None) -> None:
+        if not output_crd_path and not output_pcz_path:
+            raise SystemExit('An output CRD or PCZ file is needed to write the ensemble')
+        self.natoms = natoms
+        self.output_pcz_path = output_pcz_path
+        self.title = title
+        self.atoms = atoms
+        self.neigenv = neigenv
+        self.variance = variance
+        # Number of eigenvectors kept and fraction of the variance they capture, once compressed
+        self.compression: Optional[tuple[int, float]] = None
+        # Frames of the PCZ file, appended to the spill file
+        self._spill = None
+        self._nframes = 0
+        if output_pcz_path and frames_path:
+            self._spill = open(frames_path, 'r+b' if append and os.path.exists(frames_path) else 'w+b')
+            self._nframes = os.path.getsize(frames_path) // (natoms * 3 * np.dtype(np.float32).itemsize)
+        elif output_pcz_path:
+            self._spill = tempfile.TemporaryFile()
+        self._writer = CRDWriter(output_crd_path, natoms, title=title, append=append) if output_crd_path else None
+
+    def __enter__(self) -> 'EnsembleWriter':
+        return self
+
+    def __exit__(self, exc_type, *exc_info) -> None:
+        self.close(compress=exc_type is None)
+
+    def write(self, coords: np.ndarray) -> None:
+        """Add a (frames, atoms, 3) block of frames, or a single (atoms, 3) frame, to the ensemble."""
+        if self._writer:
+            self._writer.write(coords)
+        if self._spill:
+            self._store(coords)
+
+    def _store(self, coords: np.ndarray) -> None:
+        block = np.array(coords, dtype=np.float32, ndmin=3)
+        self._spill.seek(0, 2)
+        self._spill.write(block.tobytes())
+        self._nframes += len(block)
+
+    @property
+    def frames(self) -> Optional[np.ndarray]:
+        """Frames stored for the PCZ file as a (frames, atoms, 3) float32 array mapped from disk, None without output PCZ."""
+        if not self._spill:
+            return None
+        if not self._nframes:
+            return np.empty((0, self.natoms, 3), dtype=np.float32)
+        self._spill.flush()
+        return np.asarray(np.memmap(self._spill, dtype=np.float32, mode='r', shape=(self._nframes, self.natoms, 3)))
+
+    def flush(self) -> None:
+        """Write the buffered frames of the output trajectory and spilled frames."""
+        if self._writer:
+            self._writer.flush()
+        if self._spill:
+            self._spill.flush()
+
+    def close(self, compress: bool = True) -> None:
+        """Close the output trajectory and compress the ensemble into the output PCZ file."""
+        if self._writer:
+            self._writer.close()
+        if not self._spill:
+            return
+        try:
+            if compress and self._nframes:
+                frames = self.frames
+
+                def blocks():
+                    return (frames[start:start + PCA_BLOCK_SIZE] for start in range(0, len(frames), PCA_BLOCK_SIZE))
+
+                self.compression = pca.compress(blocks, self.output_pcz_path, self.atoms, self.neigenv,
+                                                self.variance, title=self.title)
+        finally:
+            self._spill.close()
+            self._spill = None
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+
+"""Module containing the native elastic network Normal Mode Analysis (NMA) functions used by the NMARun native backend."""
+from typing import Iterator, Optional
+import numpy as np
+from biobb_flexserv.flexserv.contacts import Contacts
+from biobb_flexserv.pcasuite import pca
+from biobb_flexserv.pcasuite.pczfile import write_pcz
+
+# Boltzmann constant in kcal/(mol K)
+KB = 0.0019872
+# Kovacs force constants: cte * (r0 / r)^6 kcal/(mol A^2), as in "nmanu.pl hessian.dat 1 0 40"
+KOVACS_CTE = 40.0
+KOVACS_R0 = 3.8
+RIGID_BODY_MODES = 6
+# Smallest eigenvalue of the kept modes relative to the largest one: softer modes are zero modes of a disconnected network
+EIGENVALUE_TOLERANCE = 1e-6
+
+
+def read_ca_coords(input_pdb_path: str) -> np.ndarray:
+    """Coordinates of the CA atoms of a PDB file as an (atoms, 3) array."""
+    coords = []
+    with open(input_pdb_path) as pdb_file:
+        for line in pdb_file:
+            if line.startswith(('ATOM', 'HETATM')) and line[12:16].strip() == 'CA':
+                coords.append((float(line[30:38]), float(line[38:46]), float(line[46:54])))
+    return np.array(coords)
+
+
+def kovacs_hessian(coords: np.ndarray, cte: float = KOVACS_CTE, r0: float = KOVACS_R0, cutoff: float = 0.0) -> np.ndarray:
+    """Elastic network Hessian of an (atoms, 3) structure as a (3 x atoms, 3 x atoms) array.
+
+    Every pair of atoms is joined by a spring of force constant cte * (r0 / r)^6 (Kovacs et al.),
+    or only the pairs closer than cutoff if it is not 0.
+    """
+    natoms = len(coords)
+    distances = coords[:, np.newaxis] - coords[np.newaxis]
+    squared = np.sum(distances ** 2, axis=-1)
+    np.fill_diagonal(squared, 1.0)
+    force_constants = cte * (r0 * r0 / squared) ** 3
+    np.fill_diagonal(force_constants, 0.0)
+    if cutoff:
+        force_constants[squared > cutoff * cutoff] = 0.0
+
+    # Off-diagonal 3x3 blocks: -k_ij / r_ij^2 * d_ij d_ij^T, diagonal blocks: minus the sum of their row
+    hessian = -(force_constants / squared)[:, :, np.newaxis, np.newaxis] * distances[:, :, :, np.newaxis] * distances[:, :, np.newaxis, :]
+    diagonal = np.arange(natoms)
+    hessian[diagonal, diagonal] = -hessian.sum(axis=1)
+    return hessian.transpose(0, 2, 1, 3).reshape(3 * natoms, 3 * natoms)
+
+
+def kovacs_sparse_hessian(coords: np.ndarray, cutoff: float, cte: float = KOVACS_CTE, r0: float = KOVACS_R0):
+    """Elastic network Hessian of an (atoms, 3) structure as a scipy sparse CSR matrix.
+
+    Only the pairs closer than cutoff are joined by a spring, so memory grows with the
+    number of contacts instead of with the square of the number of atoms.
+    """
+    sparse = import_scipy_sparse()
+    natoms = len(coords)
+    contacts = Contacts(coords, cutoff)
+    first, second = contacts.first, contacts.second
+    distances = coords[first] - coords[second]
+    squared = np.sum(distances ** 2, axis=-1)
+    force_constants = cte * (r0 * r0 / squared) ** 3
+    blocks = -(force_constants / squared)[:, np.newaxis, np.newaxis] * distances[:, :, np.newaxis] * distances[:, np.newaxis, :]
+
+    diagonal_blocks = np.zeros((natoms, 3, 3))
+    np.add.at(diagonal_blocks, first, -blocks)
+    np.add.at(diagonal_blocks, second, -blocks)
+
+    # 3x3 blocks (i, j), (j, i) and (i, i) scattered as coordinate triplets
+    rows = np.concatenate([first, second, np.arange(natoms)])
+    cols = np.concatenate([second, first, np.arange(natoms)])
+    values = np.concatenate([blocks, blocks, diagonal_blocks])
+    xyz = np.arange(3)
+    row_indices = (3 * rows[:, np.newaxis, np.newaxis] + xyz[:, np.newaxis]).repeat(3, axis=2)
+    col_indices = (3 * cols[:, np.newaxis, np.newaxis] + xyz[np.newaxis, :]).repeat(3, axis=1)
+    return sparse.csr_matrix((values.ravel(), (row_indices.ravel(), col_indices.ravel())), shape=(3 * natoms, 3 * natoms))
+
+
+def sparse_normal_modes(hessian, nvecs: int, shift: float = -1e-5, cutoff: float = 0.0) -> tuple[np.ndarray, np.ndarray]:
+    """Lowest frequency eigenvalues and eigenvectors (as rows) of a sparse Hessian, skipping the 6 rigid body modes.
+
+    Only the nvecs + 6 eigenvalues closest to a small negative shift are computed, with the
+    shift-invert Lanczos method of ARPACK (the shift keeps the factorized matrix non-singular).
+    The largest eigenvalue, the scale of check_modes, comes from a single extra Lanczos run.
+    """
+    sparse = import_scipy_sparse()
+    evals, evecs = sparse.linalg.eigsh(hessian, k=min(nvecs + RIGID_BODY_MODES, hessian.shape[0] - 1), sigma=shift, which='LM')
+    order = np.argsort(evals)[RIGID_BODY_MODES:]
+    check_modes(evals[order], sparse.linalg.eigsh(hessian, k=1, which='LA', return_eigenvectors=False)[0], cutoff)
+    return evals[order], evecs[:, order].T
+
+
+def import_scipy_sparse():
+    """scipy sparse module, only needed by the sparse solver."""
+    try:
+        import scipy.sparse
+        import scipy.sparse.linalg  # noqa: F401
+    except ImportError:
+        raise SystemExit('The sparse NMA solver needs scipy, please install it (conda install -c conda-forge scipy)')
+    return scipy.sparse
+
+
+def normal_modes(hessian: np.ndarray, nvecs: Optional[int] = None, cutoff: float = 0.0) -> tuple[np.ndarray, np.ndarray]:
+    """Lowest frequency eigenvalues and eigenvectors (as rows) of the Hessian, skipping the 6 rigid body modes."""
+    last = None if nvecs is None else RIGID_BODY_MODES + nvecs
+    evals, evecs = np.linalg.eigh(hessian)
+    check_modes(evals[RIGID_BODY_MODES:last], evals[-1], cutoff)
+    return evals[RIGID_BODY_MODES:last], evecs[:, RIGID_BODY_MODES:last].T
+
+
+def check_modes(evals: np.ndarray, largest: float, cutoff: float = 0.0) -> None:
+    """Stop if any of the kept eigenvalues is not above EIGENVALUE_TOLERANCE x largest.
+
+    Besides the 6 rigid body modes, a connected elastic network has no zero modes. Extra
+    zero or negative modes come from a cutoff leaving atoms or domains without enough springs,
+    and their kT / eigenvalue variances would blow up the sampled ensemble.
+    """
+    floppy = np.count_nonzero(evals <= EIGENVALUE_TOLERANCE * largest)
+    if floppy:
+        raise SystemExit('%d normal modes besides the %d rigid body ones have zero or negative eigenvalues: the cutoff of %g A '
+                         'disconnects the elastic network, please use a larger cutoff (or 0 for all the pairs)'
+                         % (floppy, RIGID_BODY_MODES, cutoff))
+
+
+def sample_projections(evals: np.ndarray, frames: int, temperature: float = 300.0, seed: Optional[int] = None) -> np.ndarray:
+    """Displacements along the normal modes of frames samples of the Boltzmann distribution of the harmonic model, as a (frames, modes) array.
+
+    The displacement along every mode follows a normal distribution of variance kT / eigenvalue,
+    so the frames are independent samples instead of the correlated steps of a Monte Carlo chain.
+    """
+    amplitudes = np.sqrt(KB * temperature / evals)
+    return np.random.default_rng(seed).standard_normal((frames, len(evals))) * amplitudes
+
+
+def ensemble_chunks(coords: np.ndarray, evecs: np.ndarray, projections: np.ndarray, chunk_size: int = 1000) -> Iterator[np.ndarray]:
+    """Yield the frames average + P x V of a (frames, modes) projections array in (frames, atoms, 3) blocks of at most chunk_size frames.
+
+    Every block is a single matrix product, and only one block of frames is in memory at a time.
+    """
+    for start in range(0, len(projections), max(1, chunk_size)):
+        block = projections[start:start + max(1, chunk_size)]
+        yield coords + np.matmul(block, evecs).reshape(len(block), -1, 3)
+
+
+def ensemble(coords: np.ndarray, evals: np.ndarray, evecs: np.ndarray, frames: int,
+             temperature: float = 300.0, seed: Optional[int] = None) -> np.ndarray:
+    """Conformational ensemble sampled from the Boltzmann distribution of the harmonic model, see sample_projections."""
+    projections = sample_projections(evals, frames, temperature, seed)
+    return coords + np.matmul(projections, evecs).reshape(frames, -1, 3)
+
+
+def write_projections(output_proj_path: str, projections: np.ndarray) -> None:
+    """Write a (frames, modes) projections array: NumPy binary file for .npy paths, else one text line per frame, as file.proj."""
+    if output_proj_path.endswith('.npy'):
+        np.save(output_proj_path, projections.astype(np.float32))
+    else:
+        np.savetxt(output_proj_path, projections, fmt='%12.6f', delimiter='')
+
+
+def write_modes_pcz(output_pcz_path: str, coords: np.ndarray, evals: np.ndarray, evecs: np.ndarray, projections: np.ndarray,
+                    temperature: float = 300.0, atoms: Optional[np.ndarray] = None,
+                    neigenv: int = 0, variance: Optional[float] = None, title: str = '') -> tuple[int, float]:
+    """Write the ensemble of the normal modes, given as the (frames, modes) sampled projections, straight into a PCZ file, without generating its frames.
+
+    The normal modes already are the principal components of the harmonic ensemble: its average
+    is the input structure and the variance along every mode is kT / eigenvalue, so the PCZ
+    stores them with the projections of every frame, as pcazip would after compressing
+    the same ensemble. Returns the number of eigenvectors kept and the fraction of the variance they capture.
+    """
+    variances = KB * temperature / evals
+    # Decreasing variance order, as the PCZ eigenvalues
+    order = np.argsort(variances)[::-1]
+    variances, evecs, projections = variances[order], evecs[order], projections[:, order]
+    total = float(variances.sum())
+    nvecs = pca.select_modes(variances, neigenv, variance, total)
+    write_pcz(output_pcz_path, coords.ravel(), variances[:nvecs], evecs[:nvecs], projections[:, :nvecs].T,
+              total, pca.dimensionality(variances), atoms, title=title)
+    return nvecs, float(variances[:nvecs].sum() / total)
@@ -4,8 +4,13 @@
 from typing import Optional
 import os
 from pathlib import Path
+from biobb_common.tools import file_utils as fu
 from biobb_common.generic.biobb_object import BiobbObject
 from biobb_common.tools.file_utils import launchlogger
+from biobb_flexserv.flexserv import nma
+from biobb_flexserv.flexserv.crdfile import CRDWriter
+from biobb_flexserv.flexserv.ensemble import read_ca_atoms
+from biobb_flexserv.flexserv.progress import ProgressMonitor
 
 
 class NMARun(BiobbObject):
@@ -17,11 +22,22 @@ class NMARun(BiobbObject):
     Args:
         input_pdb_path (str): Input PDB file. File type: input. `Sample file <https://github.com/bioexcel/biobb_flexserv/raw/master/biobb_flexserv/test/data/flexserv/structure.ca.pdb>`_. Accepted formats: pdb (edam:format_1476).
         output_log_path (str): Output log file. File type: output. `Sample file <https://github.com/bioexcel/biobb_flexserv/raw/master/biobb_flexserv/test/reference/flexserv/nma_run_out.log>`_. Accepted formats: log (edam:format_2330), out (edam:format_2330), txt (edam:format_2330), o (edam:format_2330).
-        output_crd_path (str): Output ensemble. File type: output. `Sample file <https://github.com/bioexcel/biobb_flexserv/raw/master/biobb_flexserv/test/reference/flexserv/nma_run_out.crd>`_. Accepted formats: crd (edam:format_3878), mdcrd (edam:format_3878), inpcrd (edam:format_3878).
+        output_crd_path (str) (Optional): Output ensemble, needed by the diaghess backend. File type: output. `Sample file <https://github.com/bioexcel/biobb_flexserv/raw/master/biobb_flexserv/test/reference/flexserv/nma_run_out.crd>`_. Accepted formats: crd (edam:format_3878), mdcrd (edam:format_3878), inpcrd (edam:format_3878).
+        output_pcz_path (str) (Optional): Output ensemble compressed into the normal modes, written without the intermediate CRD file (fused mode, native backend). File type: output. `Sample file <https://github.com/bioexcel/biobb_flexserv/raw/master/biobb_flexserv/test/reference/pcasuite/pcazip.pcz>`_. Accepted formats: pcz (edam:format_3874).
+        output_proj_path (str) (Optional): Output projections of every frame of the ensemble on the normal modes, one line per frame (or a NumPy (frames, modes) array for npy files), written without reconstructing the frames (native backend). File type: output. Accepted formats: proj (edam:format_2330), txt (edam:format_2330), npy (edam:format_4003).
+        output_metrics_path (str) (Optional): Output progress and throughput metrics of the run (frames written, frames per second, ETA, output size), rewritten every progress_interval seconds. File type: output. Accepted formats: json (edam:format_3464).
         properties (dict - Python dictionary object containing the tool parameters, not input/output files):
             * **binary_path** (*str*) - ("diaghess") NMA binary path to be used.
             * **frames** (*int*) - (1000) Number of frames in the final ensemble
             * **nvecs** (*int*) - (50) Number of vectors to take into account for the ensemble generation
+            * **backend** (*str*) - ("diaghess") Engine used to compute the normal modes: nmanu.pl, diaghess and Perl ensemble scripts or in-process NumPy elastic network NMA (Options: diaghess, native)
+            * **seed** (*int*) - (None) Seed of the random generator used by the native backend to sample the ensemble.
+            * **cutoff** (*float*) - (0.0) Native backend: distance cutoff in Angstroms of the elastic network springs (0: all the atom pairs, as nmanu.pl). Cutoffs leaving the network disconnected, with more than 6 zero modes, are rejected.
+            * **solver** (*str*) - ("dense") Native backend eigensolver: LAPACK diagonalization of the dense Hessian or shift-invert Lanczos (scipy ARPACK) on the sparse Hessian of the contacts within the cutoff, computing only the nvecs lowest modes (Options: dense, sparse)
+            * **neigenv** (*int*) - (0) Fused mode: number of eigenvectors of the output PCZ file.
+            * **variance** (*int*) - (90) Fused mode: percentage of variance captured by the eigenvectors of the output PCZ file.
+            * **chunk_size** (*int*) - (1000) Native backend: number of frames reconstructed at once from their projections and streamed to the output CRD.
+            * **progress_interval** (*float*) - (60) Seconds between the progress reports (frames written, frames per second, ETA and output size) in the log and the metrics file, only the final report if 0.
             * **remove_tmp** (*bool*) - (True) [WF property] Remove temporal files.
             * **restart** (*bool*) - (False) [WF property] Do not execute if output files exist.
             * **sandbox_path** (*str*) - ("./") [WF property] Parent path to the sandbox directory.
@@ -50,7 +66,9 @@ class NMARun(BiobbObject):
     """
 
     def __init__(self, input_pdb_path: str, output_log_path: str,
-                 output_crd_path: str, properties: Optional[dict] = None, **kwargs) -> None:
+                 output_crd_path: Optional[str] = None, output_pcz_path: Optional[str] = None,
+                 output_proj_path: Optional[str] = None, output_metrics_path: Optional[str] = None,
+                 properties: Optional[dict] = None, **kwargs) -> None:
 
         properties = properties or {}
 
@@ -62,7 +80,10 @@ class NMARun(BiobbObject):
         self.io_dict = {
             'in': {'input_pdb_path': input_pdb_path},
             'out': {'output_log_path': output_log_path,
-                    'output_crd_path': output_crd_path}
+                    'output_crd_path': output_crd_path,  # type: ignore
+                    'output_pcz_path': output_pcz_path,  # type: ignore
+                    'output_proj_path': output_proj_path,  # type: ignore
+                    'output_metrics_path': output_metrics_path}  # type: ignore
         }
 
         # Properties specific for BB
@@ -70,11 +91,72 @@ class NMARun(BiobbObject):
         self.binary_path = properties.get('binary_path', 'diaghess')
         self.frames = properties.get('frames', 1000)
         self.nvecs = properties.get('nvecs', 50)
+        self.backend = properties.get('backend', 'diaghess')
+        self.seed = properties.get('seed')
+        self.cutoff = properties.get('cutoff', 0.0)
+        self.solver = properties.get('solver', 'dense')
+        self.neigenv = properties.get('neigenv', 0)
+        self.variance = properties.get('variance')
+        self.chunk_size = properties.get('chunk_size', 1000)
+        self.progress_interval = properties.get('progress_interval', 60)
 
         # Check the properties
         self.check_properties(properties)
         self.check_arguments()
 
+    def launch_native(self):
+        """Computes the normal modes and the ensemble in-process with NumPy, without the Perl scripts and text Hessian files."""
+
+        with ProgressMonitor(int(self.frames), self.progress_interval,
+                             outputs=[self.io_dict["out"]["output_log_path"], self.io_dict["out"]["output_crd_path"],
+                                      self.io_dict["out"]["output_pcz_path"], self.io_dict["out"]["output_proj_path"]],
+                             output_metrics_path=self.io_dict["out"].get("output_metrics_path"), out_log=self.out_log) as monitor:
+            coords = nma.read_ca_coords(self.io_dict["in"]["input_pdb_path"])
+            fu.log('Building the Kovacs elastic network Hessian of %d CA atoms' % len(coords), self.out_log)
+            if self.solver == 'sparse':
+                if not self.cutoff:
+                    raise SystemExit('The sparse solver needs a cutoff to build the sparse Hessian')
+                evals, evecs = nma.sparse_normal_modes(nma.kovacs_sparse_hessian(coords, self.cutoff), self.nvecs, cutoff=self.cutoff)
+            else:
+                evals, evecs = nma.normal_modes(nma.kovacs_hessian(coords, cutoff=self.cutoff), self.nvecs, cutoff=self.cutoff)
+
+            output_crd_path = self.io_dict["out"]["output_crd_path"]
+            output_pcz_path = self.io_dict["out"]["output_pcz_path"]
+            output_proj_path = self.io_dict["out"]["output_proj_path"]
+            if not output_crd_path and not output_pcz_path and not output_proj_path:
+                raise SystemExit('An output CRD, PCZ or projections file is needed to write the ensemble')
+            # All the projections are drawn at once, the frames are reconstructed from them by chunks
+            projections = nma.sample_projections(evals, int(self.frames), seed=self.seed)
+            if output_proj_path:
+                nma.write_projections(output_proj_path, projections)
+            if output_crd_path:
+                fu.log('Generating %d frames from %d normal modes' % (self.frames, len(evals)), self.out_log)
+                with CRDWriter(output_crd_path, len(coords), title=' MC generated trajectory ', buffer_size=int(self.chunk_size)) as writer:
+                    for chunk in nma.ensemble_chunks(coords, evecs, projections, int(self.chunk_size)):
+                        writer.write(chunk)
+                        monitor.update(writer.nframes)
+            if output_pcz_path:
+                # Fused mode: the normal modes are the principal components of the ensemble, no frame is generated
+                nvecs, explained = nma.write_modes_pcz(output_pcz_path, coords, evals, evecs, projections,
+                                                       atoms=read_ca_atoms(self.io_dict["in"]["input_pdb_path"]),
+                                                       neigenv=self.neigenv, variance=self.variance, title=' MC generated trajectory ')
+                fu.log('Normal modes written into PCZ: %d eigenvectors kept, %.2f%% of the total variance' % (nvecs, 100 * explained), self.out_log)
+
+            with open(self.io_dict["out"]["output_log_path"], 'w') as log_file:
+                log_file.write('Eigenvalues of the %d normal modes: %s\n' % (len(evals), ' '.join('%.6f' % eval for eval in evals)))
+                if output_crd_path:
+                    log_file.write('Outputting trajectory to file %s ...\n' % output_crd_path)
+                if output_pcz_path:
+                    log_file.write('Outputting compressed trajectory to file %s ...\n' % output_pcz_path)
+                if output_proj_path:
+                    log_file.write('Outputting projections to file %s ...\n' % output_proj_path)
+                log_file.write('-----------------------\nSuccessfully ending\n')
+            monitor.update(int(self.frames))
+
+        self.check_arguments(output_files_created=True, raise_exception=False)
+
+        return self.return_code
+
     @launchlogger
     def launch(self):
         """Launches the execution of the FlexServ NMARun module."""
@@ -82,6 +164,13 @@ class NMARun(BiobbObject):
         # Setup Biobb
         if self.check_restart():
             return 0
+
+        if self.backend == 'native':
+            return self.launch_native()
+
+        if not self.io_dict["out"]["output_crd_path"] or self.io_dict["out"]["output_pcz_path"] or self.io_dict["out"]["output_proj_path"]:
+            raise SystemExit('The diaghess backend writes a CRD file: output_crd_path is needed and output_pcz_path and output_proj_path need the native backend')
+
         self.stage_files()
 
         # Internal file paths
@@ -123,8 +212,13 @@ class NMARun(BiobbObject):
                     '>', output_log
                     ]
 
-        # Run Biobb block
-        self.run_biobb()
+        # Run Biobb block, reporting the frames written by the binary
+        with ProgressMonitor(int(self.frames), self.progress_interval,
+                             outputs=[self.stage_io_dict["out"]["output_crd_path"], self.stage_io_dict["out"]["output_log_path"]],
+                             output_metrics_path=self.io_dict["out"].get("output_metrics_path"),
+                             poll_crd_path=self.stage_io_dict["out"]["output_crd_path"],
+                             natoms=len(nma.read_ca_coords(self.io_dict["in"]["input_pdb_path"])), out_log=self.out_log):
+            self.run_biobb()
 
         # Copy files to host
         self.copy_to_host()
@@ -137,8 +231,9 @@ class NMARun(BiobbObject):
 
 
 def nma_run(input_pdb_path: str,
-            output_log_path: str, output_crd_path: str,
-            properties: Optional[dict] = None, **kwargs) -> int:
+            output_log_path: str, output_crd_path: Optional[str] = None,
+            output_pcz_path: Optional[str] = None, output_proj_path: Optional[str] = None,
+            output_metrics_path: Optional[str] = None, properties: Optional[dict] = None, **kwargs) -> int:
     """Create :class:`NMARun <flexserv.nma_run.NMARun>`flexserv.nma_run.NMARun class and
     execute :meth:`launch() <flexserv.nma_run.NMARun.launch>` method"""
     return NMARun(**dict(locals())).launch()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+
+"""Module containing the ProgressMonitor class, live progress and throughput reports of the FlexServ runners."""
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+from biobb_common.tools import file_utils as fu
+from biobb_flexserv.flexserv.crdfile import frame_size
+
+
+def format_duration(seconds: float) -> str:
+    """Duration as hours, minutes and seconds."""
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    return '%dh%02dm%02ds' % (hours, minutes, seconds)
+
+
+def crd_frames(input_crd_path: str, natoms: int) -> int:
+    """Number of complete frames of a CRD trajectory that may still be growing, from its size."""
+    try:
+        size = os.path.getsize(input_crd_path)
+        with open(input_crd_path, 'rb') as crd_file:
+            title = crd_file.readline()
+    except OSError:
+        return 0
+    if not title.endswith(b'\n'):
+        return 0
+    return max(0, (size - len(title)) // frame_size(natoms))
+
+
+class ProgressMonitor:
+    """
+    | biobb_flexserv ProgressMonitor
+    | Progress and throughput of a FlexServ run: frames written, frames per second, ETA and size of the outputs.
+    | Reported every interval seconds to the biobb log and, optionally, to a JSON metrics file, to detect stalled or slow runs.
+
+    The native runners count their frames with update. The binaries give no feedback until
+    they exit, so with poll_crd_path a background thread counts the complete frames of the
+    growing CRD file while run_biobb waits for the process. The metrics file is rewritten
+    atomically on every report and once more when the run ends, with its final status.
+
+    Args:
+        total_frames (int): Number of frames of the complete run.
+        interval (float): (60) Seconds between reports, only the final report if 0.
+        outputs (list): (None) Output files whose total size is reported.
+        output_metrics_path (str): (None) Output JSON metrics file.
+        poll_crd_path (str): (None) Growing CRD trajectory polled to count the frames of a binary.
+        natoms (int): (None) Number of atoms of the polled CRD trajectory.
+        frames (int): (0) Frames already written when the run starts (resumed runs), not counted in the throughput.
+        out_log (logging.Logger): (None) Biobb log.
+    """
+
+    def __init__(self, total_frames: int, interval: float = 60, outputs: Optional[list] = None,
+                 output_metrics_path: Optional[str] = None, poll_crd_path: Optional[str] = None,
+                 natoms: Optional[int] = None, frames: int = 0, out_log=None) -> None:
+        self.total_frames = total_frames
+        self.interval = float(interval or 0)
+        self.outputs = [output for output in (outputs or []) if output]
+        self.output_metrics_path = output_metrics_path
+        self.poll_crd_path = poll_crd_path
+        self.natoms = natoms
+        self.out_log = out_log
+        self.frames = self.initial_frames = frames
+        self.start_time = self.last_report = self.last_frame_time = time.monotonic()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def __enter__(self) -> 'ProgressMonitor':
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, *exc_info) -> None:
+        self.stop('failed' if exc_type else 'finished')
+
+    def start(self) -> None:
+        """Start the clock and, for a binary, the thread polling its trajectory."""
+        self.start_time = self.last_report = self.last_frame_time = time.monotonic()
+        if self.poll_crd_path and self.interval > 0:
+            self._thread = threading.Thread(target=self._poll, daemon=True)
+            self._thread.start()
+
+    def _poll(self) -> None:
+        while not self._stop.wait(self.interval):
+            self._count(crd_frames(str(self.poll_crd_path), int(self.natoms or 0)))
+            self.report()
+
+    def _count(self, frames: int) -> None:
+        if frames != self.frames:
+            self.frames = frames
+            self.last_frame_time = time.monotonic()
+
+    def update(self, frames: int) -> None:
+        """Set the number of frames written, reporting if the interval has elapsed since the last report."""
+        self._count(frames)
+        if self.interval > 0 and time.monotonic() - self.last_report >= self.interval:
+            self.report()
+
+    def metrics(self, status: str = 'running') -> dict:
+        """Current progress and throughput of the run."""
+        now = time.monotonic()
+        elapsed = now - self.start_time
+        rate = (self.frames - self.initial_frames) / elapsed if elapsed > 0 else 0.0
+        remaining = max(self.total_frames - self.frames, 0)
+        return {'status': status,
+                'frames': self.frames,
+                'total_frames': self.total_frames,
+                'progress': 100.0 * self.frames / self.total_frames if self.total_frames else 100.0,
+                'elapsed_seconds': round(elapsed, 3),
+                'frames_per_second': round(rate, 3),
+                'eta_seconds': round(remaining / rate, 3) if rate > 0 else None,
+                'seconds_since_last_frame': round(now - self.last_frame_time, 3),
+                'output_size_bytes': sum(os.path.getsize(output) for output in self.outputs if Path(output).exists())}
+
+    def report(self, status: str = 'running') -> dict:
+        """Log the progress and write it to the metrics file."""
+        self.last_report = time.monotonic()
+        metrics = self.metrics(status)
+        eta = 'unknown' if metrics['eta_seconds'] is None else format_duration(metrics['eta_seconds'])
+        fu.log('Progress (%s): %d/%d frames (%.1f%%), %.2f frames/s, elapsed %s, ETA %s, output %.2f MB' %
+               (status, metrics['frames'], self.total_frames, metrics['progress'], metrics['frames_per_second'],
+                format_duration(metrics['elapsed_seconds']), eta, metrics['output_size_bytes'] / 1e6), self.out_log)
+        if self.output_metrics_path:
+            tmp_path = self.output_metrics_path + '.tmp'
+            with open(tmp_path, 'w') as metrics_file:
+                json.dump(metrics, metrics_file, indent=4)
+            os.replace(tmp_path, self.output_metrics_path)
+        return metrics
+
+    def stop(self, status: str = 'finished') -> dict:
+        """Stop polling and make the final report."""
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        if self.poll_crd_path:
+            self._count(crd_frames(self.poll_crd_path, int(self.natoms or 0)))
+        return self.report(status)
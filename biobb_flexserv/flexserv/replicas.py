@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+"""Module containing the functions used by the FlexServ runners to generate ensembles of independent seeded replicas."""
+import json
+import random
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Optional
+from biobb_common.tools import file_utils as fu
+from biobb_flexserv.flexserv.crdfile import CRDfile
+from biobb_flexserv.flexserv.ensemble import read_ca_atoms
+from biobb_flexserv.flexserv.nma import read_ca_coords
+from biobb_flexserv.pcasuite import pca
+
+
+def replica_seeds(seed: Optional[int], replicas: int) -> list[int]:
+    """Seeds of the replicas: seed, seed + 1... or consecutive seeds from a random one if seed is not given."""
+    if seed is None:
+        seed = random.SystemRandom().randrange(2 ** 31)
+    return [int(seed) + replica for replica in range(replicas)]
+
+
+def run_replica(block_class, input_pdb_path: str, output_log_path: str, output_crd_path: str, properties: dict) -> int:
+    """Launch a single replica, in the current process or in a worker of the pool."""
+    return block_class(input_pdb_path=input_pdb_path, output_log_path=output_log_path,
+                       output_crd_path=output_crd_path, properties=properties).launch()
+
+
+def run_replicas(block_class, io_dict: dict, properties: dict, seeds: list[int], n_workers: int = 1,
+                 sandbox_path: str = './', out_log=None) -> list[str]:
+    """Run one replica per seed, each one in its own sandbox directory, and merge their outputs.
+
+    The replicas run concurrently in a pool of n_workers processes. Their trajectories are
+    concatenated in replica order into the output CRD file and/or compressed together into
+    the output PCZ file, their logs into the output log file and, if requested, the frames
+    of every replica are listed in the output index file.
+    Returns the replica directories, to be removed by the calling block.
+    """
+    replica_properties = {key: value for key, value in properties.items() if key not in ('replicas', 'n_workers')}
+    replica_properties.update({'disable_logs': True, 'restart': False})
+
+    replica_dirs = []
+    jobs = []
+    for replica, seed in enumerate(seeds):
+        replica_dir = fu.create_unique_dir(path=str(sandbox_path), prefix='replica%d_' % replica, out_log=out_log)
+        replica_dirs.append(replica_dir)
+        jobs.append((block_class,
+                     io_dict["in"]["input_pdb_path"],
+                     str(Path(replica_dir).joinpath('replica.log')),
+                     str(Path(replica_dir).joinpath('replica.crd')),
+                     dict(replica_properties, seed=seed, sandbox_path=replica_dir)))
+
+    if n_workers > 1:
+        with ProcessPoolExecutor(max_workers=min(n_workers, len(jobs))) as pool:
+            return_codes = list(pool.map(run_replica, *zip(*jobs)))
+    else:
+        return_codes = [run_replica(*job) for job in jobs]
+    for replica, return_code in enumerate(return_codes):
+        if return_code:
+            raise SystemExit('Replica %d (seed %d) failed with exit code %d' % (replica, seeds[replica], return_code))
+
+    natoms = len(read_ca_coords(io_dict["in"]["input_pdb_path"]))
+    trajectories = [CRDfile(job[3], natoms=natoms) for job in jobs]
+    frames = [len(trajectory) for trajectory in trajectories]
+    if io_dict["out"].get("output_crd_path"):
+        merge_crd([job[3] for job in jobs], io_dict["out"]["output_crd_path"])
+    if io_dict["out"].get("output_pcz_path"):
+        # Fused mode: the replicas are compressed together, streamed from their sandboxes
+        pca.compress(lambda: (trajectory.read() for trajectory in trajectories), io_dict["out"]["output_pcz_path"],
+                     read_ca_atoms(io_dict["in"]["input_pdb_path"]), properties.get('neigenv', 0), properties.get('variance'),
+                     title=trajectories[0].title)
+    with open(io_dict["out"]["output_log_path"], 'w') as log_file:
+        for replica, job in enumerate(jobs):
+            log_file.write('Replica %d (seed %d)\n' % (replica, seeds[replica]))
+            with open(job[2]) as replica_log:
+                shutil.copyfileobj(replica_log, log_file)
+    if io_dict["out"].get("output_index_path"):
+        write_index(io_dict["out"]["output_index_path"], seeds, frames)
+
+    return replica_dirs
+
+
+def merge_crd(input_crd_paths: list[str], output_crd_path: str) -> None:
+    """Concatenate CRD trajectories, keeping the title of the first one."""
+    with open(output_crd_path, 'wb') as output_crd:
+        for trajectory, input_crd_path in enumerate(input_crd_paths):
+            with open(input_crd_path, 'rb') as input_crd:
+                title = input_crd.readline()
+                if not trajectory:
+                    output_crd.write(title)
+                shutil.copyfileobj(input_crd, output_crd)
+
+
+def write_index(output_index_path: str, seeds: list[int], frames: list[int]) -> None:
+    """Write the seed and the frame range (first frame included, last frame excluded) of every replica of a merged trajectory."""
+    index = []
+    first_frame = 0
+    for replica, (seed, replica_frames) in enumerate(zip(seeds, frames)):
+        index.append({'replica': replica, 'seed': seed, 'first_frame': first_frame,
+                      'last_frame': first_frame + replica_frames, 'frames': replica_frames})
+        first_frame += replica_frames
+    with open(output_index_path, 'w') as index_file:
+        json.dump({'replicas': index}, index_file, indent=4)
@@ -5,10 +5,11 @@ from . import pcz_bfactor
 from . import pcz_hinges
 from . import pcz_stiffness
 from . import pcz_similarity
+from . import pcz_similarity_matrix
 from . import pcz_collectivity
 from . import pcz_info
 from . import pcz_evecs
 from . import pcz_lindemann
 
 name = "pcasuite"
-__all__ = ["pcz_zip", "pcz_unzip", "pcz_animate", "pcz_bfactor", "pcz_hinges", "pcz_stiffness", "pcz_similarity", "pcz_collectivity", "pcz_info", "pcz_evecs", "pcz_lindemann"]
+__all__ = ["pcz_zip", "pcz_unzip", "pcz_animate", "pcz_bfactor", "pcz_hinges", "pcz_stiffness", "pcz_similarity", "pcz_similarity_matrix", "pcz_collectivity", "pcz_info", "pcz_evecs", "pcz_lindemann"]
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+
+"""Module containing the native trajectory fitting functions: batched Kabsch superposition, Gaussian-weighted RMSd fitting and average structure refinement."""
+from typing import Callable, Iterable, Iterator, Optional
+from functools import partial
+import numpy as np
+
+# Default width (Angstrom^2) of the Gaussian weights exp(-d^2 / width) of the Gaussian-weighted RMSd.
+# It is not the weighting of pcazip -g, so the Gaussian fits differ from the pcazip ones
+# and their PCZ files are marked with the Native Gaussian RMSd type
+GAUSSIAN_WIDTH = 2.0
+
+
+def center(coords: np.ndarray, weights: Optional[np.ndarray] = None) -> np.ndarray:
+    """Move the (weighted) centroid of the atoms of one or more frames to the origin."""
+    return coords - centroid(coords, weights)
+
+
+def centroid(coords: np.ndarray, weights: Optional[np.ndarray] = None) -> np.ndarray:
+    if weights is None:
+        return coords.mean(axis=-2, keepdims=True)
+    weights = weights[..., np.newaxis]
+    return np.sum(coords * weights, axis=-2, keepdims=True) / np.sum(weights, axis=-2, keepdims=True)
+
+
+def rotations(coords: np.ndarray, reference: np.ndarray, weights: Optional[np.ndarray] = None) -> np.ndarray:
+    """Optimal (Kabsch) rotation matrices of a block of centered (frames, atoms, 3) coordinates onto a centered reference.
+
+    All the frames are solved at once with a batched 3x3 SVD. The weights are given per atom,
+    as an (atoms,) array shared by all the frames or as a (frames, atoms) array.
+    """
+    if weights is not None:
+        reference = reference * weights[..., np.newaxis]
+    correlation = np.matmul(coords.transpose(0, 2, 1), reference)
+    u, _, vt = np.linalg.svd(correlation)
+    # Avoid reflections
+    u[:, :, 2] *= np.sign(np.linalg.det(np.matmul(u, vt)))[:, np.newaxis]
+    return np.matmul(u, vt)
+
+
+def fit(coords: np.ndarray, reference: np.ndarray, weights: Optional[np.ndarray] = None) -> np.ndarray:
+    """Least-squares superposition of a (frames, atoms, 3) block of coordinates onto an (atoms, 3) reference."""
+    reference_centroid = centroid(reference, weights)
+    coords = center(coords, weights)
+    return np.matmul(coords, rotations(coords, reference - reference_centroid, weights)) + reference_centroid
+
+
+def rmsd(coords: np.ndarray, reference: np.ndarray, weights: Optional[np.ndarray] = None) -> np.ndarray:
+    """(Weighted) RMSd of every frame of a block of already fitted coordinates to the reference."""
+    squared_deviations = np.sum((coords - reference) ** 2, axis=-1)
+    return np.sqrt(np.average(squared_deviations, axis=-1, weights=weights))
+
+
+def gaussian_fit(coords: np.ndarray, reference: np.ndarray, width: float = GAUSSIAN_WIDTH,
+                 tolerance: float = 1e-4, max_iterations: int = 100) -> np.ndarray:
+    """Gaussian-weighted RMSd superposition of a (frames, atoms, 3) block of coordinates onto an (atoms, 3) reference.
+
+    Every atom is weighted by exp(-d^2 / width), where d is its deviation from the reference
+    after the previous fit, so the rigid core of the structure drives the superposition
+    and the flexible regions are down-weighted. The weights of all the frames are refined
+    at once, and every frame leaves the refinement when its largest weight change is below tolerance.
+    """
+    weights = np.ones(coords.shape[:2])
+    fitted = fit(coords, reference)
+    active = np.arange(len(coords))
+    for _ in range(max_iterations):
+        new_weights = np.exp(-np.sum((fitted[active] - reference) ** 2, axis=-1) / width)
+        # Keep the weights usable for frames far away from the reference
+        new_weights = np.maximum(new_weights, 1e-6)
+        changed = np.max(np.abs(new_weights - weights[active]), axis=1) >= tolerance
+        weights[active] = new_weights
+        fitted[active] = fit(coords[active], reference, new_weights)
+        active = active[changed]
+        if not active.size:
+            break
+    return fitted
+
+
+def average_structure(blocks: Callable[[], Iterable[np.ndarray]], iterations: int = 1, gaussian: bool = False,
+                      tolerance: float = 1e-4, width: float = GAUSSIAN_WIDTH) -> np.ndarray:
+    """Average structure of a trajectory given as (frames, atoms, 3) blocks.
+
+    The frames are first fitted onto the first one, as done by pcazip. Every further
+    iteration fits them again onto the previous average, until the average moves less
+    than tolerance (RMSd in Angstroms). With gaussian, the frames are fitted with gaussian_fit of the given width.
+    """
+    fit_function = partial(gaussian_fit, width=width) if gaussian else fit
+    average = center(next(iter(blocks()))[0].astype(np.float64))
+    for _ in range(max(1, iterations)):
+        reference = average
+        total = np.zeros_like(reference)
+        nframes = 0
+        for block in blocks():
+            total += fit_function(block.astype(np.float64), reference).sum(axis=0)
+            nframes += len(block)
+        average = total / nframes
+        if rmsd(fit(average[np.newaxis], reference), reference)[0] < tolerance:
+            break
+    return average
+
+
+def displacements(blocks: Iterable[np.ndarray], average: np.ndarray, gaussian: bool = False,
+                  width: float = GAUSSIAN_WIDTH) -> Iterator[np.ndarray]:
+    """Displacements from the average structure of every block of frames fitted onto it, as (frames, 3 x atoms) arrays."""
+    fit_function = partial(gaussian_fit, width=width) if gaussian else fit
+    for block in blocks:
+        yield fit_function(block.astype(np.float64), average).reshape(len(block), -1) - average.ravel()
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+
+"""Module containing the native PCA functions used to compress trajectories into PCZ files.
+
+The trajectory is given as blocks of (frames, 3 x atoms) displacements from the average structure,
+after fitting the frames with the functions of the fitting module.
+"""
+from typing import Callable, Iterable, Iterator, Optional
+from contextlib import contextmanager
+import tempfile
+import numpy as np
+from biobb_flexserv.pcasuite import fitting
+
+
+def read_pdb_atoms(input_pdb_path: str) -> np.ndarray:
+    """Atom records of a PDB file in the PCZ atom names layout (atom number, atom name, residue number, residue name and chain)."""
+    from biobb_flexserv.pcasuite.pczfile import PCZfile
+    atoms = []
+    with open(input_pdb_path) as pdb_file:
+        for line in pdb_file:
+            if line.startswith(('ATOM', 'HETATM')):
+                line = line.ljust(27)
+                atoms.append((int(line[6:11]), line[12:16].encode(), int(line[22:26]), line[17:20].encode(), line[21].encode()))
+    return np.array(atoms, dtype=PCZfile.ATOM_DTYPE)
+
+
+def covariance(displacements: Iterable[np.ndarray]) -> np.ndarray:
+    """Covariance matrix accumulated over blocks of (frames, 3 x atoms) displacements from the average structure.
+
+    The average comes from a previous pass over the trajectory, so the accumulated
+    products are already centered (two-pass algorithm) and do not lose precision.
+    """
+    displacements = iter(displacements)
+    block = next(displacements)
+    products = np.matmul(block.T, block)
+    nframes = len(block)
+    for block in displacements:
+        products += np.matmul(block.T, block)
+        nframes += len(block)
+    return products / nframes
+
+
+def project(displacements: Iterable[np.ndarray], evecs: np.ndarray) -> np.ndarray:
+    """Projections of every frame on every eigenvector as a (vectors, frames) array."""
+    return np.concatenate([np.matmul(evecs, block.T) for block in displacements], axis=1)
+
+
+def block_size(natoms: int, memory_budget: int, full_covariance: bool = True) -> int:
+    """Number of frames per block so that the covariance matrix and the temporary arrays fit in memory_budget MB."""
+    ncoords = 3 * natoms
+    # Covariance matrix plus the LAPACK copy used to diagonalize it
+    available = memory_budget * 1024 * 1024 - (2 * 8 * ncoords * ncoords if full_covariance else 0)
+    # Coordinates, centered, fitted and displacement float64 copies of every frame
+    frame_bytes = 4 * 8 * ncoords
+    if available < frame_bytes:
+        raise SystemExit('Memory budget of %d MB is too small for a %d x %d covariance matrix' % (memory_budget, ncoords, ncoords))
+    return available // frame_bytes
+
+
+def diagonalize(covariance_matrix: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Eigenvalues and eigenvectors (as rows) of a covariance matrix, in decreasing eigenvalue order."""
+    evals, evecs = np.linalg.eigh(covariance_matrix)
+    return evals[::-1], evecs[:, ::-1].T
+
+
+def total_variance(displacements: Iterable[np.ndarray]) -> float:
+    """Trace of the covariance matrix around the average structure, without building the matrix."""
+    squares = 0.0
+    nframes = 0
+    for block in displacements:
+        squares += float(np.sum(block ** 2))
+        nframes += len(block)
+    return squares / nframes
+
+
+def covariance_product(displacements: Iterable[np.ndarray], vectors: np.ndarray) -> np.ndarray:
+    """Product of the covariance matrix by a (3 x atoms, k) array, accumulated block by block without building the matrix."""
+    product = np.zeros_like(vectors)
+    nframes = 0
+    for block in displacements:
+        product += np.matmul(block.T, np.matmul(block, vectors))
+        nframes += len(block)
+    return product / nframes
+
+
+@contextmanager
+def cached_blocks(blocks: Iterable[np.ndarray], memory_budget: int = 0) -> Iterator[Callable[[], Iterable[np.ndarray]]]:
+    """Store the (frames, 3 x atoms) blocks of a single pass to iterate over them again without recomputing them.
+
+    The blocks are kept in memory up to memory_budget MB (0: no limit). Beyond it they are
+    spilled to a temporary file, read back in blocks of the same size through a memory map.
+    """
+    stored: list[np.ndarray] = []
+    stored_bytes = 0
+    with tempfile.TemporaryFile() as spill_file:
+        spilled = None
+        for block in blocks:
+            if spilled is None and memory_budget and stored_bytes + block.nbytes > memory_budget * 1024 * 1024:
+                spilled = (len(stored[0]) if stored else len(block), block.shape[1])
+                for stored_block in stored:
+                    spill_file.write(np.ascontiguousarray(stored_block, dtype=np.float64).tobytes())
+                stored = []
+            if spilled is None:
+                stored.append(block)
+                stored_bytes += block.nbytes
+            else:
+                spill_file.write(np.ascontiguousarray(block, dtype=np.float64).tobytes())
+        if spilled is None:
+            yield lambda: iter(stored)
+            return
+        spill_file.flush()
+        frames_per_block, ncoords = spilled
+        mapped = np.memmap(spill_file, dtype=np.float64, mode='r').reshape(-1, ncoords)
+        yield lambda: (np.asarray(mapped[start:start + frames_per_block]) for start in range(0, len(mapped), frames_per_block))
+
+
+def randomized_diagonalize(displacements: Callable[[], Iterable[np.ndarray]], ncoords: int, nmodes: int,
+                           oversampling: int = 10, power_iterations: int = 2, seed: int = 0) -> tuple[np.ndarray, np.ndarray]:
+    """Leading nmodes eigenvalues and eigenvectors (as rows) of the covariance matrix by randomized subspace iteration.
+
+    Every product by the covariance matrix is a new pass over the displacement blocks, so the
+    3 x atoms square matrix is never built and the cost is linear in the number of atoms.
+    """
+    rank = min(nmodes + oversampling, ncoords)
+    basis = np.random.default_rng(seed).standard_normal((ncoords, rank))
+    for _ in range(power_iterations + 1):
+        basis, _ = np.linalg.qr(covariance_product(displacements(), basis))
+    # Rayleigh-Ritz projection of the covariance matrix on the subspace
+    evals, small_evecs = np.linalg.eigh(np.matmul(basis.T, covariance_product(displacements(), basis)))
+    evecs = np.matmul(basis, small_evecs[:, ::-1]).T
+    return evals[::-1][:nmodes], evecs[:nmodes]
+
+
+def truncated_modes(displacements: Callable[[], Iterable[np.ndarray]], ncoords: int, total: float,
+                    neigenv: int = 0, variance: Optional[float] = None, nmodes: int = 16) -> tuple[np.ndarray, np.ndarray]:
+    """Leading modes of the covariance matrix, enough for neigenv or for the variance percentage of the total variance.
+
+    When selecting by variance, the number of computed modes is doubled until they capture it.
+    """
+    nmodes = min(neigenv or nmodes, ncoords)
+    while True:
+        evals, evecs = randomized_diagonalize(displacements, ncoords, nmodes)
+        nvecs = select_modes(evals, neigenv, variance, total)
+        if neigenv or nmodes == ncoords or evals[:nvecs].sum() / total >= (variance or 90) / 100:
+            return evals, evecs
+        nmodes = min(2 * nmodes, ncoords)
+
+
+def select_modes(evals: np.ndarray, neigenv: int = 0, variance: Optional[float] = None, total: Optional[float] = None) -> int:
+    """Number of modes to keep: neigenv if given, else the smallest set capturing the variance percentage of the total variance."""
+    if neigenv:
+        return min(neigenv, len(evals))
+    explained = np.cumsum(evals) / (total or evals.sum())
+    return min(int(np.searchsorted(explained, (variance or 90) / 100)) + 1, len(evals))
+
+
+def dimensionality(evals: np.ndarray) -> int:
+    """Number of eigenvalues larger than 1 Angstrom^2."""
+    return int(np.count_nonzero(evals > 1.0))
+
+
+def compress(blocks: Callable[[], Iterable[np.ndarray]], output_pcz_path: str, atoms: Optional[np.ndarray] = None,
+             neigenv: int = 0, variance: Optional[float] = None, gaussian: bool = False, average_iterations: int = 1,
+             solver: str = 'full', title: str = '', memory_budget: int = 0,
+             gaussian_width: float = fitting.GAUSSIAN_WIDTH) -> tuple[int, float]:
+    """Compress a trajectory given as (frames, atoms, 3) blocks into a PCZ file, as pcazip does.
+
+    The frames are fitted onto the average structure, the covariance matrix is diagonalized
+    (or its leading modes computed with the randomized solver) and the eigenvectors needed
+    for neigenv or for the variance percentage are kept with the projections of every frame.
+    With gaussian, the frames are fitted with Gaussian weights of gaussian_width (Angstrom^2),
+    recorded as the Native Gaussian RMSd type since it is not the pcazip -g weighting.
+    The many passes of the randomized solver reuse the displacements of a single fitting pass,
+    cached within memory_budget MB (0: no limit) and spilled to a temporary file beyond it.
+    Returns the number of eigenvectors kept and the fraction of the total variance they capture.
+    """
+    # Average structure from the frames fitted onto the first one (and refined), then all the frames fitted onto it
+    average = fitting.average_structure(blocks, average_iterations, gaussian, width=gaussian_width)
+
+    def displacements():
+        return fitting.displacements(blocks(), average, gaussian, gaussian_width)
+
+    if solver == 'randomized':
+        with cached_blocks(displacements(), memory_budget) as fitted:
+            # Only the leading modes, the total variance is the trace of the covariance matrix
+            total = total_variance(fitted())
+            evals, evecs = truncated_modes(fitted, average.size, total, neigenv, variance)
+            nvecs = select_modes(evals, neigenv, variance, total)
+            projections = project(fitted(), evecs[:nvecs])
+    else:
+        evals, evecs = diagonalize(covariance(displacements()))
+        total = evals.sum()
+        nvecs = select_modes(evals, neigenv, variance, total)
+        projections = project(displacements(), evecs[:nvecs])
+    evecs = evecs[:nvecs]
+
+    from biobb_flexserv.pcasuite.pczfile import write_pcz
+    write_pcz(output_pcz_path, average.ravel(), evals[:nvecs], evecs, projections,
+              total, dimensionality(evals), atoms, title=title, rmsd_type=2 if gaussian else 0)
+    return nvecs, float(evals[:nvecs].sum() / total)
@@ -4,9 +4,39 @@
 from typing import Optional
 import shutil
 from pathlib import PurePath
+import numpy as np
 from biobb_common.tools import file_utils as fu
 from biobb_common.generic.biobb_object import BiobbObject
 from biobb_common.tools.file_utils import launchlogger
+from biobb_flexserv.pcasuite.pczfile import PCZfile
+
+
+def bfactors(pcz: PCZfile) -> np.ndarray:
+    """B-factors of every atom for all the modes at once, as a (vectors + 1, atoms) array.
+
+    Row 0 is the B-factor of the whole set of modes (the eigenvalue weighted sum of the squared
+    per-atom displacements, 8 pi^2 / 3 times the mean square fluctuation of the atoms along the
+    trajectory). Row k is that of mode k, which pczdump --bfactor --fluc=k computes from the unit
+    eigenvector alone: it is not weighted by the eigenvalue, so the rows 1.. are not in the same
+    units as row 0 and do not add up to it. All of them are scaled by 8 pi^2 / 3.
+    """
+    squares = np.square(np.asarray(pcz.evecs, dtype=np.float64).reshape(pcz.nvecs, pcz.natoms, 3)).sum(axis=2)
+    table = np.empty((pcz.nvecs + 1, pcz.natoms))
+    table[0] = np.matmul(np.asarray(pcz.evals, dtype=np.float64), squares)
+    table[1:] = squares
+    return table * 8 * np.pi ** 2 / 3
+
+
+def write_bfactors_pdb(output_pdb_path: str, pcz: PCZfile, values: np.ndarray) -> None:
+    """PDB file of the average structure with the given per-atom values in the B-factor column, as pczdump --pdb writes it."""
+    if pcz.atoms is None:
+        raise SystemExit('%s has no atom names, the PDB file cannot be written' % pcz.input_pcz_path)
+    coords = np.asarray(pcz.average, dtype=np.float64).reshape(-1, 3)
+    with open(output_pdb_path, 'w') as pdb_file:
+        for atom, (x, y, z), value in zip(pcz.atoms, coords, values):
+            pdb_file.write('ATOM  %5d %4s %3s %1s%4d    %8.3f%8.3f%8.3f      %6.2f\n' % (
+                atom['atom_num'], atom['atom_name'].decode(), atom['res_name'].decode(), atom['chain'].decode(),
+                atom['res_num'], x, y, z, value))
 
 
 class PCZbfactor(BiobbObject):
@@ -23,6 +53,8 @@ class PCZbfactor(BiobbObject):
             * **binary_path** (*str*) - ("pczdump") pczdump binary path to be used.
             * **eigenvector** (*int*) - (0) PCA mode (eigenvector) from which to extract bfactor values per residue (0 means average over all modes).
             * **pdb** (*bool*) - (False) Generate a PDB file with the computed bfactors (to be easily represented with colour scale)
+            * **backend** (*str*) - ("pczdump") Engine used to compute the bfactors: pczdump binary or in-process NumPy computation from the PCZ file, writing the PDB file from the same values (Options: pczdump, native)
+            * **all_modes** (*bool*) - (False) Native backend: write the bfactors of every mode as one table, one line per residue with a column for all the modes together (0) followed by a column per mode. Column 0 is weighted by the eigenvalues (Angstrom^2 units) while the per-mode columns come from the unit eigenvectors alone, unweighted as pczdump --fluc=k writes them, so the columns are not on the same scale. The PDB file still holds the bfactors of the given eigenvector.
             * **remove_tmp** (*bool*) - (True) [WF property] Remove temporal files.
             * **restart** (*bool*) - (False) [WF property] Do not execute if output files exist.
             * **sandbox_path** (*str*) - ("./") [WF property] Parent path to the sandbox directory.
@@ -72,11 +104,32 @@ class PCZbfactor(BiobbObject):
         self.binary_path = properties.get('binary_path', 'pczdump')
         self.eigenvector = properties.get('eigenvector', 1)
         self.pdb = properties.get('pdb', False)
+        self.backend = properties.get('backend', 'pczdump')
+        self.all_modes = properties.get('all_modes', False)
 
         # Check the properties
         self.check_properties(properties)
         self.check_arguments()
 
+    def launch_native(self):
+        """Computes the bfactors of every mode from a single read of the PCZ file, without calling pczdump."""
+
+        pcz = PCZfile(self.io_dict["in"]["input_pcz_path"])
+        if not 0 <= self.eigenvector <= pcz.nvecs:
+            raise SystemExit('Eigenvector %d out of range (0-%d)' % (self.eigenvector, pcz.nvecs))
+        fu.log('Computing the bfactors of %d modes with the native backend' % pcz.nvecs, self.out_log)
+
+        table = bfactors(pcz)
+        columns = table.T if self.all_modes else table[self.eigenvector][:, None]
+        np.savetxt(self.io_dict["out"]["output_dat_path"], columns, fmt='%10.6f', delimiter=' ')
+
+        if self.pdb:
+            write_bfactors_pdb(self.io_dict["out"]["output_pdb_path"], pcz, table[self.eigenvector])
+
+        self.check_arguments(output_files_created=True, raise_exception=False)
+
+        return self.return_code
+
     @launchlogger
     def launch(self):
         """Launches the execution of the FlexServ pcz_bfactor module."""
@@ -98,6 +151,12 @@ class PCZbfactor(BiobbObject):
         #     output_pdb = self.stage_io_dict["out"]["output_pdb_path"]
         #     output_dat = self.stage_io_dict["out"]["output_dat_path"]
 
+        if self.backend == 'native':
+            return self.launch_native()
+
+        if self.all_modes:
+            raise SystemExit('all_modes needs the native backend')
+
         # Manually creating a Sandbox to avoid issues with input parameters buffer overflow:
         #   Long strings defining a file path makes Fortran or C compiled programs crash if the string
         #   declared is shorter than the input parameter path (string) length.
@@ -8,6 +8,22 @@ from biobb_common.tools import file_utils as fu
 import json
 from biobb_common.generic.biobb_object import BiobbObject
 from biobb_common.tools.file_utils import launchlogger
+import numpy as np
+from biobb_flexserv.pcasuite.pczfile import PCZfile
+
+
+def collectivity(evecs: np.ndarray) -> np.ndarray:
+    """Collectivity index (Bruschweiler, 1995) of every eigenvector of a (vectors, 3 x atoms) array, as a (vectors,) array.
+
+    The squared per-atom displacements of each mode are normalized to sum 1, and the index is
+    the exponential of their information entropy divided by the number of atoms: 1 when all
+    the atoms move alike and 1/atoms when a single atom moves.
+    """
+    evecs = np.asarray(evecs, dtype=np.float64)
+    squares = np.square(evecs.reshape(len(evecs), -1, 3)).sum(axis=2)
+    squares /= squares.sum(axis=1, keepdims=True)
+    logs = np.log(squares, out=np.zeros_like(squares), where=squares > 0)
+    return np.exp(-np.sum(squares * logs, axis=1)) / squares.shape[1]
 
 
 class PCZcollectivity(BiobbObject):
@@ -22,6 +38,7 @@ class PCZcollectivity(BiobbObject):
         properties (dict - Python dictionary object containing the tool parameters, not input/output files):
             * **eigenvector** (*int*) - (0) PCA mode (eigenvector) from which to extract stiffness.
             * **binary_path** (*str*) - ("pczdump") pczdump binary path to be used.
+            * **backend** (*str*) - ("pczdump") Engine used to compute the collectivity: pczdump binary or in-process NumPy computation of all the modes at once from the PCZ file (Options: pczdump, native)
             * **remove_tmp** (*bool*) - (True) [WF property] Remove temporal files.
             * **restart** (*bool*) - (False) [WF property] Do not execute if output files exist.
             * **sandbox_path** (*str*) - ("./") [WF property] Parent path to the sandbox directory.
@@ -69,11 +86,30 @@ class PCZcollectivity(BiobbObject):
         self.properties = properties
         self.binary_path = properties.get('binary_path', 'pczdump')
         self.eigenvector = properties.get('eigenvector', 0)
+        self.backend = properties.get('backend', 'pczdump')
 
         # Check the properties
         self.check_properties(properties)
         self.check_arguments()
 
+    def launch_native(self):
+        """Computes the collectivity of every mode reading the PCZ file in-process, without calling pczdump."""
+
+        pcz = PCZfile(self.io_dict["in"]["input_pcz_path"])
+        fu.log('Computing the collectivity of %d modes with the native backend' % pcz.nvecs, self.out_log)
+
+        # Eigenvector 0 means all the modes
+        evecs = pcz.evec(self.eigenvector)[None, :] if self.eigenvector else pcz.evecs
+        # Same precision as the pczdump --collectivity text output
+        info_dict = {'collectivity': [round(float(value), 6) for value in collectivity(evecs)]}
+
+        with open(self.io_dict["out"]["output_json_path"], 'w') as out_file:
+            out_file.write(json.dumps(info_dict, indent=4))
+
+        self.check_arguments(output_files_created=True, raise_exception=False)
+
+        return self.return_code
+
     @launchlogger
     def launch(self):
         """Launches the execution of the FlexServ pcz_collectivity module."""
@@ -93,6 +129,9 @@ class PCZcollectivity(BiobbObject):
         #     input_pcz = self.stage_io_dict["in"]["input_pcz_path"]
         #     output_json = self.stage_io_dict["out"]["output_json_path"]
 
+        if self.backend == 'native':
+            return self.launch_native()
+
         # Manually creating a Sandbox to avoid issues with input parameters buffer overflow:
         #   Long strings defining a file path makes Fortran or C compiled programs crash if the string
         #   declared is shorter than the input parameter path (string) length.
@@ -9,6 +9,7 @@ from pathlib import PurePath
 from biobb_common.tools import file_utils as fu
 from biobb_common.generic.biobb_object import BiobbObject
 from biobb_common.tools.file_utils import launchlogger
+from biobb_flexserv.pcasuite.pczfile import PCZfile
 
 
 class PCZevecs(BiobbObject):
@@ -23,6 +24,7 @@ class PCZevecs(BiobbObject):
         properties (dict - Python dictionary object containing the tool parameters, not input/output files):
             * **binary_path** (*str*) - ("pczdump") pczdump binary path to be used.
             * **eigenvector** (*int*) - (1) PCA mode (eigenvector) from which to extract eigen vectors.
+            * **backend** (*str*) - ("pczdump") Engine used to read the PCZ file: pczdump binary or in-process native PCZ reader (Options: pczdump, native)
             * **remove_tmp** (*bool*) - (True) [WF property] Remove temporal files.
             * **restart** (*bool*) - (False) [WF property] Do not execute if output files exist.
             * **sandbox_path** (*str*) - ("./") [WF property] Parent path to the sandbox directory.
@@ -70,11 +72,47 @@ class PCZevecs(BiobbObject):
         self.properties = properties
         self.binary_path = properties.get('binary_path', 'pczdump')
         self.eigenvector = properties.get('eigenvector', 1)
+        self.backend = properties.get('backend', 'pczdump')
 
         # Check the properties
         self.check_properties(properties)
         self.check_arguments()
 
+    # Module of the per-atom displacement (x, y, z) along the eigenvector
+    def get_projections(self, evecs):
+        projs = []
+        module = 1
+        proj = 0
+        for num in evecs:
+            val = float(num) * float(num)
+            proj = proj + val
+            if module % 3 == 0:
+                proj = math.sqrt(proj)
+                module = 1
+                projs.append(float("{:.4f}".format(proj)))
+                proj = 0
+            else:
+                module = module + 1
+        return projs
+
+    def launch_native(self):
+        """Extracts the eigen vector reading the PCZ file in-process, without calling pczdump."""
+
+        pcz = PCZfile(self.io_dict["in"]["input_pcz_path"])
+        fu.log('Reading %s with the native PCZ reader' % self.io_dict["in"]["input_pcz_path"], self.out_log)
+
+        info_dict = {}
+        # Same precision as the pczdump --evec text output
+        info_dict['evecs'] = ["%.3f" % val for val in pcz.evec(self.eigenvector)]
+        info_dict['projs'] = self.get_projections(info_dict['evecs'])
+
+        with open(self.io_dict["out"]["output_json_path"], 'w') as out_file:
+            out_file.write(json.dumps(info_dict, indent=4))
+
+        self.check_arguments(output_files_created=True, raise_exception=False)
+
+        return self.return_code
+
     @launchlogger
     def launch(self):
         """Launches the execution of the FlexServ pcz_evecs module."""
@@ -94,6 +132,9 @@ class PCZevecs(BiobbObject):
         #     input_pcz = self.stage_io_dict["in"]["input_pcz_path"]
         #     output_json = self.stage_io_dict["out"]["output_json_path"]
 
+        if self.backend == 'native':
+            return self.launch_native()
+
         # Manually creating a Sandbox to avoid issues with input parameters buffer overflow:
         #   Long strings defining a file path makes Fortran or C compiled programs crash if the string
         #   declared is shorter than the input parameter path (string) length.
@@ -143,19 +184,7 @@ class PCZevecs(BiobbObject):
                         info_dict['evecs'].append(nums)
 
         # Computing Projections
-        info_dict['projs'] = []
-        module = 1
-        proj = 0
-        for num in info_dict['evecs']:
-            val = float(num) * float(num)
-            proj = proj + val
-            if module % 3 == 0:
-                proj = math.sqrt(proj)
-                module = 1
-                info_dict['projs'].append(float("{:.4f}".format(proj)))
-                proj = 0
-            else:
-                module = module + 1
+        info_dict['projs'] = self.get_projections(info_dict['evecs'])
 
         with open(PurePath(tmp_folder).joinpath(temp_json), 'w') as out_file:
             out_file.write(json.dumps(info_dict, indent=4))
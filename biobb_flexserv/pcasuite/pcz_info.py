@@ -8,6 +8,7 @@ from pathlib import PurePath
 from biobb_common.tools import file_utils as fu
 from biobb_common.generic.biobb_object import BiobbObject
 from biobb_common.tools.file_utils import launchlogger
+from biobb_flexserv.pcasuite.pczfile import PCZfile
 
 
 class PCZinfo(BiobbObject):
@@ -21,6 +22,7 @@ class PCZinfo(BiobbObject):
         output_json_path (str): Output json file with PCA info such as number of components, variance and dimensionality. File type: output. `Sample file <https://github.com/bioexcel/biobb_flexserv/raw/master/biobb_flexserv/test/reference/pcasuite/pcz_info.json>`_. Accepted formats: json (edam:format_3464).
         properties (dict - Python dictionary object containing the tool parameters, not input/output files):
             * **binary_path** (*str*) - ("pczdump") pczdump binary path to be used.
+            * **backend** (*str*) - ("pczdump") Engine used to read the PCZ file: pczdump binary or in-process native PCZ reader (Options: pczdump, native)
             * **remove_tmp** (*bool*) - (True) [WF property] Remove temporal files.
             * **restart** (*bool*) - (False) [WF property] Do not execute if output files exist.
             * **sandbox_path** (*str*) - ("./") [WF property] Parent path to the sandbox directory.
@@ -62,11 +64,47 @@ class PCZinfo(BiobbObject):
         # Properties specific for BB
         self.properties = properties
         self.binary_path = properties.get('binary_path', 'pczdump')
+        self.backend = properties.get('backend', 'pczdump')
 
         # Check the properties
         self.check_properties(properties)
         self.check_arguments()
 
+    # Add eigenvalues and accumulated variance percentages (vs total and vs explained variance) to the info dict
+    def add_dimensionality(self, info_dict, evals):
+        info_dict['Eigen_Values'] = []
+        info_dict['Eigen_Values_dimensionality_vs_total'] = []
+        info_dict['Eigen_Values_dimensionality_vs_explained'] = []
+        accum_tot = 0
+        accum_exp = 0
+        for eval in evals:
+            eval_var = (eval / float(info_dict['Total_variance']))*100
+            accum_tot = accum_tot + eval_var
+            eval_dim = (eval / float(info_dict['Explained_variance']))*100
+            accum_exp = accum_exp + eval_dim
+            info_dict['Eigen_Values'].append(eval)
+            info_dict['Eigen_Values_dimensionality_vs_total'].append(accum_tot)
+            info_dict['Eigen_Values_dimensionality_vs_explained'].append(accum_exp)
+        return info_dict
+
+    def launch_native(self):
+        """Extracts the PCA info reading the PCZ file in-process, without calling pczdump."""
+
+        pcz = PCZfile(self.io_dict["in"]["input_pcz_path"])
+        fu.log('Reading %s with the native PCZ reader' % self.io_dict["in"]["input_pcz_path"], self.out_log)
+
+        info_dict = pcz.info()
+        # Same precision as the pczdump --evals text output
+        evals = [float("%f" % eval) for eval in pcz.evals]
+        self.add_dimensionality(info_dict, evals)
+
+        with open(self.io_dict["out"]["output_json_path"], 'w') as out_file:
+            out_file.write(json.dumps(info_dict, indent=4))
+
+        self.check_arguments(output_files_created=True, raise_exception=False)
+
+        return self.return_code
+
     @launchlogger
     def launch(self):
         """Launches the execution of the FlexServ pcz_info module."""
@@ -86,6 +124,9 @@ class PCZinfo(BiobbObject):
         #     input_pcz = self.stage_io_dict["in"]["input_pcz_path"]
         #     output_json = self.stage_io_dict["out"]["output_json_path"]
 
+        if self.backend == 'native':
+            return self.launch_native()
+
         # Manually creating a Sandbox to avoid issues with input parameters buffer overflow:
         #   Long strings defining a file path makes Fortran or C compiled programs crash if the string
         #   declared is shorter than the input parameter path (string) length.
@@ -153,21 +194,11 @@ class PCZinfo(BiobbObject):
         # 170.061981
         # 89.214905
         # 39.836308
-        info_dict['Eigen_Values'] = []
-        info_dict['Eigen_Values_dimensionality_vs_total'] = []
-        info_dict['Eigen_Values_dimensionality_vs_explained'] = []
-        accum_tot = 0
-        accum_exp = 0
+        evals = []
         with open(PurePath(tmp_folder).joinpath(temp_out_2), 'r') as file:
             for line in file:
-                eval = float(line.strip())
-                eval_var = (eval / float(info_dict['Total_variance']))*100
-                accum_tot = accum_tot + eval_var
-                eval_dim = (eval / float(info_dict['Explained_variance']))*100
-                accum_exp = accum_exp + eval_dim
-                info_dict['Eigen_Values'].append(eval)
-                info_dict['Eigen_Values_dimensionality_vs_total'].append(accum_tot)
-                info_dict['Eigen_Values_dimensionality_vs_explained'].append(accum_exp)
+                evals.append(float(line.strip()))
+        self.add_dimensionality(info_dict, evals)
 
         with open(PurePath(tmp_folder).joinpath(temp_json), 'w') as out_file:
             out_file.write(json.dumps(info_dict, indent=4))
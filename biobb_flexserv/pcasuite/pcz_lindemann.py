@@ -1,13 +1,72 @@
 #!/usr/bin/env python3
 
 """Module containing the PCZlindemann class and the command line interface."""
-from typing import Optional
+from typing import Optional, Sequence
 import shutil
 import json
 from pathlib import PurePath
+import numpy as np
 from biobb_common.tools import file_utils as fu
 from biobb_common.generic.biobb_object import BiobbObject
 from biobb_common.tools.file_utils import launchlogger
+from biobb_flexserv.flexserv.contacts import Contacts
+from biobb_flexserv.pcasuite.pczfile import PCZfile
+
+# Minimum sequence separation of the non-bonded neighbours: the bonded (i + 1) and angle (i + 2) partners are skipped
+NEIGHBOUR_SEPARATION = 3
+# Cutoff distance (A) of the search of the nearest non-bonded neighbour of every atom
+NEIGHBOUR_CUTOFF = 10.0
+
+
+def atom_fluctuations(pcz: PCZfile) -> np.ndarray:
+    """Mean square fluctuation of every atom, summed over all the modes, as an (atoms,) array."""
+    squares = np.square(np.asarray(pcz.evecs, dtype=np.float64).reshape(pcz.nvecs, pcz.natoms, 3)).sum(axis=2)
+    return np.matmul(np.asarray(pcz.evals, dtype=np.float64), squares)
+
+
+def neighbour_distances(pcz: PCZfile) -> np.ndarray:
+    """Distance of every atom to its nearest non-bonded neighbour in the average structure, as an (atoms,) array
+    (inf for the atoms without neighbours closer than NEIGHBOUR_CUTOFF)."""
+    contacts = Contacts(np.asarray(pcz.average, dtype=np.float64).reshape(pcz.natoms, 3), NEIGHBOUR_CUTOFF,
+                        min_separation=NEIGHBOUR_SEPARATION)
+    distances = np.full(pcz.natoms, np.inf)
+    np.minimum.at(distances, contacts.first, contacts.distances)
+    np.minimum.at(distances, contacts.second, contacts.distances)
+    return distances
+
+
+def mask_selection(pcz: PCZfile, mask: str) -> np.ndarray:
+    """Boolean (atoms,) selection of a residue mask such as ":10,21,33" or ":10-20,33" (empty: all atoms)."""
+    residues = mask.strip().lstrip(':')
+    if not residues:
+        return np.ones(pcz.natoms, dtype=bool)
+    if pcz.atoms is None:
+        raise SystemExit('%s has no atom names, residue masks cannot be applied' % pcz.input_pcz_path)
+    res_nums = pcz.atoms['res_num']
+    selection = np.zeros(pcz.natoms, dtype=bool)
+    for item in residues.split(','):
+        first, _, last = item.strip().partition('-')
+        try:
+            selection |= (res_nums >= int(first)) & (res_nums <= int(last or first))
+        except ValueError:
+            raise SystemExit('Wrong residue mask %s: expected ":resnum1,resnum2" or ":first-last"' % mask)
+    if not selection.any():
+        raise SystemExit('Residue mask %s does not select any atom' % mask)
+    return selection
+
+
+def lindemann(fluctuations: np.ndarray, distances: np.ndarray, selections: Sequence[np.ndarray]) -> np.ndarray:
+    """Lindemann coefficient of every atom selection, as a (selections,) array.
+
+    The coefficient is the root mean square fluctuation of the selected atoms along one
+    coordinate divided by their mean distance to the nearest non-bonded neighbour. The
+    selections are stacked in a (selections, atoms) matrix, so the means of all of them come
+    from matrix products.
+    """
+    selections = np.asarray(selections, dtype=np.float64)
+    found = np.isfinite(distances)
+    mean_distances = np.matmul(selections, np.where(found, distances, 0.0)) / np.matmul(selections, found)
+    return np.sqrt(np.matmul(selections, fluctuations) / (3.0 * selections.sum(axis=1))) / mean_distances
 
 
 class PCZlindemann(BiobbObject):
@@ -22,6 +81,8 @@ class PCZlindemann(BiobbObject):
         properties (dict - Python dictionary object containing the tool parameters, not input/output files):
             * **binary_path** (*str*) - ("pczdump") pczdump binary path to be used.
             * **mask** (*str*) - ("all atoms") Residue mask, in the format ":resnum1, resnum2, resnum3" (e.g. ":10,21,33"). See https://mmb.irbbarcelona.org/software/pcasuite/ for the complete format specification.
+            * **backend** (*str*) - ("pczdump") Engine used to compute the Lindemann coefficient: pczdump binary or in-process NumPy computation from the PCZ file (Options: pczdump, native)
+            * **masks** (*list*) - (None) Native backend: list of residue masks (e.g. [":10-20", ":35,36,40"]) evaluated in the same pass. The native backend only reads residue numbers and first-last ranges.
             * **remove_tmp** (*bool*) - (True) [WF property] Remove temporal files.
             * **restart** (*bool*) - (False) [WF property] Do not execute if output files exist.
             * **sandbox_path** (*str*) - ("./") [WF property] Parent path to the sandbox directory.
@@ -67,11 +128,34 @@ class PCZlindemann(BiobbObject):
         self.properties = properties
         self.binary_path = properties.get('binary_path', 'pczdump')
         self.mask = properties.get('mask', '')
+        self.backend = properties.get('backend', 'pczdump')
+        self.masks = properties.get('masks', [])
 
         # Check the properties
         self.check_properties(properties)
         self.check_arguments()
 
+    def launch_native(self):
+        """Computes the Lindemann coefficient of every mask from a single read of the PCZ file, without calling pczdump."""
+
+        pcz = PCZfile(self.io_dict["in"]["input_pcz_path"])
+        fu.log('Computing the Lindemann coefficient of %d masks with the native backend' % (len(self.masks) + 1), self.out_log)
+
+        # Fluctuations and neighbour distances computed once, every mask is a row of the selection matrix
+        masks = [self.mask] + list(self.masks)
+        values = lindemann(atom_fluctuations(pcz), neighbour_distances(pcz), [mask_selection(pcz, mask) for mask in masks])
+
+        info_dict = {'lindemann': float(values[0])}
+        if self.masks:
+            info_dict['masks'] = {mask: float(value) for mask, value in zip(self.masks, values[1:])}
+
+        with open(self.io_dict["out"]["output_json_path"], 'w') as out_file:
+            out_file.write(json.dumps(info_dict, indent=4))
+
+        self.check_arguments(output_files_created=True, raise_exception=False)
+
+        return self.return_code
+
     @launchlogger
     def launch(self):
         """Launches the execution of the FlexServ pcz_lindemann module."""
@@ -91,6 +175,12 @@ class PCZlindemann(BiobbObject):
         #     input_pcz = self.stage_io_dict["in"]["input_pcz_path"]
         #     output_json = self.stage_io_dict["out"]["output_json_path"]
 
+        if self.backend == 'native':
+            return self.launch_native()
+
+        if self.masks:
+            raise SystemExit('masks needs the native backend')
+
         # Manually creating a Sandbox to avoid issues with input parameters buffer overflow:
         #   Long strings defining a file path makes Fortran or C compiled programs crash if the string
         #   declared is shorter than the input parameter path (string) length.
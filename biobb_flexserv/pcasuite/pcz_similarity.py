@@ -7,9 +7,9 @@ import numpy as np
 import shutil
 from pathlib import PurePath
 from biobb_common.tools import file_utils as fu
-from math import exp
 from biobb_common.generic.biobb_object import BiobbObject
 from biobb_common.tools.file_utils import launchlogger
+from biobb_flexserv.pcasuite.pczfile import PCZfile
 
 
 class PCZsimilarity(BiobbObject):
@@ -22,9 +22,12 @@ class PCZsimilarity(BiobbObject):
         input_pcz_path1 (str): Input compressed trajectory file 1. File type: input. `Sample file <https://github.com/bioexcel/biobb_flexserv/raw/master/biobb_flexserv/test/data/pcasuite/pcazip.pcz>`_. Accepted formats: pcz (edam:format_3874).
         input_pcz_path2 (str): Input compressed trajectory file 2. File type: input. `Sample file <https://github.com/bioexcel/biobb_flexserv/raw/master/biobb_flexserv/test/data/pcasuite/pcazip.pcz>`_. Accepted formats: pcz (edam:format_3874).
         output_json_path (str): Output json file with PCA Similarity results. File type: output. `Sample file <https://github.com/bioexcel/biobb_flexserv/raw/master/biobb_flexserv/test/reference/pcasuite/pcz_similarity.json>`_. Accepted formats: json (edam:format_3464).
+        output_npz_path (str) (Optional): Output NumPy npz file with the eigenvalues (evals_1, evals_2) and eigenvectors (evecs_1, evecs_2) of both files. File type: output. `Sample file <https://github.com/bioexcel/biobb_flexserv/raw/master/biobb_flexserv/test/reference/pcasuite/pcz_similarity.npz>`_. Accepted formats: npz (edam:format_4003).
         properties (dict - Python dictionary object containing the tool parameters, not input/output files):
             * **amplifying_factor** (*float*) - ("0.0") common displacement (dx) along the different eigenvectors. If 0, the result is the absolute similarity index (dot product).
             * **binary_path** (*str*) - ("pczdump") pczdump binary path to be used.
+            * **compact** (*bool*) - (False) Write only the similarity indexes and metadata to the output json file, leaving out the eigenvalues and eigenvectors of both files (use output_npz_path to keep them).
+            * **backend** (*str*) - ("pczdump") Engine used to read the PCZ files: one pczdump call per eigenvector or in-process native PCZ reader extracting all eigenvectors of a file in a single pass (Options: pczdump, native)
             * **remove_tmp** (*bool*) - (True) [WF property] Remove temporal files.
             * **restart** (*bool*) - (False) [WF property] Do not execute if output files exist.
             * **sandbox_path** (*str*) - ("./") [WF property] Parent path to the sandbox directory.
@@ -51,7 +54,8 @@ class PCZsimilarity(BiobbObject):
     """
 
     def __init__(self, input_pcz_path1: str, input_pcz_path2: str,
-                 output_json_path: str, properties: Optional[dict] = None, **kwargs) -> None:
+                 output_json_path: str, output_npz_path: Optional[str] = None,
+                 properties: Optional[dict] = None, **kwargs) -> None:
 
         properties = properties or {}
 
@@ -63,13 +67,16 @@ class PCZsimilarity(BiobbObject):
         self.io_dict = {
             'in': {'input_pcz_path1': input_pcz_path1,
                    'input_pcz_path2': input_pcz_path2},
-            'out': {'output_json_path': output_json_path}
+            'out': {'output_json_path': output_json_path,
+                    'output_npz_path': output_npz_path}  # type: ignore
         }
 
         # Properties specific for BB
         self.properties = properties
         self.amplifying_factor = properties.get('amplifying_factor')
+        self.compact = properties.get('compact', False)
         self.binary_path = properties.get('binary_path', 'pczdump')
+        self.backend = properties.get('backend', 'pczdump')
 
         # Check the properties
         self.check_properties(properties)
@@ -110,14 +117,16 @@ class PCZsimilarity(BiobbObject):
         # Eigenvectors are atom coordinates and each atom has 3 coordinates (x, y, z)
         if len(eigenvectors_1[0]) % 3 != 0:
             raise SystemExit('Something is wrong with eigenvectors since number of values is not divisor of 3')
-        atom_number = int(len(eigenvectors_1[0]) / 3)
+
+        evals1 = np.asarray(eigenvalues_1, dtype=np.float64)
+        evals2 = np.asarray(eigenvalues_2, dtype=np.float64)
 
         # Amplifying factor: if it is 0 the algorithm is the same as a simple dot product.
         # The value of the ~10th eigenvalue is usually taken.
         if dx is not None:
             amplifying_factor = dx
         else:
-            amplifying_factor = eigenvalues_1[eigenvectors_number-1]
+            amplifying_factor = evals1[eigenvectors_number-1]
 
         # Get the denominator
         # Find new denominator
@@ -127,40 +136,21 @@ class PCZsimilarity(BiobbObject):
         #     $part1+=exp(-2/$val_1[$i]*$ampf)*exp(-2/$val_1[$i]*$ampf);
         #     $part2+=exp(-2/$val_2[$i]*$ampf)*exp(-2/$val_2[$i]*$ampf);
         # }
-        cte1 = part1 = cte2 = part2 = 0
-        for eigenvalue in eigenvalues_1:
-            cte1 += exp(-1 / eigenvalue * amplifying_factor)
-            part1 += exp(-2 / eigenvalue * amplifying_factor) ** 2
-        for eigenvalue in eigenvalues_2:
-            cte2 += exp(-1 / eigenvalue * amplifying_factor)
-            part2 += exp(-2 / eigenvalue * amplifying_factor) ** 2
+        cte1 = np.sum(np.exp(-1 / evals1 * amplifying_factor))
+        part1 = np.sum(np.exp(-2 / evals1 * amplifying_factor) ** 2)
+        cte2 = np.sum(np.exp(-1 / evals2 * amplifying_factor))
+        part2 = np.sum(np.exp(-2 / evals2 * amplifying_factor) ** 2)
         denominator = part1 * cte2 * cte2 / cte1 / cte1 + part2 * cte1 * cte1 / cte2 / cte2
 
-        # Get all eigenvector values together
-        eigenvector_values_1 = [v for ev in eigenvectors_1 for v in ev]
-        eigenvector_values_2 = [v for ev in eigenvectors_2 for v in ev]
-
-        # IDK what it is doing now
-        total_summatory = 0
-        for i in range(eigenvectors_number):
-            for j in range(eigenvectors_number):
-                # Array has vectors in increasing order of vap, get last one first
-                a = (eigenvectors_number - 1 - i) * atom_number * 3
-                b = (eigenvectors_number - i) * atom_number * 3 - 1
-                c = (eigenvectors_number - 1 - j) * atom_number * 3
-                d = (eigenvectors_number - j) * atom_number * 3 - 1
-                temp1 = eigenvector_values_1[a:b]
-                temp2 = eigenvector_values_2[c:d]
-                if len(temp1) != len(temp2):
-                    raise ValueError("Projection of vectors of different size!!")
-                # Project the two vectors
-                add = 0
-                for k, value_1 in enumerate(temp1):
-                    value_2 = temp2[k]
-                    add += value_1 * value_2
-                add = add * exp(-1 / eigenvalues_1[i] * amplifying_factor - 1 / eigenvalues_2[j] * amplifying_factor)
-                add2 = add ** 2
-                total_summatory += add2
+        # Array has vectors in increasing order of vap, get last one first.
+        # As in the original perl script, the last value of every vector is left out of the projection.
+        evecs1 = np.asarray(eigenvectors_1, dtype=np.float64)[eigenvectors_number-1::-1, :-1]
+        evecs2 = np.asarray(eigenvectors_2, dtype=np.float64)[eigenvectors_number-1::-1, :-1]
+
+        # Project all pairs of vectors with a single matrix product and weight them
+        projections = evecs1 @ evecs2.T
+        weights = np.exp(-1 / evals1[:eigenvectors_number, None] * amplifying_factor - 1 / evals2[None, :eigenvectors_number] * amplifying_factor)
+        total_summatory = np.sum((projections * weights) ** 2)
 
         similarity_index = total_summatory * 2 / denominator
         return similarity_index
@@ -171,13 +161,10 @@ class PCZsimilarity(BiobbObject):
     # Jose Maria Lopez-Bes, Xavier de la Cruz and Modesto Orozco. J. Chem. Theory Comput.2005,1.
     def eigenmsip(self, eigenvalues_1, eigenvectors_1,
                   eigenvalues_2, eigenvectors_2,
-                  dx=None):
-
-        evals1 = np.array(eigenvalues_1)
-        evals2 = np.array(eigenvalues_2)
+                  dx=None, dpm=None):
 
-        evecs1 = np.array(eigenvectors_1)
-        evecs2 = np.array(eigenvectors_2)
+        evals1 = np.asarray(eigenvalues_1, dtype=np.float64)
+        evals2 = np.asarray(eigenvalues_2, dtype=np.float64)
 
         n_components = len(eigenvectors_1)
 
@@ -198,24 +185,14 @@ class PCZsimilarity(BiobbObject):
 
         denominator = np.sum((e1_2/sume1**2)**2)+np.sum((e2_2/sume2**2)**2)
 
-        # numerator_df = np.square(np.dot(evecs1, evecs2)*np.outer(e1, e2)/(sume1*sume2))
-        # numerator_df = 2 * np.sum(numerator_df)
-
-        val_tmp = 0
-        accum_a = 0
+        # Overlap matrix of all pairs of components (one GEMM) weighted with the
+        # outer product of the exponential weights:
+        # exp(-dx^2/eva1 - dx^2/eva2) = exp(-dx^2/eva1) * exp(-dx^2/eva2)
+        if dpm is None:
+            dpm = self.dot_product(eigenvectors_1, eigenvectors_2)
         c = sume1*sume2
-        for pc in range(0, n_components):
-            for pc2 in range(0, n_components):
-                eve1 = evecs1[pc]
-                eve2 = evecs2[pc2]
-                eva1 = evals1[pc]
-                eva2 = evals2[pc2]
-                a = np.dot(eve1, eve2)
-                b = np.exp(-(amplifying_factor)**2/eva1 - (amplifying_factor)**2/eva2)
-                val_tmp = val_tmp + ((a * b)/c)**2
-                accum_a = accum_a + a
-
-        numerator = 2 * val_tmp
+        weights = np.outer(e1[:n_components], e2[:n_components])
+        numerator = 2 * np.sum(np.square(dpm * weights / c))
 
         return numerator/(denominator)
 
@@ -230,10 +207,11 @@ class PCZsimilarity(BiobbObject):
 
     # Get the dot product matrix of two eigenvectors (squared and normalized).
     # Absolute Similarity Index (Hess 2000, 2002)
-    def dot_product_accum(self, eigenvectors_1, eigenvectors_2):
+    def dot_product_accum(self, eigenvectors_1, eigenvectors_2, dpm=None):
         n_components = len(eigenvectors_1)
         # Get the dot product
-        dpm = self.dot_product(eigenvectors_1, eigenvectors_2)
+        if dpm is None:
+            dpm = self.dot_product(eigenvectors_1, eigenvectors_2)
 
         sso = (dpm * dpm).sum() / n_components
         # sso = (dpm * dpm).sum() / n_components
@@ -241,56 +219,126 @@ class PCZsimilarity(BiobbObject):
 
     # Get the subspace overlap
     # Same as before, but with a square root
-    def get_subspace_overlap(self, eigenvectors_1, eigenvectors_2):
+    def get_subspace_overlap(self, eigenvectors_1, eigenvectors_2, dpm=None):
         # Get the number of eigenvectors
         n_components = len(eigenvectors_1)
         # Get the dot product
-        dpm = self.dot_product(eigenvectors_1, eigenvectors_2)
+        if dpm is None:
+            dpm = self.dot_product(eigenvectors_1, eigenvectors_2)
 
         sso = np.sqrt((dpm * dpm).sum() / n_components)
         # sso = (dpm * dpm).sum() / n_components
         return sso
 
     # Classic RMSip (Root Mean Square Inner Product), gives the same results as the previous function get_subspace_overlap
-    def get_rmsip(self, eigenvectors_1, eigenvectors_2):
-
-        # Get the number of eigenvectors
-        n_components = len(eigenvectors_1)
-
-        accum = 0
-        for pc in range(0, n_components):
-            for pc2 in range(0, n_components):
-                dpm = np.dot(eigenvectors_1[pc], eigenvectors_2[pc2])
-                val = dpm * dpm
-                accum = accum + val
-
-        sso = np.sqrt(accum / n_components)
-        # sso = (dpm * dpm).sum() / n_components
-        return sso
+    def get_rmsip(self, eigenvectors_1, eigenvectors_2, dpm=None):
+        return self.get_subspace_overlap(eigenvectors_1, eigenvectors_2, dpm)
 
     # RWSIP, Root Weighted Square Inner Product. Same as before, but weighted using the eigen values.
     # See Edvin Fuglebakk and others, Measuring and comparing structural fluctuation patterns in large protein datasets,
     # Bioinformatics, Volume 28, Issue 19, October 2012, Pages 2431–2440, https://doi.org/10.1093/bioinformatics/bts445
     def get_rwsip(self,
                   eigenvalues_1, eigenvectors_1,
-                  eigenvalues_2, eigenvectors_2):
+                  eigenvalues_2, eigenvectors_2, dpm=None):
 
         # Get the number of eigenvectors
         n_components = len(eigenvectors_1)
 
-        accum = 0
-        norm = 0
-        for pc in range(0, n_components):
-            for pc2 in range(0, n_components):
-                dpm = np.dot(eigenvectors_1[pc], eigenvectors_2[pc2])
-                val = dpm * dpm * eigenvalues_1[pc] * eigenvalues_2[pc2]
-                accum = accum + val
-            norm = norm + eigenvalues_1[pc] * eigenvalues_2[pc]
+        evals1 = np.asarray(eigenvalues_1, dtype=np.float64)[:n_components]
+        evals2 = np.asarray(eigenvalues_2, dtype=np.float64)[:n_components]
+
+        if dpm is None:
+            dpm = self.dot_product(eigenvectors_1, eigenvectors_2)
+
+        accum = np.sum(dpm * dpm * np.outer(evals1, evals2))
+        norm = np.dot(evals1, evals2)
 
         sso = np.sqrt(accum / norm)
         # sso = (dpm * dpm).sum() / n_components
         return sso
 
+    # Get all the similarity indexes (WCP, RMSip, RWSip and dot product) from a single shared overlap matrix
+    def get_similarity_indexes(self,
+                               eigenvalues_1, eigenvectors_1,
+                               eigenvalues_2, eigenvectors_2, dx=None):
+        dpm = self.dot_product(eigenvectors_1, eigenvectors_2)
+        return {
+            'similarityIndex_WCP': self.eigenmsip(eigenvalues_1, eigenvectors_1, eigenvalues_2, eigenvectors_2, dx, dpm),
+            'similarityIndex_rmsip': self.get_rmsip(eigenvectors_1, eigenvectors_2, dpm),
+            'similarityIndex_rwsip': self.get_rwsip(eigenvalues_1, eigenvectors_1, eigenvalues_2, eigenvectors_2, dpm),
+            'similarityIndex_dotp': self.dot_product_accum(eigenvectors_1, eigenvectors_2, dpm)
+        }
+
+    # Add the similarity indexes (WCP, RMSip, RWSip and dot product) to the info dict
+    def add_similarity_indexes(self, info_dict,
+                               eigenvalues_1, eigenvectors_1,
+                               eigenvalues_2, eigenvectors_2):
+        # simIndex = self.get_similarity_index(eigenvalues_1, eigenvectors_1, eigenvalues_2, eigenvectors_2, self.amplifying_factor)
+        # info_dict['similarityIndex_WCP2'] = float("{:.3f}".format(simIndex))
+        # dotProduct = self.get_subspace_overlap(eigenvectors_1, eigenvectors_2)
+        # info_dict['similarityIndex_rmsip2'] = float("{:.3f}".format(dotProduct))
+        indexes = self.get_similarity_indexes(eigenvalues_1, eigenvectors_1, eigenvalues_2, eigenvectors_2, self.amplifying_factor)
+        for index, value in indexes.items():
+            info_dict[index] = float("{:.3f}".format(value))
+        return info_dict
+
+    # Write the output json file and, if requested, the eigen data of both files to the npz sidecar file.
+    # In compact mode the eigenvalues/eigenvectors are left out of the json file.
+    def write_outputs(self, info_dict, output_json_path,
+                      eigenvalues_1, eigenvectors_1,
+                      eigenvalues_2, eigenvectors_2):
+
+        if self.compact:
+            compact_dict = {'num_evals_1': len(eigenvalues_1), 'num_evals_2': len(eigenvalues_2)}
+            compact_dict.update({key: value for key, value in info_dict.items() if key not in ('evals_1', 'evals_2', 'evecs_1', 'evecs_2')})
+            info_dict = compact_dict
+
+        with open(output_json_path, 'w') as out_file:
+            out_file.write(json.dumps(info_dict, indent=4))
+
+        if self.io_dict["out"].get("output_npz_path"):
+            np.savez(self.io_dict["out"]["output_npz_path"],
+                     evals_1=np.asarray(eigenvalues_1, dtype=np.float64),
+                     evecs_1=np.asarray(eigenvectors_1, dtype=np.float64),
+                     evals_2=np.asarray(eigenvalues_2, dtype=np.float64),
+                     evecs_2=np.asarray(eigenvectors_2, dtype=np.float64))
+
+    # Get all eigenvalues and eigenvectors of a PCZ file in a single decode.
+    # Eigenvectors are returned as a contiguous (n_modes x 3N) array.
+    def get_eigen_native(self, input_pcz_path):
+        pcz = PCZfile(input_pcz_path)
+        eigenvalues = np.array(pcz.evals, dtype=np.float64)
+        eigenvectors = np.ascontiguousarray(pcz.evecs, dtype=np.float64)
+        return eigenvalues, eigenvectors
+
+    def launch_native(self):
+        """Computes the PCA similarity reading both PCZ files in-process, without calling pczdump."""
+
+        fu.log('Reading PCZ files with the native PCZ reader', self.out_log)
+        evals_1, evecs_1 = self.get_eigen_native(self.io_dict["in"]["input_pcz_path1"])
+        evals_2, evecs_2 = self.get_eigen_native(self.io_dict["in"]["input_pcz_path2"])
+
+        num_evals_min = min(len(evals_1), len(evals_2))
+        evecs_1 = evecs_1[:num_evals_min]
+        evecs_2 = evecs_2[:num_evals_min]
+
+        info_dict = {}
+        if not self.compact:
+            info_dict['evals_1'] = evals_1.tolist()
+            info_dict['evals_2'] = evals_2.tolist()
+        info_dict['num_evals_min'] = num_evals_min
+        if not self.compact:
+            info_dict['evecs_1'] = {"pc{}".format(pc + 1): evec.tolist() for pc, evec in enumerate(evecs_1)}
+            info_dict['evecs_2'] = {"pc{}".format(pc + 1): evec.tolist() for pc, evec in enumerate(evecs_2)}
+
+        self.add_similarity_indexes(info_dict, evals_1, evecs_1, evals_2, evecs_2)
+
+        self.write_outputs(info_dict, self.io_dict["out"]["output_json_path"], evals_1, evecs_1, evals_2, evecs_2)
+
+        self.check_arguments(output_files_created=True, raise_exception=False)
+
+        return self.return_code
+
     @launchlogger
     def launch(self):
         """Launches the execution of the FlexServ pcz_similarity module."""
@@ -310,6 +358,9 @@ class PCZsimilarity(BiobbObject):
         #     # Container or remote case
         #     output_json = self.stage_io_dict["out"]["output_json_path"]
 
+        if self.backend == 'native':
+            return self.launch_native()
+
         # Manually creating a Sandbox to avoid issues with input parameters buffer overflow:
         #   Long strings defining a file path makes Fortran or C compiled programs crash if the string
         #   declared is shorter than the input parameter path (string) length.
@@ -438,21 +489,10 @@ class PCZsimilarity(BiobbObject):
                 info_dict['evecs_2'][pc_id] = list_evecs
                 eigenvectors_2.append(list_evecs)
 
-        # simIndex = self.get_similarity_index(info_dict['evals_1'], eigenvectors_1, info_dict['evals_2'], eigenvectors_2, self.amplifying_factor)
-        # info_dict['similarityIndex_WCP2'] = float("{:.3f}".format(simIndex))
-        # dotProduct = self.get_subspace_overlap(eigenvectors_1, eigenvectors_2)
-        # info_dict['similarityIndex_rmsip2'] = float("{:.3f}".format(dotProduct))
-        eigenmsip = self.eigenmsip(info_dict['evals_1'], eigenvectors_1, info_dict['evals_2'], eigenvectors_2, self.amplifying_factor)
-        info_dict['similarityIndex_WCP'] = float("{:.3f}".format(eigenmsip))
-        rmsip = self.get_rmsip(eigenvectors_1, eigenvectors_2)
-        info_dict['similarityIndex_rmsip'] = float("{:.3f}".format(rmsip))
-        rwsip = self.get_rwsip(info_dict['evals_1'], eigenvectors_1, info_dict['evals_2'], eigenvectors_2)
-        info_dict['similarityIndex_rwsip'] = float("{:.3f}".format(rwsip))
-        dotp = self.dot_product_accum(eigenvectors_1, eigenvectors_2)
-        info_dict['similarityIndex_dotp'] = float("{:.3f}".format(dotp))
-
-        with open(PurePath(tmp_folder).joinpath(temp_json), 'w') as out_file:
-            out_file.write(json.dumps(info_dict, indent=4))
+        self.add_similarity_indexes(info_dict, info_dict['evals_1'], eigenvectors_1, info_dict['evals_2'], eigenvectors_2)
+
+        self.write_outputs(info_dict, PurePath(tmp_folder).joinpath(temp_json),
+                           info_dict['evals_1'], eigenvectors_1, info_dict['evals_2'], eigenvectors_2)
 
         # Copy outputs from temporary folder to output path
         shutil.copy2(PurePath(tmp_folder).joinpath(temp_json), PurePath(self.io_dict["out"]["output_json_path"]))
@@ -467,6 +507,7 @@ class PCZsimilarity(BiobbObject):
 
 
 def pcz_similarity(input_pcz_path1: str, input_pcz_path2: str, output_json_path: str,
+                   output_npz_path: Optional[str] = None,
                    properties: Optional[dict] = None, **kwargs) -> int:
     """Create :class:`PCZsimilarity <flexserv.pcasuite.pcz_similarity>`flexserv.pcasuite.PCZsimilarity class and
     execute :meth:`launch() <flexserv.pcasuite.pcz_similarity.launch>` method"""
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+
+"""Module containing the PCZsimilarityMatrix class and the command line interface."""
+from typing import Optional
+import os
+import json
+from pathlib import PurePath
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from biobb_common.tools import file_utils as fu
+from biobb_common.generic.biobb_object import BiobbObject
+from biobb_common.tools.file_utils import launchlogger
+from biobb_flexserv.pcasuite.pcz_similarity import PCZsimilarity
+
+# Per-worker state: metric definitions and eigen-decomposition of every PCZ file
+_similarity = None
+_eigen_cache: list = []
+
+
+def _init_worker(similarity, eigen_cache):
+    global _similarity, _eigen_cache
+    _similarity = similarity
+    _eigen_cache = eigen_cache
+
+
+def _similarity_row(row):
+    """Similarity indexes of the PCZ file in position row against all the PCZ files."""
+    evals_1, evecs_1 = _eigen_cache[row]
+    indexes_row = []
+    for evals_2, evecs_2 in _eigen_cache:
+        num_evals_min = min(len(evals_1), len(evals_2))
+        indexes_row.append(_similarity.get_similarity_indexes(evals_1, evecs_1[:num_evals_min],
+                                                              evals_2, evecs_2[:num_evals_min],
+                                                              _similarity.amplifying_factor))
+    return row, indexes_row
+
+
+class PCZsimilarityMatrix(PCZsimilarity):
+    """
+    | biobb_flexserv PCZsimilarityMatrix
+    | Compute the all-vs-all PCA similarity matrix of a set of compressed PCZ files.
+    | Native implementation based on the PCZsimilarity indexes (WCP, RMSip, RWSip and dot product).
+
+    Args:
+        input_pcz_zip_path (str): Input zip file with the compressed trajectory files to compare. File type: input. `Sample file <https://github.com/bioexcel/biobb_flexserv/raw/master/biobb_flexserv/test/data/pcasuite/pcazip_set.zip>`_. Accepted formats: zip (edam:format_3987).
+        output_json_path (str): Output json file with the PCA Similarity matrices. File type: output. `Sample file <https://github.com/bioexcel/biobb_flexserv/raw/master/biobb_flexserv/test/reference/pcasuite/pcz_similarity_matrix.json>`_. Accepted formats: json (edam:format_3464).
+        properties (dict - Python dictionary object containing the tool parameters, not input/output files):
+            * **amplifying_factor** (*float*) - ("0.0") common displacement (dx) along the different eigenvectors. If 0, the result is the absolute similarity index (dot product). Without it, the WCP factor is taken from the eigenvalues of the row PCZ file and the WCP matrix is not symmetric.
+            * **n_workers** (*int*) - (1) Number of worker processes used to compute the matrix rows (0 means all the available CPUs).
+            * **remove_tmp** (*bool*) - (True) [WF property] Remove temporal files.
+            * **restart** (*bool*) - (False) [WF property] Do not execute if output files exist.
+            * **sandbox_path** (*str*) - ("./") [WF property] Parent path to the sandbox directory.
+
+    Examples:
+        This is a use example of how to use the building block from Python::
+
+            from biobb_flexserv.pcasuite.pcz_similarity_matrix import pcz_similarity_matrix
+            prop = {
+                'n_workers': 4
+            }
+            pcz_similarity_matrix( input_pcz_zip_path='/path/to/pcz_files.zip',
+                    output_json_path='/path/to/pcz_similarity_matrix.json',
+                    properties=prop)
+
+    Info:
+        * wrapped_software:
+            * name: FlexServ PCAsuite
+            * version: >=1.0
+            * license: Apache-2.0
+        * ontology:
+            * name: EDAM
+            * schema: http://edamontology.org/EDAM.owl
+
+    """
+
+    INDEXES = ['similarityIndex_WCP', 'similarityIndex_rmsip', 'similarityIndex_rwsip', 'similarityIndex_dotp']
+
+    def __init__(self, input_pcz_zip_path: str,
+                 output_json_path: str, properties: Optional[dict] = None, **kwargs) -> None:
+
+        properties = properties or {}
+
+        # Call parent class constructor
+        BiobbObject.__init__(self, properties)
+        self.locals_var_dict = locals().copy()
+
+        # Input/Output files
+        self.io_dict = {
+            'in': {'input_pcz_zip_path': input_pcz_zip_path},
+            'out': {'output_json_path': output_json_path}
+        }
+
+        # Properties specific for BB
+        self.properties = properties
+        self.amplifying_factor = properties.get('amplifying_factor')
+        self.n_workers = properties.get('n_workers', 1)
+
+        # Check the properties
+        self.check_properties(properties)
+        self.check_arguments()
+
+    @launchlogger
+    def launch(self):
+        """Launches the execution of the FlexServ pcz_similarity_matrix module."""
+
+        # Setup Biobb
+        if self.check_restart():
+            return 0
+
+        # Creating temporary folder
+        tmp_folder = fu.create_unique_dir()
+        fu.log('Creating %s temporary folder' % tmp_folder, self.out_log)
+
+        pcz_list = sorted(path for path in fu.unzip_list(self.io_dict["in"]["input_pcz_zip_path"], tmp_folder, self.out_log)
+                          if path.endswith('.pcz'))
+        if len(pcz_list) < 2:
+            raise SystemExit('At least two PCZ files are needed to compute a similarity matrix')
+
+        # Decompose every PCZ file only once
+        eigen_cache = [self.get_eigen_native(pcz) for pcz in pcz_list]
+        if len(set(evecs.shape[1] for _, evecs in eigen_cache)) != 1:
+            raise SystemExit('PCZ files with different number of atoms cannot be compared')
+
+        n_files = len(pcz_list)
+        n_workers = self.n_workers or os.cpu_count() or 1
+        n_workers = min(n_workers, n_files)
+        fu.log('Computing %d x %d similarity matrix with %d worker(s)' % (n_files, n_files, n_workers), self.out_log)
+
+        matrices = {index: np.zeros((n_files, n_files)) for index in self.INDEXES}
+
+        def store(row, indexes_row):
+            for col, indexes in enumerate(indexes_row):
+                for index in self.INDEXES:
+                    matrices[index][row, col] = indexes[index]
+
+        if n_workers > 1:
+            with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker,
+                                     initargs=(self, eigen_cache)) as executor:
+                for row, indexes_row in executor.map(_similarity_row, range(n_files)):
+                    store(row, indexes_row)
+        else:
+            _init_worker(self, eigen_cache)
+            for row in range(n_files):
+                store(*_similarity_row(row))
+
+        info_dict = {}
+        info_dict['pcz_files'] = [PurePath(pcz).name for pcz in pcz_list]
+        info_dict['num_evals'] = [len(evals) for evals, _ in eigen_cache]
+        for index in self.INDEXES:
+            info_dict[index] = np.round(matrices[index], 3).tolist()
+
+        with open(self.io_dict["out"]["output_json_path"], 'w') as out_file:
+            out_file.write(json.dumps(info_dict, indent=4))
+
+        # Remove temporary folder(s)
+        self.tmp_files.append(tmp_folder)
+        self.remove_tmp_files()
+
+        self.check_arguments(output_files_created=True, raise_exception=False)
+
+        return self.return_code
+
+
+def pcz_similarity_matrix(input_pcz_zip_path: str, output_json_path: str,
+                          properties: Optional[dict] = None, **kwargs) -> int:
+    """Create :class:`PCZsimilarityMatrix <flexserv.pcasuite.pcz_similarity_matrix>`flexserv.pcasuite.PCZsimilarityMatrix class and
+    execute :meth:`launch() <flexserv.pcasuite.pcz_similarity_matrix.launch>` method"""
+    return PCZsimilarityMatrix(**dict(locals())).launch()
+
+
+pcz_similarity_matrix.__doc__ = PCZsimilarityMatrix.__doc__
+main = PCZsimilarityMatrix.get_main(pcz_similarity_matrix, "Compute the all-vs-all PCA Similarity matrix of a set of compressed PCZ files.")
+
+if __name__ == '__main__':
+    main()
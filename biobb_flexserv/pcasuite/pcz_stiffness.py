@@ -1,14 +1,111 @@
 #!/usr/bin/env python3
 
 """Module containing the PCZstiffness class and the command line interface."""
-from typing import Optional
+from typing import Optional, Sequence, Union
 import shutil
 import json
-import math
 from pathlib import PurePath
+import numpy as np
 from biobb_common.tools import file_utils as fu
 from biobb_common.generic.biobb_object import BiobbObject
 from biobb_common.tools.file_utils import launchlogger
+from biobb_flexserv.pcasuite.pczfile import PCZfile
+
+# Boltzmann constant in kcal/(mol K), as used by pczdump
+BOLTZMANN = 0.0019872041
+
+
+def read_stiffness(input_dat_path) -> np.ndarray:
+    """Stiffness matrix written by pczdump --stiff, one comma separated row per atom, as an (atoms, atoms) array."""
+    with open(input_dat_path) as dat_file:
+        rows = [line.strip() for line in dat_file if line.strip()]
+    values = np.array([value for value in ','.join(rows).split(',') if value], dtype=np.float64)
+    return values.reshape(len(rows), -1)
+
+
+def log_stiffness(stiffness: np.ndarray) -> np.ndarray:
+    """Base 10 logarithm of the nonzero force constants, the zeros are kept."""
+    nonzero = stiffness != 0
+    return np.log10(stiffness, out=np.zeros_like(stiffness), where=nonzero)
+
+
+def stiffness_block_size(natoms: int, memory_budget: float) -> tuple[int, int]:
+    """Number of frames and of atom rows per block so that the temporary distance arrays of the block fit in memory_budget MB.
+
+    A block of frames x rows distances needs the distances, a scratch array of the same size
+    and their sum over the frames. The accumulators and the stiffness matrix are not part of the
+    budget. Below the size of a whole frame the distance matrices are split in blocks of rows.
+    """
+    row_bytes = 8 * natoms
+    rows = int(memory_budget * 1024 * 1024) // row_bytes
+    if rows < 3:
+        raise SystemExit('Memory budget of %g MB is too small for a row of %d distances' % (memory_budget, natoms))
+    if rows >= 3 * natoms:
+        return (rows // natoms - 1) // 2, natoms
+    return 1, rows // 3
+
+
+def distance_variance(pcz: PCZfile, eigenvector: int = 0, memory_budget: float = 0) -> np.ndarray:
+    """Variance of every interatomic distance along the trajectory stored in the PCZ file, as an (atoms, atoms) array.
+
+    The frames are rebuilt from the projections on one eigenvector (or on all of them if eigenvector
+    is 0) and their distances computed in place in blocks of frames and atom rows within memory_budget
+    MB (0: the whole trajectory at once). The distances are accumulated as deviations from the
+    average structure ones, so the variance does not lose precision.
+    """
+    if eigenvector:
+        evecs = np.asarray(pcz.evec(eigenvector), dtype=np.float64)[None, :]
+        projections = pcz.projections[eigenvector - 1:eigenvector]
+    else:
+        evecs = np.asarray(pcz.evecs, dtype=np.float64)
+        projections = pcz.projections
+    average = np.asarray(pcz.average, dtype=np.float64).reshape(-1, 3)
+
+    def distances(rows, coords, out, scratch):
+        """Distances of a (frames, rows, 3) block of atoms to the (frames, atoms, 3) atoms into out, without temporaries."""
+        out.fill(0.0)
+        for dim in range(3):
+            np.subtract(rows[..., :, None, dim], coords[..., None, :, dim], out=scratch)
+            np.multiply(scratch, scratch, out=scratch)
+            out += scratch
+        return np.sqrt(out, out=out)
+
+    natoms = pcz.natoms
+    reference = distances(average, average, np.empty((natoms, natoms)), np.empty((natoms, natoms)))
+    sums = np.zeros_like(reference)
+    squares = np.zeros_like(reference)
+    frames_per_block, rows_per_block = stiffness_block_size(natoms, memory_budget) if memory_budget else (pcz.nframes, natoms)
+    frames_per_block = min(frames_per_block, pcz.nframes)
+    block_distances = np.empty((frames_per_block, rows_per_block, natoms))
+    scratch = np.empty_like(block_distances)
+    frame_sums = np.empty((rows_per_block, natoms))
+    for start in range(0, pcz.nframes, frames_per_block):
+        block = np.matmul(np.asarray(projections[:, start:start + frames_per_block], dtype=np.float64).T, evecs)
+        coords = average + block.reshape(len(block), -1, 3)
+        for row in range(0, natoms, rows_per_block):
+            rows = slice(row, row + rows_per_block)
+            nrows = len(range(natoms)[rows])
+            deviations = distances(coords[:, rows], coords, block_distances[:len(block), :nrows], scratch[:len(block), :nrows])
+            deviations -= reference[rows]
+            sums[rows] += np.sum(deviations, axis=0, out=frame_sums[:nrows])
+            np.multiply(deviations, deviations, out=deviations)
+            squares[rows] += np.sum(deviations, axis=0, out=frame_sums[:nrows])
+    sums /= pcz.nframes
+    return np.maximum(squares / pcz.nframes - sums ** 2, 0)
+
+
+def stiffness_matrix(pcz: PCZfile, eigenvector: int = 0, temperature: Union[float, Sequence[float]] = 300,
+                     memory_budget: float = 0) -> np.ndarray:
+    """Apparent stiffness (kcal/mol/Angstrom^2) between every pair of atoms, as pczdump --stiff computes it.
+
+    The force constant of each pair is kT divided by the variance of its distance. The variances
+    are computed once, so a sequence of temperatures gives a (temperatures, atoms, atoms) array
+    in a single pass over the trajectory. The diagonal, and any rigid pair, is infinite.
+    """
+    variance = distance_variance(pcz, eigenvector, memory_budget)
+    rigid = variance == 0
+    kts = BOLTZMANN * np.asarray(temperature, dtype=np.float64)[..., None, None]
+    return np.divide(kts, variance, out=np.full(kts.shape[:-2] + variance.shape, np.inf), where=~rigid)
 
 
 class PCZstiffness(BiobbObject):
@@ -20,10 +117,15 @@ class PCZstiffness(BiobbObject):
     Args:
         input_pcz_path (str): Input compressed trajectory file. File type: input. `Sample file <https://github.com/bioexcel/biobb_flexserv/raw/master/biobb_flexserv/test/data/pcasuite/pcazip.pcz>`_. Accepted formats: pcz (edam:format_3874).
         output_json_path (str): Output json file with PCA Stiffness. File type: output. `Sample file <https://github.com/bioexcel/biobb_flexserv/raw/master/biobb_flexserv/test/reference/pcasuite/pcz_stiffness.json>`_. Accepted formats: json (edam:format_3464).
+        output_npz_path (str) (Optional): Output NumPy npz file with the stiffness and stiffness_log matrices, or their upper triangles (stiffness_triu, stiffness_log_triu, float32) in packed mode. File type: output. `Sample file <https://github.com/bioexcel/biobb_flexserv/raw/master/biobb_flexserv/test/reference/pcasuite/pcz_stiffness.npz>`_. Accepted formats: npz (edam:format_4003).
         properties (dict - Python dictionary object containing the tool parameters, not input/output files):
             * **binary_path** (*str*) - ("pczdump") pczdump binary path to be used.
             * **eigenvector** (*int*) - (0) PCA mode (eigenvector) from which to extract stiffness.
-            * **temperature** (*int*) - (300) Temperature with which compute the apparent stiffness.
+            * **temperature** (*int*) - (300) Temperature with which compute the apparent stiffness. A single value: several temperatures in one pass are only computed by the stiffness_matrix function.
+            * **compact** (*bool*) - (False) Write only the metadata (number of atoms, eigenvector and temperature) to the output json file, leaving out the stiffness matrices (use output_npz_path to keep them).
+            * **packed** (*bool*) - (False) Write only the upper triangle of the symmetric matrices, without the diagonal, as float32 arrays to the output npz file.
+            * **backend** (*str*) - ("pczdump") Engine used to compute the stiffness: pczdump binary or in-process NumPy computation from the PCZ file (Options: pczdump, native)
+            * **memory_budget** (*int*) - (256) Memory in MB available for the temporary arrays of the native backend, besides the (atoms x atoms) accumulators and stiffness matrix. The frames are rebuilt and their pairwise distances accumulated in blocks of frames and atom rows fitting in it (0: the whole trajectory at once).
             * **remove_tmp** (*bool*) - (True) [WF property] Remove temporal files.
             * **restart** (*bool*) - (False) [WF property] Do not execute if output files exist.
             * **sandbox_path** (*str*) - ("./") [WF property] Parent path to the sandbox directory.
@@ -53,7 +155,8 @@ class PCZstiffness(BiobbObject):
     """
 
     def __init__(self, input_pcz_path: str,
-                 output_json_path: str, properties: Optional[dict] = None, **kwargs) -> None:
+                 output_json_path: str, output_npz_path: Optional[str] = None,
+                 properties: Optional[dict] = None, **kwargs) -> None:
 
         properties = properties or {}
 
@@ -64,7 +167,8 @@ class PCZstiffness(BiobbObject):
         # Input/Output files
         self.io_dict = {
             'in': {'input_pcz_path': input_pcz_path},
-            'out': {'output_json_path': output_json_path}
+            'out': {'output_json_path': output_json_path,
+                    'output_npz_path': output_npz_path}  # type: ignore
         }
 
         # Properties specific for BB
@@ -72,11 +176,52 @@ class PCZstiffness(BiobbObject):
         self.binary_path = properties.get('binary_path', 'pczdump')
         self.eigenvector = properties.get('eigenvector', 0)
         self.temperature = properties.get('temperature', 300)
+        self.compact = properties.get('compact', False)
+        self.packed = properties.get('packed', False)
+        self.backend = properties.get('backend', 'pczdump')
+        self.memory_budget = properties.get('memory_budget', 256)
 
         # Check the properties
         self.check_properties(properties)
         self.check_arguments()
 
+    # Write the output json file and, if requested, the matrices to the npz sidecar file.
+    # In compact mode the matrices are left out of the json file.
+    def write_outputs(self, stiffness, output_json_path):
+
+        stiffness = np.array(stiffness, dtype=np.float64)
+        np.fill_diagonal(stiffness, np.inf)
+        stiffness_log = log_stiffness(stiffness)
+
+        if self.compact:
+            info_dict = {'natoms': len(stiffness), 'eigenvector': self.eigenvector, 'temperature': self.temperature}
+        else:
+            info_dict = {'stiffness': stiffness.tolist(), 'stiffness_log': stiffness_log.tolist()}
+        with open(output_json_path, 'w') as out_file:
+            out_file.write(json.dumps(info_dict, indent=4))
+
+        if self.io_dict["out"].get("output_npz_path"):
+            if self.packed:
+                rows, cols = np.triu_indices(len(stiffness), k=1)
+                np.savez(self.io_dict["out"]["output_npz_path"], natoms=len(stiffness),
+                         stiffness_triu=stiffness[rows, cols].astype(np.float32),
+                         stiffness_log_triu=stiffness_log[rows, cols].astype(np.float32))
+            else:
+                np.savez(self.io_dict["out"]["output_npz_path"], stiffness=stiffness, stiffness_log=stiffness_log)
+
+    def launch_native(self):
+        """Computes the stiffness reading the PCZ file in-process, without calling pczdump."""
+
+        pcz = PCZfile(self.io_dict["in"]["input_pcz_path"])
+        fu.log('Computing the stiffness of %s with the native backend' % self.io_dict["in"]["input_pcz_path"], self.out_log)
+
+        stiffness = stiffness_matrix(pcz, self.eigenvector, self.temperature, self.memory_budget)
+        self.write_outputs(stiffness, self.io_dict["out"]["output_json_path"])
+
+        self.check_arguments(output_files_created=True, raise_exception=False)
+
+        return self.return_code
+
     @launchlogger
     def launch(self):
         """Launches the execution of the FlexServ pcz_stiffness module."""
@@ -96,6 +241,12 @@ class PCZstiffness(BiobbObject):
         #     input_pcz = self.stage_io_dict["in"]["input_pcz_path"]
         #     output_json = self.stage_io_dict["out"]["output_json_path"]
 
+        if np.ndim(self.temperature):
+            raise SystemExit('A single temperature is supported, use stiffness_matrix to compute several temperatures in one pass')
+
+        if self.backend == 'native':
+            return self.launch_native()
+
         # Manually creating a Sandbox to avoid issues with input parameters buffer overflow:
         #   Long strings defining a file path makes Fortran or C compiled programs crash if the string
         #   declared is shorter than the input parameter path (string) length.
@@ -134,31 +285,8 @@ class PCZstiffness(BiobbObject):
         self.run_biobb()
 
         # Parse output stiffness
-        info_dict = {}
-        info_dict['stiffness'] = []
-        info_dict['stiffness_log'] = []
-        row = 0
-        with open(PurePath(tmp_folder).joinpath(temp_out), 'r') as file:
-            for line in file:
-                info = line.strip().split(',')
-                line_array = []
-                line_array_log = []
-                for nums in info:
-                    if nums:
-                        line_array.append(float(nums))
-                        if float(nums) != 0:
-                            line_array_log.append(math.log10(float(nums)))
-                        else:
-                            line_array_log.append(float(nums))
-
-                info_dict['stiffness'].append(line_array)
-                info_dict['stiffness'][row][row] = float('inf')
-                info_dict['stiffness_log'].append(line_array_log)
-                info_dict['stiffness_log'][row][row] = float('inf')
-                row += 1
-
-        with open(PurePath(tmp_folder).joinpath(temp_json), 'w') as out_file:
-            out_file.write(json.dumps(info_dict, indent=4))
+        stiffness = read_stiffness(PurePath(tmp_folder).joinpath(temp_out))
+        self.write_outputs(stiffness, PurePath(tmp_folder).joinpath(temp_json))
 
         # Copy outputs from temporary folder to output path
         shutil.copy2(PurePath(tmp_folder).joinpath(temp_json), PurePath(self.io_dict["out"]["output_json_path"]))
@@ -176,6 +304,7 @@ class PCZstiffness(BiobbObject):
 
 
 def pcz_stiffness(input_pcz_path: str, output_json_path: str,
+                  output_npz_path: Optional[str] = None,
                   properties: Optional[dict] = None, **kwargs) -> int:
     """Create :class:`PCZstiffness <flexserv.pcasuite.pcz_stiffness>`flexserv.pcasuite.PCZstiffness class and
     execute :meth:`launch() <flexserv.pcasuite.pcz_stiffness.launch>` method"""
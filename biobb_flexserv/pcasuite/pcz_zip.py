@@ -7,6 +7,8 @@ from pathlib import PurePath
 from biobb_common.tools import file_utils as fu
 from biobb_common.generic.biobb_object import BiobbObject
 from biobb_common.tools.file_utils import launchlogger
+from biobb_flexserv.flexserv.crdfile import CRDfile
+from biobb_flexserv.pcasuite import pca
 
 
 class PCZzip(BiobbObject):
@@ -25,6 +27,11 @@ class PCZzip(BiobbObject):
             * **variance** (*int*) - (90) Percentage of variance captured by the final set of eigenvectors
             * **verbose** (*bool*) - (False) Make output verbose
             * **gauss_rmsd** (*bool*) - (False) Use a gaussian RMSd for fitting
+            * **gauss_width** (*float*) - (2.0) Native backend: width in Angstrom^2 of the Gaussian weights exp(-d^2 / width) of the atoms deviating d from the reference in the gaussian RMSd fitting. Smaller widths down-weight the flexible regions more. The native Gaussian fitting is not the pcazip -g algorithm, its fitted frames and modes differ from the pcazip ones, and its PCZ files are marked with the Native Gaussian RMSd type (2) instead of the Gaussian RMSd one (1).
+            * **average_iterations** (*int*) - (1) Native backend: number of times the frames are fitted to compute the average structure. The first time they are fitted onto the first frame, as pcazip does, and every further iteration fits them onto the previous average until it converges.
+            * **backend** (*str*) - ("pcazip") Engine used to compress the trajectory: pcazip binary or in-process NumPy PCA (Options: pcazip, native)
+            * **memory_budget** (*int*) - (0) Memory in MB available for the native backend. The trajectory is streamed from disk in blocks of frames fitting in it (0: load the whole trajectory).
+            * **solver** (*str*) - ("full") Eigensolver of the native backend: full diagonalization of the covariance matrix or randomized computation of the leading modes only, without building the matrix. With the randomized solver, the frames are fitted only once and their displacements cached in memory for its passes, spilled to a temporary file beyond the memory budget, and the dimensionality only counts the computed modes (Options: full, randomized)
             * **remove_tmp** (*bool*) - (True) [WF property] Remove temporal files.
             * **restart** (*bool*) - (False) [WF property] Do not execute if output files exist.
             * **sandbox_path** (*str*) - ("./") [WF property] Parent path to the sandbox directory.
@@ -76,11 +83,43 @@ class PCZzip(BiobbObject):
         self.variance = properties.get('variance')
         self.verbose = properties.get('verbose', False)
         self.gauss_rmsd = properties.get('gauss_rmsd', False)
+        self.gauss_width = properties.get('gauss_width', 2.0)
+        self.average_iterations = properties.get('average_iterations', 1)
+        self.backend = properties.get('backend', 'pcazip')
+        self.memory_budget = properties.get('memory_budget', 0)
+        self.solver = properties.get('solver', 'full')
 
         # Check the properties
         self.check_properties(properties)
         self.check_arguments()
 
+    def launch_native(self):
+        """Compresses the trajectory in-process with NumPy, without calling pcazip or copying the inputs to a sandbox."""
+
+        atoms = pca.read_pdb_atoms(self.io_dict["in"]["input_pdb_path"])
+        crd = CRDfile(self.io_dict["in"]["input_crd_path"], natoms=len(atoms))
+        fu.log('Compressing %d frames of %d atoms with the native PCA engine' % (crd.nframes, crd.natoms), self.out_log)
+
+        # Whole trajectory in memory, or streamed in blocks of frames within the memory budget
+        if self.memory_budget:
+            frames_per_block = pca.block_size(crd.natoms, self.memory_budget, self.solver == 'full')
+            fu.log('Streaming the trajectory in blocks of %d frames (%d MB memory budget)' % (frames_per_block, self.memory_budget), self.out_log)
+        else:
+            frames_per_block = crd.nframes
+        whole_trajectory = [crd.read()] if frames_per_block >= crd.nframes else []
+
+        def blocks():
+            return whole_trajectory or crd.iter_chunks(frames_per_block)
+
+        nvecs, explained = pca.compress(blocks, self.io_dict["out"]["output_pcz_path"], atoms, self.neigenv, self.variance,
+                                        self.gauss_rmsd, self.average_iterations, self.solver, memory_budget=self.memory_budget,
+                                        gaussian_width=float(self.gauss_width))
+        fu.log('%d eigenvectors kept, %.2f%% of the total variance' % (nvecs, 100 * explained), self.out_log)
+
+        self.check_arguments(output_files_created=True, raise_exception=False)
+
+        return self.return_code
+
     @launchlogger
     def launch(self):
         """Launches the execution of the FlexServ pcazip module."""
@@ -101,6 +140,9 @@ class PCZzip(BiobbObject):
         #     input_crd = self.stage_io_dict["in"]["input_crd_path"]
         #     output_pcz = self.stage_io_dict["out"]["output_pcz_path"]
 
+        if self.backend == 'native':
+            return self.launch_native()
+
         # Manually creating a Sandbox to avoid issues with input parameters buffer overflow:
         #   Long strings defining a file path makes Fortran or C compiled programs crash if the string
         #   declared is shorter than the input parameter path (string) length.
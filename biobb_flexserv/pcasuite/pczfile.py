@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+
+"""Module containing the PCZfile class and the write_pcz function, native I/O for PCAsuite compressed (PCZ) files."""
+import struct
+from typing import Optional
+import numpy as np
+
+
+class PCZfile:
+    """
+    | biobb_flexserv PCZfile
+    | Native reader for compressed PCZ trajectories generated by the pcazip tool from the PCAsuite FlexServ module.
+    | Decodes header, eigenvalues, eigenvectors, average structure and projections directly into NumPy arrays.
+
+    The float section of the file is memory-mapped, so eigenvectors and projections are
+    only read from disk when they are accessed.
+
+    PCZ4 layout (little endian):
+
+        * Header: "PCZ4" (4 bytes), title (80 bytes), atoms, frames, vectors (3 x int32), total variance and explained variance (2 x float32), dimensionality, RMSd type, have atom names (3 x int32).
+        * Atom names (only if have atom names): atom number (int32), atom name (4 bytes), residue number (int32), residue name and chain (4 bytes).
+        * Average structure: 3 x atoms float32.
+        * One record per vector: eigenvector (3 x atoms float32), eigenvalue (float32), projections (frames float32).
+
+    Args:
+        input_pcz_path (str): Input compressed trajectory file.
+        mmap (bool): (True) Memory-map the float section of the file instead of reading it into memory.
+    """
+
+    HEADER_FORMAT = '<4s80s3i2f3i'
+    HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+    ATOM_DTYPE = np.dtype([('atom_num', '<i4'), ('atom_name', 'S4'),
+                           ('res_num', '<i4'), ('res_name', 'S3'), ('chain', 'S1')])
+    # 2 marks the Gaussian fitting of the native backend, not the pcazip -g one
+    RMSD_TYPES = {0: 'Standard RMSd', 1: 'Gaussian RMSd', 2: 'Native Gaussian RMSd'}
+
+    def __init__(self, input_pcz_path: str, mmap: bool = True) -> None:
+        self.input_pcz_path = input_pcz_path
+
+        with open(input_pcz_path, 'rb') as pcz_file:
+            header = pcz_file.read(self.HEADER_SIZE)
+        if len(header) < self.HEADER_SIZE:
+            raise ValueError('%s is not a valid PCZ file: truncated header' % input_pcz_path)
+
+        (version, title, self.natoms, self.nframes, self.nvecs,
+         self.total_variance, self.explained_variance,
+         self.dimensionality, self.rmsd_type, have_atom_names) = struct.unpack(self.HEADER_FORMAT, header)
+
+        self.version = version.decode('ascii', errors='replace')
+        if self.version != 'PCZ4':
+            raise ValueError('Unsupported PCZ format %s in %s (only PCZ4 is supported)' % (self.version, input_pcz_path))
+        self.title = title.split(b'\x00')[0].decode('ascii', errors='replace').strip()
+        self.have_atom_names = bool(have_atom_names)
+
+        offset = self.HEADER_SIZE
+        self.atoms: Optional[np.ndarray] = None
+        if self.have_atom_names:
+            self.atoms = np.fromfile(input_pcz_path, dtype=self.ATOM_DTYPE, count=self.natoms, offset=offset)
+            offset += self.natoms * self.ATOM_DTYPE.itemsize
+
+        # Average structure followed by one record (evec, eval, projections) per vector
+        self.record_size = 3 * self.natoms + 1 + self.nframes
+        n_floats = 3 * self.natoms + self.nvecs * self.record_size
+        data: np.ndarray
+        if mmap:
+            data = np.memmap(input_pcz_path, dtype='<f4', mode='r', offset=offset, shape=(n_floats,))
+        else:
+            data = np.fromfile(input_pcz_path, dtype='<f4', count=n_floats, offset=offset)
+        if data.size != n_floats:
+            raise ValueError('%s is not a valid PCZ file: truncated data section' % input_pcz_path)
+
+        self.average = data[:3 * self.natoms]
+        self._records = data[3 * self.natoms:].reshape(self.nvecs, self.record_size)
+
+    @property
+    def evecs(self) -> np.ndarray:
+        """Eigenvectors as a (vectors, 3 x atoms) array, in decreasing eigenvalue order."""
+        return self._records[:, :3 * self.natoms]
+
+    @property
+    def evals(self) -> np.ndarray:
+        """Eigenvalues as a (vectors,) array, in decreasing order."""
+        return self._records[:, 3 * self.natoms]
+
+    @property
+    def projections(self) -> np.ndarray:
+        """Projections of every frame on every eigenvector as a (vectors, frames) array."""
+        return self._records[:, 3 * self.natoms + 1:]
+
+    @property
+    def quality(self) -> float:
+        """Percentage of the total variance explained by the stored eigenvectors."""
+        return 100 * self.explained_variance / self.total_variance
+
+    @property
+    def rmsd_type_name(self) -> str:
+        return self.RMSD_TYPES.get(self.rmsd_type, 'Unknown RMSd')
+
+    def evec(self, eigenvector: int) -> np.ndarray:
+        """Eigenvector of the given PCA mode (1-based, as in pczdump)."""
+        if not 1 <= eigenvector <= self.nvecs:
+            raise ValueError('Eigenvector %d out of range (1-%d)' % (eigenvector, self.nvecs))
+        return self.evecs[eigenvector - 1]
+
+    def info(self) -> dict:
+        """PCA info with the same keys and formatting as pczdump --info."""
+        return {
+            'Title': self.title,
+            'Atoms': str(self.natoms),
+            'Vectors': str(self.nvecs),
+            'Frames': str(self.nframes),
+            'Total_variance': '%.2f' % self.total_variance,
+            'Explained_variance': '%.2f' % self.explained_variance,
+            'Quality': '%.2f%%' % self.quality,
+            'Dimensionality': str(self.dimensionality),
+            'RMSd_type': self.rmsd_type_name,
+            'Have_atom_names': str(self.have_atom_names)
+        }
+
+
+def write_pcz(output_pcz_path: str, average: np.ndarray, evals: np.ndarray, evecs: np.ndarray, projections: np.ndarray,
+              total_variance: float, dimensionality: int, atoms: Optional[np.ndarray] = None,
+              title: str = '', rmsd_type: int = 0) -> None:
+    """Write a PCZ4 compressed trajectory readable by pcaunzip and pczdump.
+
+    Args:
+        output_pcz_path (str): Output compressed trajectory file.
+        average (np.ndarray): Average structure, 3 x atoms values.
+        evals (np.ndarray): Eigenvalues of the stored vectors, in decreasing order.
+        evecs (np.ndarray): Eigenvectors as a (vectors, 3 x atoms) array.
+        projections (np.ndarray): Projections of every frame on every eigenvector as a (vectors, frames) array.
+        total_variance (float): Total variance of the trajectory.
+        dimensionality (int): Dimensionality of the trajectory.
+        atoms (np.ndarray): (None) Atom records with the PCZfile.ATOM_DTYPE layout.
+        title (str): ('') Title of the compressed trajectory.
+        rmsd_type (int): (0) RMSd used to fit the frames (0: Standard RMSd, 1: Gaussian RMSd of pcazip -g, 2: Native Gaussian RMSd).
+    """
+    evecs = np.asarray(evecs, dtype='<f4')
+    nvecs, ncoords = evecs.shape
+    nframes = np.shape(projections)[1]
+    header = struct.pack(PCZfile.HEADER_FORMAT, b'PCZ4', title.encode('ascii')[:80], ncoords // 3, nframes, nvecs,
+                         total_variance, float(np.sum(evals)), dimensionality, rmsd_type, atoms is not None)
+
+    records = np.empty((nvecs, ncoords + 1 + nframes), dtype='<f4')
+    records[:, :ncoords] = evecs
+    records[:, ncoords] = evals
+    records[:, ncoords + 1:] = projections
+
+    with open(output_pcz_path, 'wb') as pcz_file:
+        pcz_file.write(header)
+        if atoms is not None:
+            pcz_file.write(np.asarray(atoms, dtype=PCZfile.ATOM_DTYPE).tobytes())
+        pcz_file.write(np.asarray(average, dtype='<f4').tobytes())
+        pcz_file.write(records.tobytes())
@@ -1,6 +1,12 @@
 # type: ignore
+import numpy as np
 from biobb_common.tools import test_fixtures as fx
 from biobb_flexserv.flexserv.bd_run import bd_run
+from biobb_flexserv.flexserv.crdfile import CRDfile
+from biobb_flexserv.flexserv.nma import read_ca_coords
+from biobb_flexserv.pcasuite import pca
+from biobb_flexserv.pcasuite.pczfile import PCZfile
+from biobb_flexserv.pcasuite.fitting import center, fit, rmsd
 
 
 class TestBDRun():
@@ -17,3 +23,94 @@ class TestBDRun():
         assert fx.not_empty(self.paths['output_log_path'])
         assert fx.equal(self.paths['output_crd_path'], self.paths['ref_output_crd_path'])
         assert fx.equal(self.paths['output_log_path'], self.paths['ref_output_log_path'])
+
+
+class TestBDRunNative():
+    def setup_class(self):
+        fx.test_setup(self, 'bd_run_native')
+
+    def teardown_class(self):
+        fx.test_teardown(self)
+        # pass
+
+    def test_bd_run_native(self):
+        bd_run(properties=self.properties, **self.paths)
+        assert fx.not_empty(self.paths['output_crd_path'])
+        assert fx.equal(self.paths['output_log_path'], self.paths['ref_output_log_path'])
+        coords = center(read_ca_coords(self.paths['input_pdb_path']))
+        trajectory = CRDfile(self.paths['output_crd_path'], natoms=len(coords)).read()
+        assert trajectory.shape == (100, len(coords), 3)
+        # The elastic network keeps the structure close to the initial one
+        assert np.all(rmsd(fit(trajectory.astype(np.float64), coords), coords) < 4.0)
+
+
+class TestBDRunReplicas():
+    def setup_class(self):
+        fx.test_setup(self, 'bd_run_replicas')
+
+    def teardown_class(self):
+        fx.test_teardown(self)
+        # pass
+
+    def test_bd_run_replicas(self):
+        bd_run(properties=self.properties, **self.paths)
+        assert fx.not_empty(self.paths['output_crd_path'])
+        assert fx.not_empty(self.paths['output_log_path'])
+        assert fx.equal(self.paths['output_index_path'], self.paths['ref_output_index_path'])
+        natoms = len(read_ca_coords(self.paths['input_pdb_path']))
+        ensemble = CRDfile(self.paths['output_crd_path'], natoms=natoms).read()
+        assert ensemble.shape == (60, natoms, 3)
+        # Every replica is the single run of its seed
+        single_crd_path = self.paths['output_crd_path'].replace('.crd', '_single.crd')
+        bd_run(input_pdb_path=self.paths['input_pdb_path'], output_log_path=self.paths['output_log_path'],
+               output_crd_path=single_crd_path, properties=dict(self.properties, seed=2, replicas=1))
+        assert np.array_equal(CRDfile(single_crd_path, natoms=natoms).read(), ensemble[20:40])
+
+
+class TestBDRunPCZ():
+    def setup_class(self):
+        fx.test_setup(self, 'bd_run_pcz')
+
+    def teardown_class(self):
+        fx.test_teardown(self)
+        # pass
+
+    def test_bd_run_pcz(self):
+        bd_run(properties=self.properties, **self.paths)
+        assert fx.not_empty(self.paths['output_pcz_path'])
+        assert fx.not_empty(self.paths['output_log_path'])
+        pcz = PCZfile(self.paths['output_pcz_path'])
+        assert (pcz.nvecs, pcz.nframes) == (5, 20)
+        # Same compression as the CRD ensemble of the same seed
+        crd_path = self.paths['output_pcz_path'].replace('.pcz', '.crd')
+        ref_pcz_path = self.paths['output_pcz_path'].replace('.pcz', '_ref.pcz')
+        bd_run(input_pdb_path=self.paths['input_pdb_path'], output_log_path=self.paths['output_log_path'],
+               output_crd_path=crd_path, properties=self.properties)
+        trajectory = CRDfile(crd_path, natoms=pcz.natoms)
+        pca.compress(lambda: [trajectory.read()], ref_pcz_path, neigenv=5)
+        assert np.allclose(pcz.evals, PCZfile(ref_pcz_path).evals, rtol=1e-3)
+
+
+class TestBDRunCheckpoint():
+    def setup_class(self):
+        fx.test_setup(self, 'bd_run_checkpoint')
+
+    def teardown_class(self):
+        fx.test_teardown(self)
+        # pass
+
+    def test_bd_run_checkpoint(self):
+        # First half, then frames written after the last checkpoint by a killed job
+        bd_run(properties=dict(self.properties, time=1000), **self.paths)
+        assert fx.not_empty(self.paths['output_checkpoint_path'])
+        for path in (self.paths['output_crd_path'], self.paths['output_log_path']):
+            with open(path, 'a') as output_file:
+                output_file.write('   1.000   2.000   3.000\n')
+        # Resumed up to the full simulation time
+        bd_run(properties=self.properties, **self.paths)
+        single_crd_path = self.paths['output_crd_path'].replace('.crd', '_single.crd')
+        single_log_path = self.paths['output_log_path'].replace('.log', '_single.log')
+        bd_run(input_pdb_path=self.paths['input_pdb_path'], output_log_path=single_log_path, output_crd_path=single_crd_path,
+               properties={key: value for key, value in self.properties.items() if key not in ('checkpoint_freq', 'resume')})
+        assert fx.equal(self.paths['output_crd_path'], single_crd_path)
+        assert fx.equal(self.paths['output_log_path'], single_log_path)
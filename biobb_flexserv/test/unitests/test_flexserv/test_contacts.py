@@ -0,0 +1,28 @@
+# type: ignore
+import numpy as np
+from biobb_common.tools import test_fixtures as fx
+from biobb_flexserv.flexserv.contacts import Contacts
+from biobb_flexserv.flexserv.nma import read_ca_coords
+
+
+class TestContacts():
+    def setup_class(self):
+        fx.test_setup(self, 'contacts')
+
+    def teardown_class(self):
+        fx.test_teardown(self)
+        # pass
+
+    def test_contacts(self):
+        coords = read_ca_coords(self.paths['input_pdb_path'])
+        distances = np.linalg.norm(coords[:, np.newaxis] - coords[np.newaxis], axis=-1)
+        first, second = np.nonzero(np.triu(distances < 12.0, k=1))
+
+        contacts = Contacts(coords, 12.0)
+        assert len(contacts) == 784
+        assert np.array_equal(contacts.first, first)
+        assert np.array_equal(contacts.second, second)
+        assert np.allclose(contacts.distances, distances[first, second])
+        assert np.array_equal(contacts.neighbours(0), second[first == 0])
+        # Go contacts of the DMD runner, without the consecutive CA atoms
+        assert len(Contacts(coords, 8.0, min_separation=2)) == 250
@@ -0,0 +1,32 @@
+# type: ignore
+import numpy as np
+import pytest
+from biobb_common.tools import test_fixtures as fx
+from biobb_flexserv.flexserv.crdfile import CRDfile, format_fields, write_crd
+
+
+class TestCRDfile():
+    def setup_class(self):
+        fx.test_setup(self, 'crdfile')
+
+    def teardown_class(self):
+        fx.test_teardown(self)
+        # pass
+
+    def test_crdfile(self):
+        crd = CRDfile(self.paths['input_crd_path'])
+        coords = crd.read()
+        assert coords.shape == (1001, 85, 3)
+        assert np.array_equal(crd[10:100:9], coords[10:100:9])
+        assert np.array_equal(crd[-1], coords[-1])
+        write_crd(self.paths['output_crd_path'], coords, title=crd.title)
+        assert fx.not_empty(self.paths['output_crd_path'])
+        assert fx.equal(self.paths['output_crd_path'], self.paths['ref_output_crd_path'])
+
+    def test_crdfile_not_finite(self):
+        assert bytes(format_fields(np.array([-1.5, 123.4567]))) == b'  -1.500 123.457'
+        for value in (np.nan, np.inf, -np.inf):
+            with pytest.raises(ValueError, match='NaN or infinite'):
+                write_crd(self.paths['output_crd_path'], np.array([[[1.0, 2.0, value]]]))
+            with pytest.raises(ValueError, match='NaN or infinite'):
+                format_fields(np.array([1.0, value]))
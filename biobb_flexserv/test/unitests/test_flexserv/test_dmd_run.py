@@ -1,6 +1,12 @@
 # type: ignore
+import os
+import numpy as np
 from biobb_common.tools import test_fixtures as fx
 from biobb_flexserv.flexserv.dmd_run import dmd_run
+from biobb_flexserv.flexserv.crdfile import CRDfile
+from biobb_flexserv.flexserv.nma import read_ca_coords
+from biobb_flexserv.pcasuite.pczfile import PCZfile
+from biobb_flexserv.pcasuite.fitting import center, fit, rmsd
 
 
 class TestDMDRun():
@@ -16,3 +22,112 @@ class TestDMDRun():
         assert fx.not_empty(self.paths['output_crd_path'])
         assert fx.equal(self.paths['output_crd_path'], self.paths['ref_output_crd_path'])
         # assert fx.equal(self.paths['output_log_path'], self.paths['ref_output_log_path']) # Log file differs at every run
+
+
+class TestDMDRunNative():
+    def setup_class(self):
+        fx.test_setup(self, 'dmd_run_native')
+
+    def teardown_class(self):
+        fx.test_teardown(self)
+        # pass
+
+    def test_dmd_run_native(self):
+        dmd_run(properties=self.properties, **self.paths)
+        assert fx.not_empty(self.paths['output_crd_path'])
+        assert fx.not_empty(self.paths['output_log_path'])
+        coords = center(read_ca_coords(self.paths['input_pdb_path']))
+        trajectory = CRDfile(self.paths['output_crd_path'], natoms=len(coords)).read().astype(np.float64)
+        reference = CRDfile(self.paths['ref_output_crd_path'], natoms=len(coords)).read().astype(np.float64)
+        assert trajectory.shape == reference.shape
+        assert np.allclose(trajectory[0], coords, atol=1e-3)
+        # Same dynamics as dmdgoopt: RMSF profile and RMSd to the native structure of the fitted trajectories
+        fitted, fitted_reference = fit(trajectory, coords), fit(reference, coords)
+        rmsf = np.sqrt(np.sum((fitted - fitted.mean(axis=0)) ** 2, axis=-1).mean(axis=0))
+        rmsf_reference = np.sqrt(np.sum((fitted_reference - fitted_reference.mean(axis=0)) ** 2, axis=-1).mean(axis=0))
+        assert np.isclose(rmsf.mean(), rmsf_reference.mean(), rtol=0.35)
+        assert np.corrcoef(rmsf, rmsf_reference)[0, 1] > 0.7
+        assert np.isclose(rmsd(fitted, coords).mean(), rmsd(fitted_reference, coords).mean(), rtol=0.25)
+        # Consecutive atoms stay bonded out of their wells
+        bonds = np.linalg.norm(trajectory[:, 1:] - trajectory[:, :-1], axis=-1) / np.linalg.norm(coords[1:] - coords[:-1], axis=-1)
+        assert np.all(np.abs(bonds - 1) < 0.3 + 1e-3)
+
+    def test_dmd_run_native_no_frames(self):
+        # Only the starting structure, the engine returns without processing any event
+        dmd_run(properties=dict(self.properties, frames=0), **self.paths)
+        coords = center(read_ca_coords(self.paths['input_pdb_path']))
+        trajectory = CRDfile(self.paths['output_crd_path'], natoms=len(coords)).read()
+        assert trajectory.shape == (1, len(coords), 3)
+
+
+class TestDMDRunReplicas():
+    def setup_class(self):
+        fx.test_setup(self, 'dmd_run_replicas')
+
+    def teardown_class(self):
+        fx.test_teardown(self)
+        # pass
+
+    def test_dmd_run_replicas(self):
+        dmd_run(properties=self.properties, **self.paths)
+        assert fx.not_empty(self.paths['output_crd_path'])
+        assert fx.not_empty(self.paths['output_log_path'])
+        assert fx.equal(self.paths['output_index_path'], self.paths['ref_output_index_path'])
+        natoms = len(read_ca_coords(self.paths['input_pdb_path']))
+        ensemble = CRDfile(self.paths['output_crd_path'], natoms=natoms).read()
+        assert ensemble.shape == (33, natoms, 3)
+        # Every replica is the single run of its seed, starting from the structure
+        single_crd_path = self.paths['output_crd_path'].replace('.crd', '_single.crd')
+        dmd_run(input_pdb_path=self.paths['input_pdb_path'], output_log_path=self.paths['output_log_path'],
+                output_crd_path=single_crd_path, properties=dict(self.properties, seed=2, replicas=1))
+        assert np.array_equal(CRDfile(single_crd_path, natoms=natoms).read(), ensemble[11:22])
+
+
+class TestDMDRunCheckpoint():
+    def setup_class(self):
+        fx.test_setup(self, 'dmd_run_checkpoint')
+
+    def teardown_class(self):
+        fx.test_teardown(self)
+        # pass
+
+    def test_dmd_run_checkpoint(self):
+        # First half, then frames written after the last checkpoint by a killed job
+        dmd_run(properties=dict(self.properties, frames=10), **self.paths)
+        assert fx.not_empty(self.paths['output_checkpoint_path'])
+        with open(self.paths['output_crd_path'], 'a') as crd_file:
+            crd_file.write('   1.000   2.000   3.000\n')
+        # Resumed up to the full number of frames
+        dmd_run(properties=self.properties, **self.paths)
+        natoms = len(read_ca_coords(self.paths['input_pdb_path']))
+        trajectory = CRDfile(self.paths['output_crd_path'], natoms=natoms).read()
+        single_crd_path = self.paths['output_crd_path'].replace('.crd', '_single.crd')
+        dmd_run(input_pdb_path=self.paths['input_pdb_path'], output_log_path=self.paths['output_log_path'], output_crd_path=single_crd_path,
+                properties={key: value for key, value in self.properties.items() if key not in ('checkpoint_freq', 'resume')})
+        assert trajectory.shape == (21, natoms, 3)
+        assert np.allclose(trajectory, CRDfile(single_crd_path, natoms=natoms).read(), atol=2e-3)
+
+    def test_dmd_run_checkpoint_complete(self):
+        # Resuming a complete simulation leaves the outputs as they are
+        paths = dict(self.paths, output_crd_path=self.paths['output_crd_path'].replace('.crd', '_complete.crd'),
+                     output_checkpoint_path=self.paths['output_checkpoint_path'].replace('.chk', '_complete.chk'))
+        properties = dict(self.properties, frames=3, checkpoint_freq=1)
+        dmd_run(properties=properties, **paths)
+        with open(paths['output_crd_path']) as crd_file:
+            complete_crd = crd_file.read()
+        dmd_run(properties=properties, **paths)
+        with open(paths['output_crd_path']) as crd_file:
+            assert crd_file.read() == complete_crd
+
+    def test_dmd_run_checkpoint_pcz(self):
+        # Fused mode: the spilled frames are rewound to the checkpoint too
+        paths = dict(self.paths, output_crd_path=None, output_pcz_path=self.paths['output_crd_path'].replace('.crd', '.pcz'),
+                     output_checkpoint_path=self.paths['output_checkpoint_path'].replace('.chk', '_pcz.chk'))
+        dmd_run(properties=dict(self.properties, frames=10), **paths)
+        frames_path = paths['output_checkpoint_path'] + '.frames'
+        with open(frames_path, 'ab') as frames_file:
+            frames_file.write(b'\0' * 12)
+        dmd_run(properties=self.properties, **paths)
+        natoms = len(read_ca_coords(self.paths['input_pdb_path']))
+        assert os.path.getsize(frames_path) == 21 * natoms * 3 * 4
+        assert PCZfile(paths['output_pcz_path']).nframes == 21
@@ -1,6 +1,12 @@
 # type: ignore
+import json
+import pytest
+import numpy as np
 from biobb_common.tools import test_fixtures as fx
 from biobb_flexserv.flexserv.nma_run import nma_run
+from biobb_flexserv.flexserv import nma
+from biobb_flexserv.flexserv.crdfile import CRDfile
+from biobb_flexserv.pcasuite.pczfile import PCZfile
 
 
 class TestNMARun():
@@ -16,3 +22,92 @@ class TestNMARun():
         assert fx.not_empty(self.paths['output_crd_path'])
         assert fx.equal(self.paths['output_crd_path'], self.paths['ref_output_crd_path'])
         # assert fx.equal(self.paths['output_log_path'], self.paths['ref_output_log_path'])
+
+
+class TestNMARunNative():
+    def setup_class(self):
+        fx.test_setup(self, 'nma_run_native')
+
+    def teardown_class(self):
+        fx.test_teardown(self)
+        # pass
+
+    def test_nma_run_native(self):
+        nma_run(properties=self.properties, **self.paths)
+        assert fx.not_empty(self.paths['output_crd_path'])
+        assert fx.not_empty(self.paths['output_log_path'])
+        coords = nma.read_ca_coords(self.paths['input_pdb_path'])
+        ensemble = CRDfile(self.paths['output_crd_path'], natoms=len(coords)).read()
+        assert ensemble.shape == (100, len(coords), 3)
+        with open(self.paths['output_metrics_path']) as metrics_file:
+            metrics = json.load(metrics_file)
+        assert (metrics['status'], metrics['frames'], metrics['total_frames']) == ('finished', 100, 100)
+        # Frames only move along the requested normal modes
+        _, evecs = nma.normal_modes(nma.kovacs_hessian(coords))
+        projections = np.matmul((ensemble - coords).reshape(100, -1), evecs.T)
+        assert np.allclose(projections[:, 50:], 0, atol=1e-2)
+        # The frames are reconstructed from the output projections
+        assert np.allclose(np.load(self.paths['output_proj_path']), projections[:, :50], atol=1e-2)
+
+
+class TestNMARunPCZ():
+    def setup_class(self):
+        fx.test_setup(self, 'nma_run_pcz')
+
+    def teardown_class(self):
+        fx.test_teardown(self)
+        # pass
+
+    def test_nma_run_pcz(self):
+        nma_run(properties=self.properties, **self.paths)
+        assert fx.not_empty(self.paths['output_pcz_path'])
+        assert fx.not_empty(self.paths['output_log_path'])
+        coords = nma.read_ca_coords(self.paths['input_pdb_path'])
+        pcz = PCZfile(self.paths['output_pcz_path'])
+        assert pcz.nframes == 100
+        assert np.allclose(pcz.average, coords.ravel(), atol=1e-3)
+        # The modes are stored with their harmonic variance kT / eigenvalue, the softest first
+        evals, _ = nma.normal_modes(nma.kovacs_hessian(coords), 50)
+        variances = nma.KB * 300 / evals
+        assert np.allclose(pcz.evals, variances[:pcz.nvecs], rtol=1e-5)
+        assert pcz.quality >= 80 > 100 * variances[:pcz.nvecs - 1].sum() / variances.sum()
+
+
+class TestNMARunSparse():
+    def setup_class(self):
+        fx.test_setup(self, 'nma_run_sparse')
+
+    def teardown_class(self):
+        fx.test_teardown(self)
+        # pass
+
+    def test_nma_run_sparse(self):
+        pytest.importorskip('scipy')
+        nma_run(properties=self.properties, **self.paths)
+        assert fx.not_empty(self.paths['output_crd_path'])
+        assert fx.not_empty(self.paths['output_log_path'])
+        # Same modes as the dense Hessian with the same cutoff
+        coords = nma.read_ca_coords(self.paths['input_pdb_path'])
+        sparse_evals, sparse_evecs = nma.sparse_normal_modes(nma.kovacs_sparse_hessian(coords, 12.0), 20)
+        dense_evals, dense_evecs = nma.normal_modes(nma.kovacs_hessian(coords, cutoff=12.0), 20)
+        assert np.allclose(sparse_evals, dense_evals)
+        assert np.allclose(np.abs(np.sum(sparse_evecs * dense_evecs, axis=1)), 1)
+
+
+class TestNMARunCutoff():
+    def setup_class(self):
+        fx.test_setup(self, 'nma_run_cutoff')
+
+    def teardown_class(self):
+        fx.test_teardown(self)
+        # pass
+
+    def test_nma_run_cutoff(self):
+        # The 8 A cutoff leaves the elastic network with extra zero modes
+        with pytest.raises(SystemExit, match='cutoff of 8 A disconnects'):
+            nma_run(properties=self.properties, **self.paths)
+
+    def test_nma_run_cutoff_sparse(self):
+        pytest.importorskip('scipy')
+        with pytest.raises(SystemExit, match='cutoff of 8 A disconnects'):
+            nma_run(properties=dict(self.properties, solver='sparse'), **self.paths)
@@ -0,0 +1,31 @@
+# type: ignore
+import json
+from biobb_common.tools import test_fixtures as fx
+from biobb_flexserv.flexserv.crdfile import CRDfile, CRDWriter
+from biobb_flexserv.flexserv.progress import ProgressMonitor, crd_frames
+
+
+class TestProgress():
+    def setup_class(self):
+        fx.test_setup(self, 'progress')
+
+    def teardown_class(self):
+        fx.test_teardown(self)
+        # pass
+
+    def test_progress(self):
+        trajectory = CRDfile(self.paths['input_crd_path'])
+        with ProgressMonitor(100, interval=0.01, outputs=[self.paths['output_crd_path']],
+                             output_metrics_path=self.paths['output_metrics_path'],
+                             poll_crd_path=self.paths['output_crd_path'], natoms=trajectory.natoms) as monitor:
+            with CRDWriter(self.paths['output_crd_path'], trajectory.natoms, title=trajectory.title, buffer_size=10) as writer:
+                for frame in trajectory[:95]:
+                    writer.write(frame)
+                # Only the flushed frames are complete
+                assert crd_frames(self.paths['output_crd_path'], trajectory.natoms) == 90
+            assert monitor.metrics()['total_frames'] == 100
+        with open(self.paths['output_metrics_path']) as metrics_file:
+            metrics = json.load(metrics_file)
+        assert metrics['status'] == 'finished'
+        assert metrics['frames'] == 95
+        assert metrics['output_size_bytes'] > 0
@@ -1,6 +1,10 @@
 # type: ignore
+import numpy as np
 from biobb_common.tools import test_fixtures as fx
 from biobb_flexserv.pcasuite.pcz_zip import pcz_zip
+from biobb_flexserv.pcasuite.pczfile import PCZfile
+from biobb_flexserv.pcasuite import fitting
+from biobb_flexserv.flexserv.crdfile import CRDfile
 
 
 class TestPCZzip():
@@ -15,3 +19,98 @@ class TestPCZzip():
         pcz_zip(properties=self.properties, **self.paths)
         assert fx.not_empty(self.paths['output_pcz_path'])
         assert fx.equal(self.paths['output_pcz_path'], self.paths['ref_output_pcz_path'])
+
+
+class TestPCZzipNative():
+    def setup_class(self):
+        fx.test_setup(self, 'pcz_zip_native')
+
+    def teardown_class(self):
+        fx.test_teardown(self)
+        # pass
+
+    def test_pczzip_native(self):
+        pcz_zip(properties=self.properties, **self.paths)
+        assert fx.not_empty(self.paths['output_pcz_path'])
+        pcz = PCZfile(self.paths['output_pcz_path'])
+        ref = PCZfile(self.paths['ref_output_pcz_path'])
+        assert pcz.info() == ref.info()
+        assert np.array_equal(pcz.atoms, ref.atoms)
+        assert np.allclose(pcz.average, ref.average, atol=1e-3)
+        assert np.allclose(pcz.evals, ref.evals, rtol=1e-5)
+        # Eigenvectors are defined up to their sign
+        signs = np.sign(np.sum(pcz.evecs * ref.evecs, axis=1))[:, np.newaxis]
+        assert np.allclose(pcz.evecs * signs, ref.evecs, atol=1e-5)
+        assert np.allclose(pcz.projections * signs, ref.projections, atol=1e-3)
+
+
+class TestPCZzipStreaming():
+    def setup_class(self):
+        fx.test_setup(self, 'pcz_zip_streaming')
+
+    def teardown_class(self):
+        fx.test_teardown(self)
+        # pass
+
+    def test_pczzip_streaming(self):
+        pcz_zip(properties=self.properties, **self.paths)
+        assert fx.not_empty(self.paths['output_pcz_path'])
+        pcz = PCZfile(self.paths['output_pcz_path'])
+        ref = PCZfile(self.paths['ref_output_pcz_path'])
+        assert pcz.info() == ref.info()
+        assert np.array_equal(pcz.atoms, ref.atoms)
+        assert np.allclose(pcz.average, ref.average, atol=1e-3)
+        assert np.allclose(pcz.evals, ref.evals, rtol=1e-5)
+        # Eigenvectors are defined up to their sign
+        signs = np.sign(np.sum(pcz.evecs * ref.evecs, axis=1))[:, np.newaxis]
+        assert np.allclose(pcz.evecs * signs, ref.evecs, atol=1e-5)
+        assert np.allclose(pcz.projections * signs, ref.projections, atol=1e-3)
+
+
+class TestPCZzipRandomized():
+    def setup_class(self):
+        fx.test_setup(self, 'pcz_zip_randomized')
+
+    def teardown_class(self):
+        fx.test_teardown(self)
+        # pass
+
+    def test_pczzip_randomized(self):
+        pcz_zip(properties=self.properties, **self.paths)
+        assert fx.not_empty(self.paths['output_pcz_path'])
+        pcz = PCZfile(self.paths['output_pcz_path'])
+        ref = PCZfile(self.paths['ref_output_pcz_path'])
+        # Dimensionality is only counted over the computed modes
+        info, ref_info = pcz.info(), ref.info()
+        info.pop('Dimensionality')
+        ref_info.pop('Dimensionality')
+        assert info == ref_info
+        assert np.allclose(pcz.evals, ref.evals, rtol=1e-5)
+        assert np.allclose(np.abs(np.sum(pcz.evecs * ref.evecs, axis=1)), 1, atol=1e-4)
+
+
+class TestPCZzipGaussian():
+    def setup_class(self):
+        fx.test_setup(self, 'pcz_zip_gaussian')
+
+    def teardown_class(self):
+        fx.test_teardown(self)
+        # pass
+
+    def test_pczzip_gaussian(self):
+        pcz_zip(properties=self.properties, **self.paths)
+        assert fx.not_empty(self.paths['output_pcz_path'])
+        pcz = PCZfile(self.paths['output_pcz_path'])
+        # Not the pcazip -g fitting, marked as such in the header
+        assert (pcz.rmsd_type, pcz.rmsd_type_name) == (2, 'Native Gaussian RMSd')
+        assert pcz.nvecs == 5
+        assert np.all(np.diff(pcz.evals) <= 0)
+        assert np.allclose(np.matmul(pcz.evecs, pcz.evecs.T), np.identity(5), atol=1e-5)
+        assert np.allclose(np.mean(pcz.projections ** 2, axis=1), pcz.evals, rtol=1e-4)
+
+    def test_pczzip_gaussian_width(self):
+        coords = CRDfile(self.paths['input_crd_path'], natoms=85).read()[:50].astype(np.float64)
+        reference = fitting.center(coords[0])
+        # Very wide Gaussian weights are uniform, narrow ones move the superposition away from the least-squares one
+        assert np.allclose(fitting.gaussian_fit(coords, reference, width=1e9), fitting.fit(coords, reference), atol=1e-6)
+        assert not np.allclose(fitting.gaussian_fit(coords, reference, width=0.5), fitting.fit(coords, reference), atol=1e-2)
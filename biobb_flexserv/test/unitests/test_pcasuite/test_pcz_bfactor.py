@@ -1,6 +1,9 @@
 # type: ignore
+import numpy as np
 from biobb_common.tools import test_fixtures as fx
 from biobb_flexserv.pcasuite.pcz_bfactor import pcz_bfactor
+from biobb_flexserv.pcasuite.pczfile import PCZfile
+from biobb_flexserv.flexserv.crdfile import CRDfile
 
 
 class TestPCZbfactor():
@@ -17,3 +20,42 @@ class TestPCZbfactor():
         assert fx.not_empty(self.paths['output_pdb_path'])
         assert fx.equal(self.paths['output_dat_path'], self.paths['ref_output_dat_path'])
         assert fx.equal(self.paths['output_pdb_path'], self.paths['ref_output_pdb_path'])
+
+
+class TestPCZbfactorNative():
+    def setup_class(self):
+        fx.test_setup(self, 'pcz_bfactor_native')
+
+    def teardown_class(self):
+        fx.test_teardown(self)
+        # pass
+
+    def test_pcz_bfactor_native(self):
+        pcz_bfactor(properties=self.properties, **self.paths)
+        assert fx.not_empty(self.paths['output_dat_path'])
+        assert fx.not_empty(self.paths['output_pdb_path'])
+        assert fx.equal(self.paths['output_dat_path'], self.paths['ref_output_dat_path'])
+        assert fx.equal(self.paths['output_pdb_path'], self.paths['ref_output_pdb_path'])
+
+
+class TestPCZbfactorAllModes():
+    def setup_class(self):
+        fx.test_setup(self, 'pcz_bfactor_all_modes')
+
+    def teardown_class(self):
+        fx.test_teardown(self)
+        # pass
+
+    def test_pcz_bfactor_all_modes(self):
+        pcz_bfactor(properties=self.properties, **self.paths)
+        assert fx.not_empty(self.paths['output_dat_path'])
+        assert fx.not_empty(self.paths['output_pdb_path'])
+        assert fx.equal(self.paths['output_pdb_path'], self.paths['ref_output_pdb_path'])
+        table = np.loadtxt(self.paths['output_dat_path'])
+        assert table.shape == (85, 8)
+        assert np.allclose(table[:, 1], np.loadtxt(self.paths['ref_output_dat_path']), atol=1e-6)
+        # All the modes together: 8 pi^2 / 3 x mean square fluctuation of the trajectory uncompressed by pcaunzip
+        pcz = PCZfile(self.paths['input_pcz_path'])
+        trajectory = CRDfile(self.paths['ref_output_crd_path'], natoms=pcz.natoms).read().astype(np.float64)
+        fluctuations = np.sum((trajectory - np.asarray(pcz.average, dtype=np.float64).reshape(-1, 3)) ** 2, axis=-1).mean(axis=0)
+        assert np.allclose(table[:, 0], 8 * np.pi ** 2 / 3 * fluctuations, rtol=1e-3)
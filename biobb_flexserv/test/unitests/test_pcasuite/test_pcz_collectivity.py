@@ -1,4 +1,6 @@
 # type: ignore
+import json
+import numpy as np
 from biobb_common.tools import test_fixtures as fx
 from biobb_flexserv.pcasuite.pcz_collectivity import pcz_collectivity
 
@@ -15,3 +17,19 @@ class TestPCZcollectivity():
         pcz_collectivity(properties=self.properties, **self.paths)
         assert fx.not_empty(self.paths['output_json_path'])
         assert fx.equal(self.paths['output_json_path'], self.paths['ref_output_json_path'])
+
+
+class TestPCZcollectivityNative():
+    def setup_class(self):
+        fx.test_setup(self, 'pcz_collectivity_native')
+
+    def teardown_class(self):
+        fx.test_teardown(self)
+        # pass
+
+    def test_pcz_collectivity_native(self):
+        pcz_collectivity(properties=self.properties, **self.paths)
+        assert fx.not_empty(self.paths['output_json_path'])
+        # pczdump accumulates in single precision, the last printed digit may differ
+        with open(self.paths['output_json_path']) as json_file, open(self.paths['ref_output_json_path']) as ref_file:
+            assert np.allclose(json.load(json_file)['collectivity'], json.load(ref_file)['collectivity'], atol=2e-6)
@@ -15,3 +15,17 @@ class TestPCZevecs():
         pcz_evecs(properties=self.properties, **self.paths)
         assert fx.not_empty(self.paths['output_json_path'])
         assert fx.equal(self.paths['output_json_path'], self.paths['ref_output_json_path'])
+
+
+class TestPCZevecsNative():
+    def setup_class(self):
+        fx.test_setup(self, 'pcz_evecs_native')
+
+    def teardown_class(self):
+        fx.test_teardown(self)
+        # pass
+
+    def test_pcz_evecs_native(self):
+        pcz_evecs(properties=self.properties, **self.paths)
+        assert fx.not_empty(self.paths['output_json_path'])
+        assert fx.equal(self.paths['output_json_path'], self.paths['ref_output_json_path'])
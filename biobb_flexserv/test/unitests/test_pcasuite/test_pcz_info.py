@@ -15,3 +15,17 @@ class TestPCZinfo():
         pcz_info(properties=self.properties, **self.paths)
         assert fx.not_empty(self.paths['output_json_path'])
         assert fx.equal(self.paths['output_json_path'], self.paths['ref_output_json_path'])
+
+
+class TestPCZinfoNative():
+    def setup_class(self):
+        fx.test_setup(self, 'pcz_info_native')
+
+    def teardown_class(self):
+        fx.test_teardown(self)
+        # pass
+
+    def test_pcz_info_native(self):
+        pcz_info(properties=self.properties, **self.paths)
+        assert fx.not_empty(self.paths['output_json_path'])
+        assert fx.equal(self.paths['output_json_path'], self.paths['ref_output_json_path'])
@@ -1,4 +1,6 @@
 # type: ignore
+import json
+import pytest
 from biobb_common.tools import test_fixtures as fx
 from biobb_flexserv.pcasuite.pcz_lindemann import pcz_lindemann
 
@@ -15,3 +17,26 @@ class TestPCZlindemann():
         pcz_lindemann(properties=self.properties, **self.paths)
         assert fx.not_empty(self.paths['output_json_path'])
         assert fx.equal(self.paths['output_json_path'], self.paths['ref_output_json_path'])
+
+
+class TestPCZlindemannNative():
+    def setup_class(self):
+        fx.test_setup(self, 'pcz_lindemann_native')
+
+    def teardown_class(self):
+        fx.test_teardown(self)
+        # pass
+
+    def test_pcz_lindemann_native(self):
+        pcz_lindemann(properties=self.properties, **self.paths)
+        assert fx.not_empty(self.paths['output_json_path'])
+        with open(self.paths['output_json_path']) as json_file:
+            info = json.load(json_file)
+        with open(self.paths['ref_output_json_path']) as json_file:
+            reference = json.load(json_file)
+        # The pczdump reference has two decimals
+        assert info['lindemann'] == pytest.approx(reference['lindemann'], abs=5e-3)
+        assert list(info['masks']) == self.properties['masks']
+        # The first mask selects every residue of the structure
+        assert info['masks'][':2-86'] == pytest.approx(info['lindemann'])
+        assert all(value > 0 for value in info['masks'].values())
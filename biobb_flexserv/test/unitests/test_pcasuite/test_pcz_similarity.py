@@ -1,4 +1,6 @@
 # type: ignore
+import json
+import numpy as np
 from biobb_common.tools import test_fixtures as fx
 from biobb_flexserv.pcasuite.pcz_similarity import pcz_similarity
 
@@ -15,3 +17,42 @@ class TestPCZsimilarity():
         pcz_similarity(properties=self.properties, **self.paths)
         assert fx.not_empty(self.paths['output_json_path'])
         assert fx.equal(self.paths['output_json_path'], self.paths['ref_output_json_path'])
+
+
+class TestPCZsimilarityNative():
+    def setup_class(self):
+        fx.test_setup(self, 'pcz_similarity_native')
+
+    def teardown_class(self):
+        fx.test_teardown(self)
+        # pass
+
+    def test_pcz_similarity_native(self):
+        pcz_similarity(properties=self.properties, **self.paths)
+        assert fx.not_empty(self.paths['output_json_path'])
+        # Native eigenvectors are not rounded to the 3 decimals of the pczdump text output, compare only the indexes
+        with open(self.paths['output_json_path']) as out_file, open(self.paths['ref_output_json_path']) as ref_file:
+            out_dict = json.load(out_file)
+            ref_dict = json.load(ref_file)
+        for index in ['similarityIndex_WCP', 'similarityIndex_rmsip', 'similarityIndex_rwsip', 'similarityIndex_dotp']:
+            assert out_dict[index] == ref_dict[index]
+        assert out_dict['num_evals_min'] == ref_dict['num_evals_min']
+
+
+class TestPCZsimilarityCompact():
+    def setup_class(self):
+        fx.test_setup(self, 'pcz_similarity_compact')
+
+    def teardown_class(self):
+        fx.test_teardown(self)
+        # pass
+
+    def test_pcz_similarity_compact(self):
+        pcz_similarity(properties=self.properties, **self.paths)
+        assert fx.not_empty(self.paths['output_json_path'])
+        assert fx.not_empty(self.paths['output_npz_path'])
+        assert fx.equal(self.paths['output_json_path'], self.paths['ref_output_json_path'])
+        with np.load(self.paths['output_npz_path']) as out_npz, np.load(self.paths['ref_output_npz_path']) as ref_npz:
+            assert sorted(out_npz.files) == sorted(ref_npz.files)
+            for key in ['evals_1', 'evals_2', 'evecs_1', 'evecs_2']:
+                assert np.allclose(out_npz[key], ref_npz[key])
@@ -0,0 +1,47 @@
+# type: ignore
+import json
+import zipfile
+from pathlib import Path
+import numpy as np
+from biobb_common.tools import test_fixtures as fx
+from biobb_flexserv.pcasuite.pcz_similarity import pcz_similarity
+from biobb_flexserv.pcasuite.pcz_similarity_matrix import pcz_similarity_matrix, PCZsimilarityMatrix
+
+
+class TestPCZsimilarityMatrix():
+    def setup_class(self):
+        fx.test_setup(self, 'pcz_similarity_matrix')
+
+    def teardown_class(self):
+        fx.test_teardown(self)
+        # pass
+
+    def test_pcz_similarity_matrix(self):
+        pcz_similarity_matrix(properties=self.properties, **self.paths)
+        assert fx.not_empty(self.paths['output_json_path'])
+        assert fx.equal(self.paths['output_json_path'], self.paths['ref_output_json_path'])
+        with open(self.paths['output_json_path']) as out_file:
+            out_dict = json.load(out_file)
+        assert len(out_dict['pcz_files']) >= 3
+
+        # Every entry is the pairwise similarity of its two PCZ files
+        pcz_dir = Path(self.paths['output_json_path']).parent
+        with zipfile.ZipFile(self.paths['input_pcz_zip_path']) as zip_file:
+            zip_file.extractall(pcz_dir)
+        for row, pcz_1 in enumerate(out_dict['pcz_files']):
+            for col, pcz_2 in enumerate(out_dict['pcz_files']):
+                pair_json_path = str(pcz_dir.joinpath('pair_%d_%d.json' % (row, col)))
+                pcz_similarity(input_pcz_path1=str(pcz_dir.joinpath(pcz_1)), input_pcz_path2=str(pcz_dir.joinpath(pcz_2)),
+                               output_json_path=pair_json_path,
+                               properties={'backend': 'native', 'amplifying_factor': self.properties['amplifying_factor']})
+                with open(pair_json_path) as pair_file:
+                    pair_dict = json.load(pair_file)
+                for index in PCZsimilarityMatrix.INDEXES:
+                    assert out_dict[index][row][col] == pair_dict[index]
+
+        for index in PCZsimilarityMatrix.INDEXES:
+            matrix = np.array(out_dict[index])
+            assert np.array_equal(matrix, matrix.T)
+            assert np.all(np.diag(matrix) == 1.0)
+            # Distinct trajectories
+            assert np.all(matrix[~np.eye(len(matrix), dtype=bool)] < 1.0)
@@ -1,6 +1,10 @@
 # type: ignore
+import json
+import numpy as np
+import pytest
 from biobb_common.tools import test_fixtures as fx
-from biobb_flexserv.pcasuite.pcz_stiffness import pcz_stiffness
+from biobb_flexserv.pcasuite.pcz_stiffness import pcz_stiffness, distance_variance, stiffness_block_size
+from biobb_flexserv.pcasuite.pczfile import PCZfile
 
 
 class TestPCZstiffness():
@@ -15,3 +19,51 @@ class TestPCZstiffness():
         pcz_stiffness(properties=self.properties, **self.paths)
         assert fx.not_empty(self.paths['output_json_path'])
         # assert fx.equal(self.paths['output_json_path'], self.paths['ref_output_json_path'])
+
+
+class TestPCZstiffnessCompact():
+    def setup_class(self):
+        fx.test_setup(self, 'pcz_stiffness_compact')
+
+    def teardown_class(self):
+        fx.test_teardown(self)
+        # pass
+
+    def test_pcz_stiffness_compact(self):
+        pcz_stiffness(properties=self.properties, **self.paths)
+        assert fx.not_empty(self.paths['output_json_path'])
+        assert fx.not_empty(self.paths['output_npz_path'])
+        with open(self.paths['output_json_path']) as json_file:
+            assert json.load(json_file) == {'natoms': 85, 'eigenvector': 0, 'temperature': 300}
+        packed = np.load(self.paths['output_npz_path'])
+        reference = np.load(self.paths['ref_output_npz_path'])
+        rows, cols = np.triu_indices(int(packed['natoms']), k=1)
+        assert np.allclose(packed['stiffness_triu'], reference['stiffness'][rows, cols], rtol=1e-3)
+        assert np.allclose(packed['stiffness_log_triu'], reference['stiffness_log'][rows, cols], atol=1e-3)
+
+
+class TestPCZstiffnessNative():
+    def setup_class(self):
+        fx.test_setup(self, 'pcz_stiffness_native')
+
+    def teardown_class(self):
+        fx.test_teardown(self)
+        # pass
+
+    def test_pcz_stiffness_native(self):
+        pcz_stiffness(properties=self.properties, **self.paths)
+        assert fx.not_empty(self.paths['output_json_path'])
+        assert fx.not_empty(self.paths['output_npz_path'])
+        native = np.load(self.paths['output_npz_path'])
+        reference = np.load(self.paths['ref_output_npz_path'])
+        assert np.allclose(native['stiffness'], reference['stiffness'], rtol=2e-3)
+
+    def test_pcz_stiffness_row_blocks(self):
+        # Budgets below a whole frame of distances split the matrix in blocks of rows
+        pcz = PCZfile(self.paths['input_pcz_path'])
+        assert stiffness_block_size(pcz.natoms, 0.01) == (1, 5)
+        assert np.allclose(distance_variance(pcz, memory_budget=0.01), distance_variance(pcz))
+
+    def test_pcz_stiffness_temperatures(self):
+        with pytest.raises(SystemExit, match='single temperature'):
+            pcz_stiffness(properties=dict(self.properties, temperature=[300, 310]), **self.paths)
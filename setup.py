@@ -37,7 +37,8 @@ setuptools.setup(
             "pcz_info = biobb_flexserv.pcasuite.pcz_info:main",
             "pcz_lindemann = biobb_flexserv.pcasuite.pcz_lindemann:main",
             "pcz_stiffness = biobb_flexserv.pcasuite.pcz_stiffness:main",
-            "pcz_similarity = biobb_flexserv.pcasuite.pcz_similarity:main"
+            "pcz_similarity = biobb_flexserv.pcasuite.pcz_similarity:main",
+            "pcz_similarity_matrix = biobb_flexserv.pcasuite.pcz_similarity_matrix:main"
         ]
     },
     classifiers=[